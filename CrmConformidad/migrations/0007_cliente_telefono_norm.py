@@ -0,0 +1,96 @@
+# Generated by Django 5.2.5 on 2026-10-18 15:55
+
+from django.db import migrations, models
+
+
+def normaliza_tel_mx(raw):
+    # copia de Digitales.models.normaliza_tel_mx al momento de esta migración:
+    # las migraciones no importan código de la app, que puede cambiar después
+    digits = "".join(c for c in str(raw or "") if c.isdigit())
+    if not digits:
+        return ""
+    if len(digits) == 10:
+        return "52" + digits
+    if len(digits) == 12 and digits.startswith("52"):
+        return digits
+    return digits
+
+
+# `clientes` no la administra Django (Cliente es managed=False): la columna y
+# su índice se agregan con SQL explícito, solo si la tabla existe en esta BD
+# (en la de pruebas no está). El DEFAULT lleva nombre para poder quitarlo en
+# el reverse. EXEC difiere la compilación hasta saber que la tabla existe.
+AGREGAR_COLUMNA = """
+IF OBJECT_ID(N'clientes', N'U') IS NOT NULL AND COL_LENGTH(N'clientes', N'telefono_norm') IS NULL
+    EXEC(N'ALTER TABLE clientes ADD telefono_norm nvarchar(32) NOT NULL
+          CONSTRAINT DF_clientes_telefono_norm DEFAULT ''''')
+"""
+QUITAR_COLUMNA = """
+IF COL_LENGTH(N'clientes', N'telefono_norm') IS NOT NULL
+    EXEC(N'ALTER TABLE clientes DROP CONSTRAINT DF_clientes_telefono_norm;
+          ALTER TABLE clientes DROP COLUMN telefono_norm')
+"""
+CREAR_INDICE = """
+IF COL_LENGTH(N'clientes', N'telefono_norm') IS NOT NULL
+   AND NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = N'clientes_telefono_norm_idx' AND object_id = OBJECT_ID(N'clientes'))
+    EXEC(N'CREATE INDEX clientes_telefono_norm_idx ON clientes (telefono_norm)')
+"""
+QUITAR_INDICE = """
+IF EXISTS (SELECT 1 FROM sys.indexes WHERE name = N'clientes_telefono_norm_idx' AND object_id = OBJECT_ID(N'clientes'))
+    EXEC(N'DROP INDEX clientes_telefono_norm_idx ON clientes')
+"""
+
+
+class RunSQLServer(migrations.RunSQL):
+    """RunSQL que solo corre en SQL Server, la BD donde vive `clientes`."""
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == "microsoft":
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == "microsoft":
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+def llenar_telefono_norm(apps, schema_editor):
+    Cliente = apps.get_model("CrmConformidad", "Cliente")
+    tabla = Cliente._meta.db_table
+    if tabla not in schema_editor.connection.introspection.table_names():
+        return
+    with schema_editor.connection.cursor() as cursor:
+        columnas = {c.name for c in schema_editor.connection.introspection.get_table_description(cursor, tabla)}
+    if "telefono_norm" not in columnas:
+        return
+
+    lote = []
+    for c in Cliente.objects.only("id_cliente", "telefono").iterator(chunk_size=2000):
+        c.telefono_norm = normaliza_tel_mx(c.telefono)
+        lote.append(c)
+        if len(lote) >= 500:
+            Cliente.objects.bulk_update(lote, ["telefono_norm"])
+            lote = []
+    if lote:
+        Cliente.objects.bulk_update(lote, ["telefono_norm"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('CrmConformidad', '0006_alter_expedienteconformidad_options'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddField(
+                    model_name='cliente',
+                    name='telefono_norm',
+                    field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=32),
+                ),
+            ],
+        ),
+        RunSQLServer(AGREGAR_COLUMNA, QUITAR_COLUMNA),
+        RunSQLServer(CREAR_INDICE, QUITAR_INDICE),
+        migrations.RunPython(llenar_telefono_norm, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,7 @@
 from django.db import models
 
+from ryrback.telefonos import TelefonoNormMixin
+
 
 class Rol(models.Model):
     id_rol = models.AutoField(primary_key=True)
@@ -38,12 +40,14 @@ class Usuario(models.Model):
     def is_anonymous(self):
         return False
 
-class Cliente(models.Model):
+class Cliente(TelefonoNormMixin, models.Model):
     id_cliente = models.AutoField(primary_key=True)
     chasis = models.CharField(max_length=255)
     nombre = models.CharField(max_length=50)
     apellidos = models.CharField(max_length=70)
     telefono = models.CharField(max_length=20)
+    # columna agregada por la migración 0007 (la tabla no la administra Django)
+    telefono_norm = models.CharField(max_length=32, blank=True, default="", db_index=True, editable=False)
     correo = models.EmailField(max_length=255)
     os_exp = models.IntegerField()
     agencia = models.CharField(max_length=100)
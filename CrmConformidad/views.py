@@ -14,6 +14,11 @@ from .serializers import UsuarioRegisterSerializer,UsuarioLoginSerializer, gener
 from .models import Usuario, Rol
 from .authentication import SignedUserAuthentication
 from .permissions import IsAdminRole
+from django.conf import settings
+from Digitales.subidas import MB, usar_subida_en_disco
+
+# tope por documento del expediente (MB)
+DOCS_MAX_MB = int(getattr(settings, "CRM_DOCS_MAX_MB", 50))
 
 class CasoListCreateView(generics.ListCreateAPIView):
     queryset = ExpedienteConformidad.objects.select_related("cliente").prefetch_related("documentos").order_by("-id_exp")
@@ -38,9 +43,16 @@ class CasoDetailView(generics.RetrieveUpdateDestroyAPIView):
 class CasoUploadDocsView(generics.GenericAPIView):
     parser_classes = [MultiPartParser, FormParser]
 
+    def initial(self, request, *args, **kwargs):
+        # antes de autenticar: el check de CSRF podría parsear el body
+        self.limite = usar_subida_en_disco(request, limites={}, defecto=DOCS_MAX_MB * MB)
+        super().initial(request, *args, **kwargs)
+
     def post(self, request, id_exp):
         exp = get_object_or_404(ExpedienteConformidad, id_exp=id_exp)
         files = request.FILES.getlist("files")
+        if not files and self.limite.rechazados:
+            return Response({"detail": "Archivos demasiado grandes", "rechazados": self.limite.rechazados}, status=status.HTTP_400_BAD_REQUEST)
         created = []
         for f in files:
             doc = ExpedienteDocumento.objects.create(
@@ -0,0 +1,331 @@
+# digitales/busqueda.py
+"""
+Búsqueda de prospectos y mensajes sobre un índice FTS5 local (SQLite).
+
+El índice es un archivo aparte (como el del limitador): se llena de forma
+incremental desde la BD principal, clientes por `actualizado` y mensajes por
+id, así que puede borrarse y reconstruirse cuando sea (`indexar_busqueda
+--rehacer`). El tokenizador unicode61 con remove_diacritics ignora acentos
+y mayúsculas ("garcia" encuentra "García"); los fragmentos de teléfono se
+buscan aparte con LIKE sobre una tabla chica.
+
+Solo `manage.py indexar_busqueda --continuo` escribe el índice (un proceso
+por máquina); las vistas solo lo leen. Los borrados no dejan rastro que
+sincronizar: cada PURGA_SEGUNDOS la sincronización compara los ids del
+índice contra la BD y quita los que ya no existen.
+"""
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from django.conf import settings
+
+from .models import ClientesDigitales, MensajeWhatsApp
+
+logger = logging.getLogger(__name__)
+
+RUTA = Path(getattr(settings, "WHATSAPP_BUSQUEDA_DB", Path(getattr(settings, "WHATSAPP_SPOOL_DIR", "spool")) / "busqueda.sqlite3"))
+LOTE = int(getattr(settings, "WHATSAPP_BUSQUEDA_LOTE", 2000))
+INTERVALO = float(getattr(settings, "WHATSAPP_BUSQUEDA_INTERVALO", 15))
+# las filas no aparecen en la BD en orden estricto de id / actualizado
+# (transacciones que confirman tarde): cada pasada vuelve a ver un poco atrás
+TRASLAPE_IDS = 500
+TRASLAPE_SEGUNDOS = 120
+PURGA_SEGUNDOS = int(getattr(settings, "WHATSAPP_BUSQUEDA_PURGA", 3600))
+# ids por consulta al comparar contra la BD (SQL Server admite ~2100 parámetros)
+PURGA_LOTE = 1000
+
+VERSION = 1
+TOKENIZER = "unicode61 remove_diacritics 2"
+# pesos bm25 de clientes: nombre, correo, auto_interes, comentarios
+PESOS_CLIENTES = (10.0, 4.0, 3.0, 1.0)
+MAX_TERMINOS = 8
+MAX_CANDIDATOS = int(getattr(settings, "WHATSAPP_BUSQUEDA_CANDIDATOS", 2000))
+
+_TERMINO = re.compile(r"\w+", re.UNICODE)
+
+_local = threading.local()
+
+
+def _conexion() -> sqlite3.Connection:
+    # por hilo y por proceso: una conexión heredada de un fork no se reutiliza
+    clave = (os.getpid(), str(RUTA))
+    con = getattr(_local, "con", None)
+    if con is None or _local.clave != clave:
+        RUTA.parent.mkdir(parents=True, exist_ok=True)
+        con = sqlite3.connect(str(RUTA), timeout=10, isolation_level=None)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        if con.execute("PRAGMA user_version").fetchone()[0] != VERSION:
+            # índice de otra versión del esquema: se tira y la sincronización lo rehace
+            for tabla in ("clientes", "mensajes", "telefonos", "estado"):
+                con.execute(f"DROP TABLE IF EXISTS {tabla}")
+            con.execute(f"PRAGMA user_version = {VERSION}")
+        con.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS clientes USING fts5("
+            f" nombre, correo, auto_interes, comentarios, tokenize='{TOKENIZER}', prefix='2 3')"
+        )
+        con.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS mensajes USING fts5("
+            f" body, chat, tokenize='{TOKENIZER}', prefix='2 3')"
+        )
+        con.execute("CREATE TABLE IF NOT EXISTS telefonos (cliente_id INTEGER PRIMARY KEY, telefono TEXT NOT NULL)")
+        con.execute("CREATE TABLE IF NOT EXISTS estado (clave TEXT PRIMARY KEY, valor TEXT NOT NULL)")
+        _local.con, _local.clave = con, clave
+    return con
+
+
+def _leer_estado(con, clave: str, defecto=None):
+    fila = con.execute("SELECT valor FROM estado WHERE clave = ?", (clave,)).fetchone()
+    return json.loads(fila[0]) if fila else defecto
+
+
+def _guardar_estado(con, clave: str, valor):
+    con.execute("INSERT OR REPLACE INTO estado (clave, valor) VALUES (?, ?)", (clave, json.dumps(valor)))
+
+
+def _escribir(fn):
+    con = _conexion()
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        resultado = fn(con)
+        con.execute("COMMIT")
+        return resultado
+    except BaseException:
+        con.execute("ROLLBACK")
+        raise
+
+
+# --- indexado ---------------------------------------------------------------
+
+def _indexar_clientes(con, clientes: list[dict]):
+    ids = [(c["id"],) for c in clientes]
+    con.executemany("DELETE FROM clientes WHERE rowid = ?", ids)
+    con.executemany(
+        "INSERT INTO clientes (rowid, nombre, correo, auto_interes, comentarios) VALUES (?, ?, ?, ?, ?)",
+        [(c["id"], c["nombre"], c["correo"], c["auto_interes"], c["comentarios"]) for c in clientes],
+    )
+    con.executemany(
+        "INSERT OR REPLACE INTO telefonos (cliente_id, telefono) VALUES (?, ?)",
+        [(c["id"], c["telefono"]) for c in clientes],
+    )
+
+
+def _chat(cliente_id) -> str:
+    # el cliente va como término indexado para filtrar por chat dentro del MATCH
+    return f"c{cliente_id}" if cliente_id else ""
+
+
+def _indexar_mensajes(con, mensajes: list[dict]):
+    con.executemany("DELETE FROM mensajes WHERE rowid = ?", [(m["id"],) for m in mensajes])
+    con.executemany(
+        "INSERT INTO mensajes (rowid, body, chat) VALUES (?, ?, ?)",
+        [(m["id"], m["body"], _chat(m["cliente_id"])) for m in mensajes if (m["body"] or "").strip()],
+    )
+
+
+def sincronizar_clientes() -> int:
+    con = _conexion()
+    marca = _leer_estado(con, "clientes_actualizado")
+    qs = ClientesDigitales.objects.order_by("actualizado", "id")
+    if marca:
+        qs = qs.filter(actualizado__gte=datetime.fromisoformat(marca) - timedelta(seconds=TRASLAPE_SEGUNDOS))
+
+    total = 0
+    ultimo = None
+    lote = []
+    campos = ("id", "telefono", "nombre", "correo", "auto_interes", "comentarios", "actualizado")
+    for c in qs.values(*campos).iterator(chunk_size=LOTE):
+        lote.append(c)
+        if len(lote) >= LOTE:
+            _escribir(lambda con, lote=lote: _indexar_clientes(con, lote))
+            total += len(lote)
+            ultimo = lote[-1]["actualizado"]
+            lote = []
+    if lote:
+        _escribir(lambda con: _indexar_clientes(con, lote))
+        total += len(lote)
+        ultimo = lote[-1]["actualizado"]
+
+    if ultimo is not None:
+        _escribir(lambda con: _guardar_estado(con, "clientes_actualizado", ultimo.isoformat()))
+    return total
+
+
+def sincronizar_mensajes() -> int:
+    con = _conexion()
+    desde = max(0, int(_leer_estado(con, "mensajes_id", 0)) - TRASLAPE_IDS)
+    total = 0
+    while True:
+        lote = list(
+            MensajeWhatsApp.objects
+            .filter(pk__gt=desde)
+            .order_by("id")
+            .values("id", "body", "cliente_id")[:LOTE]
+        )
+        if not lote:
+            return total
+        desde = lote[-1]["id"]
+
+        def fn(con, lote=lote, desde=desde):
+            _indexar_mensajes(con, lote)
+            if desde > _leer_estado(con, "mensajes_id", 0):
+                _guardar_estado(con, "mensajes_id", desde)
+
+        _escribir(fn)
+        total += len(lote)
+
+
+def reindexar_mensaje(msg: MensajeWhatsApp):
+    """Para ediciones: los mensajes se sincronizan por id y no verían el cambio."""
+    try:
+        _escribir(lambda con: _indexar_mensajes(con, [{"id": msg.pk, "body": msg.body, "cliente_id": msg.cliente_id}]))
+    except sqlite3.Error:
+        logger.exception("Búsqueda: no se pudo reindexar el mensaje %s", msg.pk)
+
+
+def _olvidar_clientes(con, ids: list[int]):
+    con.executemany("DELETE FROM clientes WHERE rowid = ?", [(i,) for i in ids])
+    con.executemany("DELETE FROM telefonos WHERE cliente_id = ?", [(i,) for i in ids])
+
+
+def _olvidar_mensajes(con, ids: list[int]):
+    con.executemany("DELETE FROM mensajes WHERE rowid = ?", [(i,) for i in ids])
+
+
+def _purgar(sql_ids: str, modelo, olvidar) -> int:
+    con = _conexion()
+    desde, total = 0, 0
+    while True:
+        ids = [r[0] for r in con.execute(sql_ids, (desde, PURGA_LOTE))]
+        if not ids:
+            return total
+        desde = ids[-1]
+        existen = set(modelo.objects.filter(pk__in=ids).values_list("id", flat=True))
+        faltan = [i for i in ids if i not in existen]
+        if faltan:
+            _escribir(lambda con, faltan=faltan: olvidar(con, faltan))
+            total += len(faltan)
+
+
+def purgar() -> dict:
+    """Quita del índice los clientes y mensajes que ya no están en la BD."""
+    n = {
+        "clientes": _purgar(
+            "SELECT cliente_id FROM telefonos WHERE cliente_id > ? ORDER BY cliente_id LIMIT ?",
+            ClientesDigitales,
+            _olvidar_clientes,
+        ),
+        "mensajes": _purgar(
+            "SELECT rowid FROM mensajes WHERE rowid > ? ORDER BY rowid LIMIT ?",
+            MensajeWhatsApp,
+            _olvidar_mensajes,
+        ),
+    }
+    _escribir(lambda con: _guardar_estado(con, "purga_at", time.time()))
+    return n
+
+
+def sincronizar() -> dict:
+    inicio = time.monotonic()
+    n = {"clientes": sincronizar_clientes(), "mensajes": sincronizar_mensajes()}
+    if n["clientes"] or n["mensajes"]:
+        logger.info(
+            "Búsqueda: indexados %s clientes y %s mensajes en %.2fs",
+            n["clientes"], n["mensajes"], time.monotonic() - inicio,
+        )
+    if time.time() - _leer_estado(_conexion(), "purga_at", 0) >= PURGA_SEGUNDOS:
+        borrados = purgar()
+        if borrados["clientes"] or borrados["mensajes"]:
+            logger.info("Búsqueda: quitados %s clientes y %s mensajes borrados", borrados["clientes"], borrados["mensajes"])
+    return n
+
+
+def rehacer() -> dict:
+    """Borra el índice y lo vuelve a llenar desde cero."""
+    def fn(con):
+        for tabla in ("clientes", "mensajes", "telefonos", "estado"):
+            con.execute(f"DELETE FROM {tabla}")
+        # recién llenado desde la BD no hay nada que purgar
+        _guardar_estado(con, "purga_at", time.time())
+    _escribir(fn)
+    n = sincronizar()
+    _conexion().execute("INSERT INTO mensajes (mensajes) VALUES ('optimize')")
+    _conexion().execute("INSERT INTO clientes (clientes) VALUES ('optimize')")
+    return n
+
+
+# --- consulta ---------------------------------------------------------------
+
+def consulta_fts(texto: str) -> str:
+    """
+    Términos del usuario a una consulta FTS5 segura: cada palabra entre
+    comillas y como prefijo, todas requeridas ("gar lop" -> García López).
+    """
+    terminos = _TERMINO.findall(texto or "")[:MAX_TERMINOS]
+    return " ".join('"{}"*'.format(t.replace('"', "")) for t in terminos)
+
+
+def _fragmento_telefono(texto: str) -> str:
+    digitos = "".join(c for c in texto or "" if c.isdigit())
+    # con menos de 4 dígitos casi todo coincide
+    return digitos if len(digitos) >= 4 and len(digitos) * 2 >= len((texto or "").replace(" ", "")) else ""
+
+
+def buscar_clientes(texto: str, limit: int = 20, offset: int = 0) -> list[int]:
+    """Ids de clientes ordenados por relevancia (los que coinciden por teléfono van primero)."""
+    fts = consulta_fts(texto)
+    tel = _fragmento_telefono(texto)
+    con = _conexion()
+    hasta = offset + limit
+
+    ids = []
+    if tel:
+        ids += [r[0] for r in con.execute(
+            "SELECT cliente_id FROM telefonos WHERE telefono LIKE ? ORDER BY cliente_id DESC LIMIT ?",
+            (f"%{tel}%", hasta),
+        )]
+    if fts:
+        pesos = ", ".join(str(p) for p in PESOS_CLIENTES)
+        ids += [r[0] for r in con.execute(
+            f"SELECT rowid FROM clientes WHERE clientes MATCH ? ORDER BY bm25(clientes, {pesos}) LIMIT ?",
+            (fts, hasta + len(ids)),
+        )]
+    return list(dict.fromkeys(ids))[offset:hasta]
+
+
+def buscar_mensajes(texto: str, limit: int = 20, offset: int = 0, cliente_id: int | None = None) -> list[tuple[int, str]]:
+    """
+    (id, fragmento) de mensajes por relevancia; el fragmento marca las
+    coincidencias con «». Solo se ordenan las MAX_CANDIDATOS coincidencias
+    más recientes: con palabras muy comunes calcular bm25 sobre todo el
+    historial cuesta cientos de ms y lo viejo casi nunca es lo que se busca.
+    """
+    fts = consulta_fts(texto)
+    if not fts:
+        return []
+    fts = f"body : ({fts})"
+    if cliente_id:
+        fts += f' AND chat : "{_chat(cliente_id)}"'
+    con = _conexion()
+
+    filtro, params = "", [fts]
+    piso = con.execute(
+        "SELECT rowid FROM mensajes WHERE mensajes MATCH ? ORDER BY rowid DESC LIMIT 1 OFFSET ?",
+        (fts, MAX_CANDIDATOS - 1),
+    ).fetchone()
+    if piso:
+        filtro, params = " AND rowid >= ?", [fts, piso[0]]
+
+    sql = (
+        "SELECT rowid, snippet(mensajes, 0, '«', '»', '…', 12) FROM mensajes "
+        f"WHERE mensajes MATCH ?{filtro} ORDER BY rank LIMIT ? OFFSET ?"
+    )
+    return list(con.execute(sql, (*params, limit, offset)))
+
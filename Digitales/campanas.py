@@ -0,0 +1,285 @@
+# digitales/campanas.py
+"""
+Motor de campañas de plantillas: resuelve los leads de un filtro, reparte
+los envíos en un pool acotado de hilos respetando el throughput de Meta y
+escribe resultados, contadores y el log de MensajeWhatsApp por lotes.
+"""
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import DateTimeField, F, Q, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .contacto import enviar_template_whatsapp
+from .eventos import publicar_mensajes
+from .models import (
+    CampanaEnvio,
+    CampanaEnvioDestinatario,
+    CampanaMeta,
+    ClientesDigitales,
+    MensajeWhatsApp,
+)
+from .workers import en_segundo_plano
+
+logger = logging.getLogger(__name__)
+
+HILOS = int(getattr(settings, "WHATSAPP_CAMPANA_HILOS", 8))
+MPS = float(getattr(settings, "WHATSAPP_CAMPANA_MPS", 20))
+LOTE = int(getattr(settings, "WHATSAPP_CAMPANA_LOTE", 200))
+# sin latido en este tiempo, la ejecución se da por muerta y otra la reanuda
+LEASE = int(getattr(settings, "WHATSAPP_CAMPANA_LEASE", 120))
+
+FILTROS = ("agencia", "estado", "business", "pauta", "asesor_digital")
+CAMPOS_PARAMS = (
+    "nombre", "telefono", "correo", "agencia", "business", "auto_interes",
+    "asesor_digital", "asesor_ventas", "responsable",
+)
+
+
+class Ritmo:
+    """Reparte turnos a `mps` mensajes por segundo entre todos los hilos."""
+
+    def __init__(self, mps: float):
+        self.intervalo = 1.0 / mps if mps > 0 else 0.0
+        self._siguiente = time.monotonic()
+        self._lock = threading.Lock()
+
+    def esperar(self):
+        if not self.intervalo:
+            return
+        with self._lock:
+            ahora = time.monotonic()
+            turno = max(ahora, self._siguiente)
+            self._siguiente = turno + self.intervalo
+        if turno > ahora:
+            time.sleep(turno - ahora)
+
+
+def filtrar_leads(filtro: dict):
+    """
+    Filtros soportados: agencia, estado, business, pauta, asesor_digital
+    (valor o lista) y campana_meta (id_campana; se traduce a la etiqueta
+    "sucursal - nombre" que se guarda en `pauta`).
+    """
+    qs = ClientesDigitales.objects.exclude(telefono="")
+    for campo in FILTROS:
+        valor = filtro.get(campo)
+        if isinstance(valor, list):
+            qs = qs.filter(**{f"{campo}__in": valor})
+        elif valor:
+            qs = qs.filter(**{campo: valor})
+
+    if filtro.get("campana_meta"):
+        c = CampanaMeta.objects.filter(id_campana=filtro["campana_meta"]).first()
+        label = f"{(c.sucursal or '').strip()} - {(c.nombre_campana or '').strip()}".strip(" -") if c else ""
+        qs = qs.filter(pauta=label) if label else qs.none()
+
+    return qs
+
+
+def resolver_params(mapeo: list, lead: dict) -> list[str]:
+    out = []
+    for p in mapeo or []:
+        if isinstance(p, dict) and p.get("campo") in CAMPOS_PARAMS:
+            out.append(str(lead.get(p["campo"]) or p.get("default") or ""))
+        elif isinstance(p, dict):
+            out.append(str(p.get("valor") or ""))
+        else:
+            out.append(str(p))
+    return out
+
+
+def crear_campana(template_name: str, idioma: str, params: list, filtro: dict) -> CampanaEnvio:
+    # todo o nada: una campaña a medio crear quedaría `pendiente` con un
+    # `total` que no corresponde a sus destinatarios
+    with transaction.atomic():
+        campana = CampanaEnvio.objects.create(
+            template_name=template_name,
+            idioma=idioma,
+            params=params,
+            filtro=filtro,
+        )
+
+        leads = filtrar_leads(filtro).values("id", *CAMPOS_PARAMS).order_by("id")
+        lote, total = [], 0
+        for lead in leads.iterator(chunk_size=2000):
+            lote.append(CampanaEnvioDestinatario(
+                campana=campana,
+                cliente_id=lead["id"],
+                telefono=lead["telefono"],
+                params=resolver_params(params, lead),
+            ))
+            if len(lote) >= 1000:
+                CampanaEnvioDestinatario.objects.bulk_create(lote)
+                total += len(lote)
+                lote = []
+        if lote:
+            CampanaEnvioDestinatario.objects.bulk_create(lote)
+            total += len(lote)
+
+        campana.total = total
+        campana.save(update_fields=["total"])
+    return campana
+
+
+def lanzar_campana(campana_id: int):
+    en_segundo_plano("wa-campanas", ejecutar_campana, campana_id, max_workers=2)
+
+
+def _body_log(template_name: str, params: list[str]) -> str:
+    # mismo formato que enviar_plantilla_view
+    return f"[TEMPLATE:{template_name}] {' | '.join(params)}".strip()
+
+
+def _enviar(campana: CampanaEnvio, dest: CampanaEnvioDestinatario, ritmo: Ritmo) -> tuple:
+    ritmo.esperar()
+    try:
+        wa_res = enviar_template_whatsapp(
+            to=dest.telefono,
+            template_name=campana.template_name,
+            params=dest.params,
+            idioma=campana.idioma,
+        )
+        wa_id = ((wa_res.get("messages") or [{}])[0].get("id", "") or "")
+        return dest, wa_res, wa_id, ""
+    except Exception as e:
+        return dest, None, "", str(e)
+
+
+def _guardar_lote(campana: CampanaEnvio, resultados: list[tuple]):
+    now = timezone.now()
+    dests, msgs = [], []
+    ok = fallo = 0
+
+    for dest, wa_res, wa_id, error in resultados:
+        dest.enviado_at = now
+        dest.wa_message_id = wa_id
+        dest.error = error[:500]
+        dest.estado = dest.Estado.FALLIDO if error else dest.Estado.ENVIADO
+        dests.append(dest)
+        if error:
+            fallo += 1
+        else:
+            ok += 1
+
+        msgs.append(MensajeWhatsApp(
+            telefono=dest.telefono,
+            cliente_id=dest.cliente_id,
+            direction="out",
+            body=f"[TEMPLATE:{campana.template_name}] failed" if error else _body_log(campana.template_name, dest.params),
+            wa_message_id=wa_id,
+            status="failed" if error else "accepted",
+            raw=wa_res if not error else {"error": error, "campana": campana.pk},
+        ))
+
+    with transaction.atomic():
+        CampanaEnvioDestinatario.objects.bulk_update(dests, ["estado", "wa_message_id", "error", "enviado_at"])
+        msgs = MensajeWhatsApp.bulk_guardar(msgs)
+        ClientesDigitales.registrar_envios(msgs, when=now)
+        CampanaEnvio.objects.filter(pk=campana.pk).update(
+            enviados=F("enviados") + ok,
+            fallidos=F("fallidos") + fallo,
+        )
+    publicar_mensajes(msgs)
+
+
+def _latir(campana_id: int, ejecucion: str) -> bool:
+    """Renueva el lease; False si la campaña se canceló o la tomó otro proceso."""
+    return bool(CampanaEnvio.objects.filter(
+        pk=campana_id, estado=CampanaEnvio.Estado.ENVIANDO, ejecucion=ejecucion,
+    ).update(latido_at=timezone.now()))
+
+
+def _reclamar_lote(campana: CampanaEnvio, ejecucion: str) -> list[CampanaEnvioDestinatario] | None:
+    """
+    Siguiente lote de pendientes marcado `enviando` por esta ejecución.
+    Solo se envían las filas que este UPDATE ganó; None si ya no hay pendientes.
+    """
+    Dest = CampanaEnvioDestinatario
+    ids = list(
+        Dest.objects
+        .filter(campana=campana, estado=Dest.Estado.PENDIENTE)
+        .order_by("id")
+        .values_list("id", flat=True)[:LOTE]
+    )
+    if not ids:
+        return None
+    Dest.objects.filter(pk__in=ids, estado=Dest.Estado.PENDIENTE).update(
+        estado=Dest.Estado.ENVIANDO, ejecucion=ejecucion,
+    )
+    return list(Dest.objects.filter(pk__in=ids, estado=Dest.Estado.ENVIANDO, ejecucion=ejecucion).order_by("id"))
+
+
+def ejecutar_campana(campana_id: int) -> bool:
+    """
+    Envía los destinatarios pendientes por lotes. Regresa False si no se pudo
+    tomar: ya terminó, se canceló o la está enviando otro proceso con el
+    latido al día.
+
+    Se puede llamar de nuevo para reanudar una campaña cuyo proceso murió
+    (latido más viejo que WHATSAPP_CAMPANA_LEASE): lo que quedó `enviando`
+    se marca fallido (no sabemos si Meta lo aceptó; no se reenvía a ciegas).
+    """
+    ejecucion = uuid.uuid4().hex
+    now = timezone.now()
+    vencido = now - timedelta(seconds=LEASE)
+    tomada = (
+        CampanaEnvio.objects
+        .filter(pk=campana_id)
+        .filter(
+            Q(estado=CampanaEnvio.Estado.PENDIENTE)
+            | Q(estado=CampanaEnvio.Estado.ENVIANDO, latido_at__isnull=True)
+            | Q(estado=CampanaEnvio.Estado.ENVIANDO, latido_at__lt=vencido)
+        )
+        .update(
+            estado=CampanaEnvio.Estado.ENVIANDO,
+            ejecucion=ejecucion,
+            latido_at=now,
+            # al reanudar se conserva el inicio original
+            iniciado_at=Coalesce("iniciado_at", Value(now), output_field=DateTimeField()),
+        )
+    )
+    if not tomada:
+        return False
+
+    campana = CampanaEnvio.objects.get(pk=campana_id)
+    # con el lease en nuestras manos, lo `enviando` es de una ejecución muerta
+    interrumpidos = CampanaEnvioDestinatario.objects.filter(
+        campana=campana, estado=CampanaEnvioDestinatario.Estado.ENVIANDO,
+    ).exclude(ejecucion=ejecucion).update(
+        estado=CampanaEnvioDestinatario.Estado.FALLIDO, error="interrumpido: verificar en WhatsApp",
+    )
+    if interrumpidos:
+        CampanaEnvio.objects.filter(pk=campana.pk).update(fallidos=F("fallidos") + interrumpidos)
+
+    ritmo = Ritmo(MPS)
+    with ThreadPoolExecutor(max_workers=HILOS, thread_name_prefix=f"wa-campana-{campana.pk}") as pool:
+        while True:
+            if not _latir(campana.pk, ejecucion):
+                logger.info("Campaña %s cancelada o tomada por otro proceso", campana.pk)
+                return True
+
+            lote = _reclamar_lote(campana, ejecucion)
+            if lote is None:
+                break
+            if not lote:
+                continue
+
+            futuros = [pool.submit(_enviar, campana, d, ritmo) for d in lote]
+            # un lote con timeouts de Graph puede tardar más que el lease
+            while wait(futuros, timeout=LEASE / 3).not_done:
+                _latir(campana.pk, ejecucion)
+            _guardar_lote(campana, [f.result() for f in futuros])
+
+    CampanaEnvio.objects.filter(pk=campana.pk, estado=CampanaEnvio.Estado.ENVIANDO, ejecucion=ejecucion).update(
+        estado=CampanaEnvio.Estado.TERMINADA,
+        terminado_at=timezone.now(),
+    )
+    return True
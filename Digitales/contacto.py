@@ -1,11 +1,175 @@
 # digitales/contacto.py
+import logging
 import mimetypes
+import random
+import threading
+import time
 import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from .sett import whatsapp_url, whatsapp_token
+from . import limitador
+from .subidas import MB, CuerpoMultipart
 import re
 
+logger = logging.getLogger(__name__)
+
 DEFAULT_IDIOMA = "es"
 
+# Cliente HTTP de Graph: una sola Session por proceso con pool keep-alive,
+# así cada envío reutiliza la conexión TLS a graph.facebook.com.
+GRAPH_POOL = int(getattr(settings, "WHATSAPP_GRAPH_POOL", 10))
+GRAPH_CONNECT_TIMEOUT = float(getattr(settings, "WHATSAPP_GRAPH_CONNECT_TIMEOUT", 5))
+GRAPH_TIMEOUT = float(getattr(settings, "WHATSAPP_GRAPH_TIMEOUT", 20))
+GRAPH_MEDIA_TIMEOUT = float(getattr(settings, "WHATSAPP_GRAPH_MEDIA_TIMEOUT", 45))
+GRAPH_RETRIES = int(getattr(settings, "WHATSAPP_GRAPH_RETRIES", 3))
+GRAPH_BACKOFF = float(getattr(settings, "WHATSAPP_GRAPH_BACKOFF", 0.5))
+# Throttling de Meta: reintentos y tope (s) del backoff exponencial con jitter.
+GRAPH_THROTTLE_RETRIES = int(getattr(settings, "WHATSAPP_GRAPH_THROTTLE_RETRIES", 5))
+GRAPH_THROTTLE_MAX = float(getattr(settings, "WHATSAPP_GRAPH_THROTTLE_MAX", 60))
+# Lo más que puede tardar un _graph con cubeta: cada intento con sus timeouts
+# y cada espera por throttling al tope. Los leases de quien llama (outbox) se
+# miden contra esto.
+GRAPH_PRESUPUESTO = (
+    (GRAPH_THROTTLE_RETRIES + 1) * (GRAPH_CONNECT_TIMEOUT + GRAPH_TIMEOUT)
+    + GRAPH_THROTTLE_RETRIES * GRAPH_THROTTLE_MAX
+)
+# llamadas hechas dentro de un request web: no esperan tokens ni throttling más
+# allá de esto (mejor un error rápido que el timeout del worker de gunicorn)
+GRAPH_LIMITE_INTERACTIVO = float(getattr(settings, "WHATSAPP_GRAPH_LIMITE_INTERACTIVO", 20))
+
+# Códigos de Meta que significan "vas muy rápido". 131056 es por par
+# (mismo destinatario): se reintenta sin frenar la cubeta de todos.
+META_RATE_LIMIT = {4, 80007, 130429, 131048}
+META_RATE_LIMIT_PAR = {131056}
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def graph_session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                # Reintentos solo donde es seguro: errores de conexión (la petición
+                # no salió) y 5xx en GET. Un POST que llegó a Meta no se repite.
+                retry = Retry(
+                    total=GRAPH_RETRIES,
+                    connect=GRAPH_RETRIES,
+                    read=0,
+                    status=GRAPH_RETRIES,
+                    status_forcelist=(500, 502, 503, 504),
+                    allowed_methods=frozenset(["GET"]),
+                    backoff_factor=GRAPH_BACKOFF,
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=GRAPH_POOL, max_retries=retry)
+                s = requests.Session()
+                s.mount("https://", adapter)
+                s.mount("http://", adapter)
+                _session = s
+    return _session
+
+
+def _headers(json: bool = True) -> dict:
+    headers = {"Authorization": f"Bearer {whatsapp_token}"}
+    if json:
+        headers["Content-Type"] = "application/json"
+    return headers
+
+
+def _codigo_throttling(r: requests.Response) -> int | None:
+    if r.status_code == 429:
+        return 429
+    if r.status_code < 400:
+        return None
+    try:
+        err = (r.json() or {}).get("error") or {}
+    except ValueError:
+        return None
+    for codigo in (err.get("code"), err.get("error_subcode")):
+        if codigo in META_RATE_LIMIT or codigo in META_RATE_LIMIT_PAR:
+            return codigo
+    return None
+
+
+def _espera_throttling(r: requests.Response, intento: int) -> float:
+    try:
+        retry_after = float(r.headers.get("Retry-After") or 0)
+    except ValueError:
+        retry_after = 0
+    base = min(GRAPH_THROTTLE_MAX, GRAPH_BACKOFF * (2 ** intento))
+    # full jitter: evita que todos los workers reintenten al mismo tiempo
+    # Retry-After también se topa: así GRAPH_PRESUPUESTO es una cota real
+    return min(GRAPH_THROTTLE_MAX, max(retry_after, random.uniform(base / 2, base)))
+
+
+def _graph(
+    method: str,
+    url: str,
+    *,
+    timeout: float = GRAPH_TIMEOUT,
+    json_body: bool = True,
+    cubeta: "limitador.CubetaTokens | None" = None,
+    hasta: float | None = None,
+    **kwargs,
+) -> requests.Response:
+    """
+    Toda llamada a Graph pasa por aquí: headers, pool y timeouts en un solo lugar.
+    Con `cubeta`, respeta el límite compartido y reintenta lo que Meta rechace
+    por throttling (Meta no procesó esa petición, así que repetir un POST es seguro).
+
+    El reintento manda el mismo `data` otra vez: con un cuerpo en streaming
+    tiene que poder iterarse de nuevo desde el inicio (como subidas.CuerpoMultipart);
+    un generador o un archivo ya leído saldría vacío.
+
+    `hasta` (time.monotonic(), ver plazo_interactivo) corta las esperas: si el
+    token o el siguiente reintento llegarían después, falla en lugar de dormir.
+    """
+    headers = {**_headers(json=json_body), **kwargs.pop("headers", {})}
+
+    intento = 0
+    while True:
+        if cubeta is not None and not cubeta.tomar(hasta=hasta):
+            raise ErrorMeta(f"Graph: sin cupo en la cubeta {cubeta.nombre} dentro del plazo", 429)
+        r = graph_session().request(
+            method,
+            url,
+            headers=headers,
+            timeout=(GRAPH_CONNECT_TIMEOUT, timeout),
+            **kwargs,
+        )
+        codigo = _codigo_throttling(r) if cubeta is not None else None
+        if codigo is None or intento >= GRAPH_THROTTLE_RETRIES:
+            return r
+
+        espera = _espera_throttling(r, intento)
+        if codigo not in META_RATE_LIMIT_PAR:
+            # la pausa queda en la cubeta: los demás workers también esperan
+            cubeta.frenar(espera)
+        if hasta is not None and time.monotonic() + espera > hasta:
+            logger.warning("Graph throttling (%s) en %s; sin plazo para reintentar", codigo, cubeta.nombre)
+            return r
+        logger.warning("Graph throttling (%s) en %s; reintento %s en %.1fs", codigo, cubeta.nombre, intento + 1, espera)
+        if codigo in META_RATE_LIMIT_PAR:
+            time.sleep(espera)
+        intento += 1
+
+
+def plazo_interactivo() -> float:
+    """Límite `hasta` para las llamadas a Graph de un request web."""
+    return time.monotonic() + GRAPH_LIMITE_INTERACTIVO
+
+
+class ErrorMeta(RuntimeError):
+    """Meta respondió con error HTTP; `status_code` permite decidir si reintentar."""
+
+    def __init__(self, mensaje: str, status_code: int):
+        super().__init__(mensaje)
+        self.status_code = status_code
+
 
 def _meta_error(r):
     try:
@@ -29,17 +193,13 @@ def enviar_template_whatsapp(
     params: list[str] | None = None,
     idioma: str = DEFAULT_IDIOMA,
     components: list[dict] | None = None,
+    hasta: float | None = None,
 ) -> dict:
     if not to:
         raise ValueError("Falta número destino")
     if not template_name:
         raise ValueError("Falta template_name")
 
-    headers = {
-        "Authorization": f"Bearer {whatsapp_token}",
-        "Content-Type": "application/json",
-    }
-
     if components:
         # Normaliza a formato Meta: type en MAYÚSCULA y parameters igual
         norm_components = []
@@ -84,10 +244,10 @@ def enviar_template_whatsapp(
             },
         }
 
-    r = requests.post(whatsapp_url, headers=headers, json=payload, timeout=20)
+    r = _graph("POST", whatsapp_url, json=payload, cubeta=limitador.mensajes, hasta=hasta)
     if r.status_code >= 400:
         err = _meta_error(r)
-        raise RuntimeError(f"Meta error {r.status_code}: {err}")
+        raise ErrorMeta(f"Meta error {r.status_code}: {err}", r.status_code)
     return r.json()
 
 def enviar_texto_whatsapp(to: str, text: str) -> dict:
@@ -99,18 +259,18 @@ def enviar_texto_whatsapp(to: str, text: str) -> dict:
         "text": {"body": text},
     }
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {whatsapp_token}",
-    }
-
-    r = requests.post(whatsapp_url, headers=headers, json=payload, timeout=20)
+    r = _graph("POST", whatsapp_url, json=payload, cubeta=limitador.mensajes)
     if r.status_code >= 400:
-        raise RuntimeError(f"Meta error {r.status_code}: {r.text}")
+        raise ErrorMeta(f"Meta error {r.status_code}: {r.text}", r.status_code)
     return r.json()
 
 
-def subir_media_whatsapp(file_obj, filename: str | None = None, content_type: str | None = None) -> dict:
+def subir_media_whatsapp(
+    file_obj,
+    filename: str | None = None,
+    content_type: str | None = None,
+    hasta: float | None = None,
+) -> dict:
     """
     Sube un archivo a WhatsApp Cloud y devuelve respuesta que incluye:
     { "id": "<MEDIA_ID>" }
@@ -121,44 +281,54 @@ def subir_media_whatsapp(file_obj, filename: str | None = None, content_type: st
 
     media_url = f"{base}/media"
 
-    headers = {
-        "Authorization": f"Bearer {whatsapp_token}",
-        # OJO: en multipart NO se manda Content-Type manual
-    }
-
     # intenta inferir content-type
     ct = content_type or ""
     if not ct and filename:
         ct = mimetypes.guess_type(filename)[0] or ""
 
-    files = {
-        "file": (filename or getattr(file_obj, "name", "file"), file_obj, ct or "application/octet-stream"),
-    }
-
-    data = {
-        "messaging_product": "whatsapp",
-        # opcional: "type": ct (Meta lo acepta, pero no siempre requerido)
-    }
-
-    r = requests.post(media_url, headers=headers, files=files, data=data, timeout=45)
+    # multipart armado a mano y leído por chunks: el archivo nunca se carga
+    # completo en memoria (requests con files= lo materializa entero)
+    cuerpo = CuerpoMultipart(
+        {"messaging_product": "whatsapp"},
+        "file",
+        file_obj,
+        filename or getattr(file_obj, "name", "file"),
+        ct or "application/octet-stream",
+    )
+
+    inicio = time.monotonic()
+    r = _graph(
+        "POST",
+        media_url,
+        data=cuerpo,
+        headers={"Content-Type": cuerpo.content_type},
+        timeout=GRAPH_MEDIA_TIMEOUT,
+        json_body=False,
+        cubeta=limitador.media,
+        hasta=hasta,
+    )
+    seg = max(time.monotonic() - inicio, 1e-6)
+    logger.info("Graph media upload: %.1f MB en %.2fs (%.1f MB/s)", cuerpo.tamano / MB, seg, cuerpo.tamano / MB / seg)
     if r.status_code >= 400:
         err = _meta_error(r)
-        raise RuntimeError(f"Meta media upload error {r.status_code}: {err}")
+        raise ErrorMeta(f"Meta media upload error {r.status_code}: {err}", r.status_code)
     return r.json()
 
 
-def enviar_media_whatsapp(to: str, media_id: str, media_type: str, caption: str = "", filename: str = "") -> dict:
+def enviar_media_whatsapp(
+    to: str,
+    media_id: str,
+    media_type: str,
+    caption: str = "",
+    filename: str = "",
+    hasta: float | None = None,
+) -> dict:
     """
     Envía media ya subida (media_id) como image/document/video/audio.
     """
     if media_type not in ("image", "document", "video", "audio"):
         raise ValueError("media_type inválido")
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {whatsapp_token}",
-    }
-
     payload = {
         "messaging_product": "whatsapp",
         "recipient_type": "individual",
@@ -177,10 +347,10 @@ def enviar_media_whatsapp(to: str, media_id: str, media_type: str, caption: str
     if filename and media_type == "document":
         payload[media_type]["filename"] = filename
 
-    r = requests.post(whatsapp_url, headers=headers, json=payload, timeout=20)
+    r = _graph("POST", whatsapp_url, json=payload, cubeta=limitador.mensajes, hasta=hasta)
     if r.status_code >= 400:
         err = _meta_error(r)
-        raise RuntimeError(f"Meta send media error {r.status_code}: {err}")
+        raise ErrorMeta(f"Meta send media error {r.status_code}: {err}", r.status_code)
     return r.json()
 
 
@@ -213,12 +383,7 @@ def replace_start(s: str) -> str:
         return "52" + s[3:]
     return s
 
-def editar_texto_whatsapp(to: str, original_message_id: str, new_text: str) -> dict:
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {whatsapp_token}",
-    }
-
+def editar_texto_whatsapp(to: str, original_message_id: str, new_text: str, hasta: float | None = None) -> dict:
     payload = {
         "messaging_product": "whatsapp",
         "to": to,
@@ -227,9 +392,9 @@ def editar_texto_whatsapp(to: str, original_message_id: str, new_text: str) -> d
         "text": {"body": new_text},
     }
 
-    r = requests.post(whatsapp_url, headers=headers, json=payload, timeout=20)
+    r = _graph("POST", whatsapp_url, json=payload, cubeta=limitador.mensajes, hasta=hasta)
     if r.status_code >= 400:
-        raise RuntimeError(f"Meta edit error {r.status_code}: {r.text}")
+        raise ErrorMeta(f"Meta edit error {r.status_code}: {r.text}", r.status_code)
     return r.json()
 
 def _graph_root_from_messages_url(messages_url: str) -> str:
@@ -244,23 +409,57 @@ def get_media_info_whatsapp(media_id: str) -> dict:
         raise RuntimeError("No se pudo derivar graph_root desde whatsapp_url.")
 
     url = f"{graph_root}/{media_id}"
-    headers = {"Authorization": f"Bearer {whatsapp_token}"}
 
-    r = requests.get(url, headers=headers, timeout=20)
+    r = _graph("GET", url, json_body=False, cubeta=limitador.media)
     if r.status_code >= 400:
-        raise RuntimeError(f"Meta media info error {r.status_code}: {r.text}")
+        raise ErrorMeta(f"Meta media info error {r.status_code}: {r.text}", r.status_code)
     return r.json()
 
-def download_media_whatsapp(media_id: str) -> tuple[bytes, str]:
+# La URL de descarga que regresa Meta dura ~5 min: el info se guarda menos que eso.
+MEDIA_INFO_TTL = float(getattr(settings, "WHATSAPP_MEDIA_INFO_TTL", 240))
+MEDIA_INFO_MAXIMO = 2000
+
+_media_info: dict[str, tuple[float, dict]] = {}
+_media_info_lock = threading.Lock()
+
+
+def media_info_whatsapp(media_id: str, refrescar: bool = False) -> dict:
+    """get_media_info_whatsapp con caché TTL por proceso."""
+    ahora = time.monotonic()
+    if not refrescar:
+        with _media_info_lock:
+            guardado = _media_info.get(media_id)
+        if guardado and guardado[0] > ahora:
+            return guardado[1]
+
     info = get_media_info_whatsapp(media_id)
-    media_url = info.get("url") or ""
-    if not media_url:
-        raise RuntimeError(f"Meta no regresó url para media_id={media_id}: {info}")
+    with _media_info_lock:
+        if len(_media_info) >= MEDIA_INFO_MAXIMO:
+            vencidos = [k for k, (expira, _) in _media_info.items() if expira <= ahora]
+            # sin vencidos: fuera el 10% más viejo (el dict conserva el orden de inserción)
+            for k in vencidos or list(_media_info)[: MEDIA_INFO_MAXIMO // 10]:
+                del _media_info[k]
+        _media_info[media_id] = (ahora + MEDIA_INFO_TTL, info)
+    return info
 
-    headers = {"Authorization": f"Bearer {whatsapp_token}"}
-    r = requests.get(media_url, headers=headers, timeout=45)
-    if r.status_code >= 400:
-        raise RuntimeError(f"Meta media download error {r.status_code}: {r.text}")
 
-    ct = r.headers.get("content-type") or info.get("mime_type") or "application/octet-stream"
-    return (r.content, ct)
\ No newline at end of file
+def abrir_media_whatsapp(media_id: str) -> tuple[requests.Response, dict]:
+    """
+    Descarga un media de Meta sin leer el cuerpo: regresa la respuesta en
+    modo stream (consumir con iter_content y cerrarla) y el info.
+    """
+    for refrescar in (False, True):
+        info = media_info_whatsapp(media_id, refrescar=refrescar)
+        media_url = info.get("url") or ""
+        if not media_url:
+            raise RuntimeError(f"Meta no regresó url para media_id={media_id}: {info}")
+
+        r = _graph("GET", media_url, timeout=GRAPH_MEDIA_TIMEOUT, json_body=False, cubeta=limitador.media, stream=True)
+        if r.status_code < 400:
+            return r, info
+        detalle = r.text
+        r.close()
+        # URL vencida antes de tiempo: se pide un info nuevo una vez
+        if r.status_code not in (401, 403, 404) or refrescar:
+            break
+    raise ErrorMeta(f"Meta media download error {r.status_code}: {detalle}", r.status_code)
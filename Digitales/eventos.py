@@ -0,0 +1,216 @@
+# digitales/eventos.py
+"""
+Eventos de chat (mensaje nuevo, cambio de status) para los streams SSE
+abiertos (ver views.contacto_stream).
+
+Publicar escribe una fila (teléfono, tipo, id del mensaje) en un log SQLite
+local, como el del limitador: funciona igual desde los workers de gunicorn,
+el inbox, el outbox, las campañas o el proceso ASGI del stream, mientras
+compartan máquina y spool. En cada proceso con streams abiertos un solo
+vigilante lee las filas nuevas cada POLL s y las reparte a sus
+suscripciones; lo publicado en el mismo proceso lo despierta al instante.
+
+El log solo guarda ids: el stream lee de BD el estado actual del mensaje,
+así un status atrasado o repetido no puede pintar algo viejo.
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+RUTA = Path(getattr(settings, "WHATSAPP_EVENTOS_DB", Path(getattr(settings, "WHATSAPP_SPOOL_DIR", "spool")) / "eventos.sqlite3"))
+POLL = float(getattr(settings, "WHATSAPP_EVENTOS_POLL", 0.5))
+# un stream que se reconecta después de esto recupera mensajes con su resync contra BD
+RETENCION_SEGUNDOS = 600
+LECTURA_MAXIMA = 5000
+COLA_MAXIMA = 200
+
+_local = threading.local()
+_ultima_poda = 0.0
+_poda_lock = threading.Lock()
+
+
+def _conexion() -> sqlite3.Connection:
+    # por hilo y por proceso: una conexión heredada de un fork no se reutiliza
+    clave = (os.getpid(), str(RUTA))
+    con = getattr(_local, "con", None)
+    if con is None or _local.clave != clave:
+        RUTA.parent.mkdir(parents=True, exist_ok=True)
+        con = sqlite3.connect(str(RUTA), timeout=5, isolation_level=None)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        con.execute(
+            "CREATE TABLE IF NOT EXISTS eventos ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " tel TEXT NOT NULL,"
+            " tipo TEXT NOT NULL,"
+            " msg_id INTEGER NOT NULL,"
+            " ts REAL NOT NULL)"
+        )
+        con.execute("CREATE INDEX IF NOT EXISTS eventos_ts ON eventos (ts)")
+        _local.con, _local.clave = con, clave
+    return con
+
+
+def _podar(con):
+    global _ultima_poda
+    with _poda_lock:
+        ahora = time.monotonic()
+        if _ultima_poda and ahora - _ultima_poda < 60:
+            return
+        _ultima_poda = ahora
+    con.execute("DELETE FROM eventos WHERE ts < ?", (time.time() - RETENCION_SEGUNDOS,))
+
+
+def publicar_eventos(eventos: list[tuple[str, str, int]]):
+    """Agrega (tel, tipo, msg_id) al log. Nunca falla hacia quien publica."""
+    if not eventos:
+        return
+    ahora = time.time()
+    try:
+        con = _conexion()
+        with con:
+            con.executemany(
+                "INSERT INTO eventos (tel, tipo, msg_id, ts) VALUES (?, ?, ?, ?)",
+                [(tel, tipo, msg_id, ahora) for tel, tipo, msg_id in eventos],
+            )
+        _podar(con)
+    except sqlite3.Error:
+        logger.exception("Eventos: no se pudieron publicar %s eventos", len(eventos))
+        return
+    bus.despertar()
+
+
+def ultimo_id() -> int:
+    return _conexion().execute("SELECT COALESCE(MAX(id), 0) FROM eventos").fetchone()[0]
+
+
+def leer_desde(desde: int) -> list[tuple[int, str, str, int]]:
+    return _conexion().execute(
+        "SELECT id, tel, tipo, msg_id FROM eventos WHERE id > ? ORDER BY id LIMIT ?",
+        (desde, LECTURA_MAXIMA),
+    ).fetchall()
+
+
+class Suscripcion:
+    def __init__(self, tel: str):
+        self.tel = tel
+        self.loop = asyncio.get_running_loop()
+        self.cola: asyncio.Queue = asyncio.Queue(maxsize=COLA_MAXIMA)
+        # si la cola se llena, el stream hace un resync contra BD
+        self.desbordada = False
+
+    def _entregar(self, evento: tuple[str, int]):
+        try:
+            self.cola.put_nowait(evento)
+        except asyncio.QueueFull:
+            self.desbordada = True
+
+    async def siguiente(self, timeout: float) -> list[tuple[str, int]]:
+        """Espera hasta `timeout` el primer evento y regresa todos los que haya ([] si nada)."""
+        try:
+            eventos = [await asyncio.wait_for(self.cola.get(), timeout)]
+        except asyncio.TimeoutError:
+            return []
+        while not self.cola.empty():
+            eventos.append(self.cola.get_nowait())
+        return eventos
+
+
+class Bus:
+    """Reparte el log a las suscripciones de este proceso (un vigilante por event loop)."""
+
+    def __init__(self):
+        self._subs: dict[str, set[Suscripcion]] = defaultdict(set)
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._tarea: asyncio.Task | None = None
+        self._despierta: asyncio.Event | None = None
+
+    def suscribir(self, tel: str) -> Suscripcion:
+        sub = Suscripcion(tel)
+        with self._lock:
+            self._subs[tel].add(sub)
+        if self._tarea is None or self._tarea.done() or self._loop is not sub.loop:
+            self._loop = sub.loop
+            self._despierta = asyncio.Event()
+            # solo lo publicado desde que hay alguien escuchando
+            self._tarea = sub.loop.create_task(self._vigilar(ultimo_id()))
+        return sub
+
+    def cancelar(self, sub: Suscripcion):
+        with self._lock:
+            subs = self._subs.get(sub.tel)
+            if subs:
+                subs.discard(sub)
+                if not subs:
+                    del self._subs[sub.tel]
+
+    def despertar(self):
+        loop, despierta = self._loop, self._despierta
+        if loop is None or despierta is None or self._tarea is None or self._tarea.done():
+            return
+        try:
+            loop.call_soon_threadsafe(despierta.set)
+        except RuntimeError:
+            pass  # loop cerrado
+
+    async def _vigilar(self, desde: int):
+        while True:
+            try:
+                await asyncio.wait_for(self._despierta.wait(), POLL)
+            except asyncio.TimeoutError:
+                pass
+            self._despierta.clear()
+
+            with self._lock:
+                if not self._subs:
+                    return
+            try:
+                filas = await asyncio.to_thread(leer_desde, desde)
+            except sqlite3.Error:
+                logger.exception("Eventos: no se pudo leer el log")
+                continue
+
+            for id_, tel, tipo, msg_id in filas:
+                desde = id_
+                with self._lock:
+                    subs = list(self._subs.get(tel, ()))
+                for sub in subs:
+                    sub._entregar((tipo, msg_id))
+            if len(filas) >= LECTURA_MAXIMA:
+                self._despierta.set()
+
+
+bus = Bus()
+
+
+def publicar_mensajes(msgs):
+    """Avisa de mensajes recién guardados (en cualquier proceso)."""
+    publicar_eventos([(m.telefono, "mensaje", m.pk) for m in msgs if m.pk])
+
+
+def publicar_status(msgs):
+    publicar_eventos([(m.telefono, "status", m.pk) for m in msgs if m.pk])
+
+
+def datos_status(msg) -> dict:
+    return {
+        "id": msg.pk,
+        "wa_message_id": msg.wa_message_id,
+        "status": msg.status,
+        "sent_at": msg.sent_at,
+        "delivered_at": msg.delivered_at,
+        "read_at": msg.read_at,
+        "failed_at": msg.failed_at,
+        "error_code": msg.error_code,
+        "error_title": msg.error_title,
+    }
@@ -0,0 +1,51 @@
+# digitales/idempotencia.py
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class RecientesTTL:
+    """
+    Conjunto acotado de claves vistas recientemente (LRU con expiración).
+    Sirve de primer filtro antes de ir a BD; un falso negativo (clave ya
+    desalojada) solo significa que la BD hace la verificación.
+    """
+
+    def __init__(self, maximo: int = 50_000, ttl: float = 3600):
+        self.maximo = maximo
+        self.ttl = ttl
+        self._items: OrderedDict[str, float] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def contiene(self, clave: str) -> bool:
+        with self._lock:
+            expira = self._items.get(clave)
+            if expira is None:
+                return False
+            if expira < time.monotonic():
+                del self._items[clave]
+                return False
+            self._items.move_to_end(clave)
+            return True
+
+    def agregar(self, claves):
+        expira = time.monotonic() + self.ttl
+        with self._lock:
+            for clave in claves:
+                self._items[clave] = expira
+                self._items.move_to_end(clave)
+            # desaloja por tamaño y, de paso, lo expirado que quede al frente
+            ahora = time.monotonic()
+            while self._items and (
+                len(self._items) > self.maximo or next(iter(self._items.values())) < ahora
+            ):
+                self._items.popitem(last=False)
+
+
+# wa_message_id entrantes ya guardados por este proceso
+wa_ids_vistos = RecientesTTL(
+    maximo=int(getattr(settings, "WHATSAPP_DEDUP_MAXIMO", 50_000)),
+    ttl=float(getattr(settings, "WHATSAPP_DEDUP_TTL", 6 * 3600)),
+)
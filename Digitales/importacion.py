@@ -0,0 +1,267 @@
+# digitales/importacion.py
+"""
+Importación masiva de prospectos (CSV, XLSX o JSONL).
+
+Las filas se leen en streaming y se procesan por lotes: los teléfonos del
+lote se normalizan de una pasada, los existentes se resuelven con un solo
+`telefono__in` y se escribe con bulk_create / bulk_update. Las filas
+inválidas no detienen la carga; quedan en el reporte con su número de fila.
+
+Misma regla que ProspectosViewSet.create: si el teléfono ya existe solo se
+pisan los campos que vienen con valor.
+"""
+import csv
+import io
+import json
+import logging
+from itertools import islice
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import IntegrityError, models, transaction
+from django.utils import timezone
+
+from .models import ClientesDigitales, normaliza_tel_mx
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+logger = logging.getLogger(__name__)
+
+LOTE = int(getattr(settings, "PROSPECTOS_IMPORT_LOTE", 1000))
+# el reporte guarda solo los primeros N errores (el conteo sí es total)
+MAX_ERRORES = int(getattr(settings, "PROSPECTOS_IMPORT_MAX_ERRORES", 1000))
+
+FORMATOS = ("csv", "xlsx", "jsonl")
+# columnas que no se importan: las maneja el sistema
+PROTEGIDOS = {
+    "id", "telefono", "creado", "actualizado", "primer_contacto_at", "ultimo_contacto_at",
+    "last_read_at", "unread_count", "ultimo_msg_id", "ultimo_msg_preview",
+    "ultimo_msg_direction", "ultimo_msg_at",
+}
+CAMPOS = {
+    f.name: f
+    for f in ClientesDigitales._meta.concrete_fields
+    if f.name not in PROTEGIDOS
+}
+VERDADEROS = {"1", "true", "si", "sí", "x", "yes", "verdadero"}
+FALSOS = {"0", "false", "no", "falso", ""}
+
+
+class ErrorImportacion(ValueError):
+    pass
+
+
+def formato_por_nombre(nombre: str) -> str:
+    ext = Path(nombre or "").suffix.lower().lstrip(".")
+    if ext == "ndjson":
+        return "jsonl"
+    return ext if ext in FORMATOS else "csv"
+
+
+def leer_filas(archivo, formato: str):
+    """
+    Itera (número de fila, dict columna -> valor) del archivo (binario), sin
+    cargarlo completo. El número es el que ve quien abre el archivo: línea
+    en JSONL, renglón en CSV/XLSX (el 1 es el encabezado), contando los vacíos.
+    """
+    if formato == "csv":
+        texto = io.TextIOWrapper(archivo, encoding="utf-8-sig", newline="")
+        muestra = texto.read(4096)
+        texto.seek(0)
+        try:
+            dialecto = csv.Sniffer().sniff(muestra, delimiters=",;\t|")
+        except csv.Error:
+            dialecto = csv.excel
+        yield from enumerate(csv.DictReader(texto, dialect=dialecto), start=2)
+
+    elif formato == "jsonl":
+        for n, linea in enumerate(io.TextIOWrapper(archivo, encoding="utf-8-sig"), start=1):
+            if not linea.strip():
+                continue
+            try:
+                fila = json.loads(linea)
+            except ValueError:
+                fila = None
+            yield n, (fila if isinstance(fila, dict) else {"__error__": "JSON inválido"})
+
+    elif formato == "xlsx":
+        if openpyxl is None:
+            raise ErrorImportacion("Para importar XLSX hace falta instalar openpyxl")
+        libro = openpyxl.load_workbook(archivo, read_only=True, data_only=True)
+        try:
+            filas = libro.active.iter_rows(values_only=True)
+            encabezados = [str(c or "").strip() for c in next(filas, ())]
+            for n, valores in enumerate(filas, start=2):
+                if any(v not in (None, "") for v in valores):
+                    yield n, dict(zip(encabezados, valores))
+        finally:
+            libro.close()
+
+    else:
+        raise ErrorImportacion(f"Formato no soportado: {formato}")
+
+
+def _columna(nombre) -> str:
+    return str(nombre or "").strip().lower().replace(" ", "_")
+
+
+def _limpiar(fila: dict) -> tuple[str, dict]:
+    """Teléfono normalizado + campos con valor ya convertidos. ValueError si algo no cuadra."""
+    if "__error__" in fila:
+        raise ValueError(fila["__error__"])
+
+    datos = {_columna(k): v for k, v in fila.items()}
+    tel = datos.pop("telefono", "")
+    if isinstance(tel, float) and tel.is_integer():
+        tel = int(tel)  # Excel guarda los teléfonos como número
+    tel = normaliza_tel_mx(tel)
+    if len(tel) < 10:
+        raise ValueError("Teléfono inválido" if tel else "El teléfono es obligatorio")
+
+    campos = {}
+    for k, v in datos.items():
+        campo = CAMPOS.get(k)
+        if campo is None or v is None:
+            continue
+        if isinstance(campo, models.BooleanField):
+            s = str(v).strip().lower()
+            if s in VERDADEROS:
+                campos[k] = True
+            elif s in FALSOS:
+                if s:
+                    campos[k] = False
+            else:
+                raise ValueError(f"{k}: se esperaba sí/no")
+            continue
+
+        s = str(v).strip()
+        if not s:
+            continue
+        if campo.max_length and len(s) > campo.max_length:
+            raise ValueError(f"{k}: máximo {campo.max_length} caracteres")
+        if k == "correo":
+            try:
+                validate_email(s)
+            except ValidationError:
+                raise ValueError("correo inválido")
+        campos[k] = s
+    return tel, campos
+
+
+def _responsable(obj: ClientesDigitales):
+    if obj.asesor_digital or obj.asesor_ventas:
+        obj.responsable = " / ".join([x for x in [obj.asesor_digital, obj.asesor_ventas] if x])
+
+
+def _guardar_lote(filas: list[tuple[int, dict]], actualizar: bool, reporte: dict):
+    lote = {}
+    for n, fila in filas:
+        try:
+            tel, campos = _limpiar(fila)
+        except ValueError as e:
+            reporte["errores_total"] += 1
+            if len(reporte["errores"]) < MAX_ERRORES:
+                reporte["errores"].append({"fila": n, "error": str(e)})
+            continue
+        # teléfono repetido en el mismo lote: se combinan, gana lo último
+        lote.setdefault(tel, {}).update(campos)
+
+    if not lote:
+        return
+
+    now = timezone.now()
+    existentes = _existentes(lote.keys())
+
+    nuevos, cambiados, tocados, omitidos = [], [], set(), 0
+    for tel, campos in lote.items():
+        obj = existentes.get(tel)
+        if obj is None:
+            obj = ClientesDigitales(telefono=tel, creado=now, actualizado=now, **campos)
+            _responsable(obj)
+            nuevos.append(obj)
+            continue
+        if not actualizar:
+            omitidos += 1
+            continue
+        antes = obj.responsable
+        for k, v in campos.items():
+            setattr(obj, k, v)
+        _responsable(obj)
+        tocados.update(campos)
+        if obj.responsable != antes:
+            tocados.add("responsable")
+        obj.actualizado = now
+        cambiados.append(obj)
+
+    try:
+        with transaction.atomic():
+            if nuevos:
+                ClientesDigitales.objects.bulk_create(nuevos, batch_size=LOTE)
+            if cambiados:
+                ClientesDigitales.objects.bulk_update(cambiados, sorted(tocados | {"actualizado"}), batch_size=LOTE)
+    except IntegrityError:
+        # otro proceso (webhook, otra importación) creó alguno de estos
+        # teléfonos entre la consulta y el insert: el lote va fila por fila
+        logger.warning("Importación: choque con un alta concurrente, lote de %s fila por fila", len(lote))
+        for tel, campos in lote.items():
+            _guardar_uno(tel, campos, actualizar, reporte)
+        return
+
+    reporte["creados"] += len(nuevos)
+    reporte["actualizados"] += len(cambiados)
+    reporte["omitidos"] += omitidos
+
+
+def _existentes(telefonos) -> dict[str, ClientesDigitales]:
+    return {c.telefono: c for c in ClientesDigitales.objects.filter(telefono__in=telefonos)}
+
+
+def _guardar_uno(tel: str, campos: dict, actualizar: bool, reporte: dict):
+    for _ in range(2):
+        obj = ClientesDigitales.objects.filter(telefono=tel).first()
+        if obj is None:
+            obj = ClientesDigitales(telefono=tel, **campos)
+            _responsable(obj)
+            try:
+                with transaction.atomic():
+                    obj.save(force_insert=True)
+            except IntegrityError:
+                continue  # lo acaba de crear alguien más: se actualiza
+            reporte["creados"] += 1
+            return
+        if not actualizar:
+            reporte["omitidos"] += 1
+            return
+        for k, v in campos.items():
+            setattr(obj, k, v)
+        _responsable(obj)
+        obj.save(update_fields=[*campos, "responsable", "actualizado"])
+        reporte["actualizados"] += 1
+        return
+
+
+def importar(filas, lote: int = LOTE, actualizar: bool = True) -> dict:
+    """
+    Importa un iterable de (número de fila, dict), como el de leer_filas.
+    Regresa el reporte:
+    {total, creados, actualizados, omitidos, errores_total, errores: [{fila, error}]}.
+    """
+    reporte = {"total": 0, "creados": 0, "actualizados": 0, "omitidos": 0, "errores_total": 0, "errores": []}
+    filas = iter(filas)
+    while True:
+        chunk = list(islice(filas, max(1, lote)))
+        if not chunk:
+            break
+        reporte["total"] += len(chunk)
+        _guardar_lote(chunk, actualizar, reporte)
+
+    logger.info(
+        "Importación de prospectos: %s filas, %s creados, %s actualizados, %s errores",
+        reporte["total"], reporte["creados"], reporte["actualizados"], reporte["errores_total"],
+    )
+    return reporte
@@ -0,0 +1,245 @@
+# digitales/inbox.py
+"""
+Inbox local (spool en disco) para el webhook de WhatsApp.
+
+El webhook solo escribe el payload crudo a `entrantes/` y responde 200;
+los workers lo reclaman moviéndolo a `procesando/` (rename atómico, así que
+varios hilos o procesos pueden drenar el mismo spool) y lo aplican a BD.
+
+Si aplicarlo falla (BD caída, deadlock...) regresa a `entrantes/` con el
+número de intento en el nombre (`<ns>-<uuid>~<n>.json`) y el mtime en el
+instante del siguiente intento; solo tras MAX_INTENTOS, o si no es JSON
+válido, se estaciona en `errores/` (`procesar_webhooks --reencolar-errores`
+lo regresa).
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+
+from .ingesta import procesar_payload
+from .workers import Despachador
+
+logger = logging.getLogger(__name__)
+
+SPOOL_DIR = Path(getattr(settings, "WHATSAPP_SPOOL_DIR", settings.BASE_DIR / "spool")) / "webhook"
+ENTRANTES = SPOOL_DIR / "entrantes"
+PROCESANDO = SPOOL_DIR / "procesando"
+ERRORES = SPOOL_DIR / "errores"
+
+LOTE = int(getattr(settings, "WHATSAPP_INBOX_LOTE", 50))
+HILOS = int(getattr(settings, "WHATSAPP_INBOX_HILOS", 2))
+# un payload que lleva más de esto en procesando/ es de un worker que murió
+HUERFANO_SEGUNDOS = int(getattr(settings, "WHATSAPP_INBOX_HUERFANO", 300))
+MAX_INTENTOS = int(getattr(settings, "WHATSAPP_INBOX_INTENTOS", 5))
+# backoff entre intentos (s): base * 2^intento, con jitter, hasta el tope
+BACKOFF = float(getattr(settings, "WHATSAPP_INBOX_BACKOFF", 10))
+BACKOFF_MAX = float(getattr(settings, "WHATSAPP_INBOX_BACKOFF_MAX", 600))
+
+
+def _asegurar_dirs():
+    for d in (ENTRANTES, PROCESANDO, ERRORES):
+        d.mkdir(parents=True, exist_ok=True)
+
+
+def encolar(raw: bytes) -> Path:
+    """
+    Persiste el payload tal cual llegó (write + fsync + rename) y despierta
+    a los workers. El nombre empieza con el instante de recepción en ns,
+    lo que da el orden FIFO y la latencia de espera en cola.
+    """
+    _asegurar_dirs()
+    nombre = f"{time.time_ns()}-{uuid.uuid4().hex}"
+    tmp = ENTRANTES / f".{nombre}.tmp"
+    final = ENTRANTES / f"{nombre}.json"
+
+    with open(tmp, "wb") as fh:
+        fh.write(raw)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, final)
+
+    despachador.despertar()
+    return final
+
+
+def _recibido_ns(ruta: Path) -> int:
+    try:
+        return int(ruta.name.split("-", 1)[0])
+    except ValueError:
+        return time.time_ns()
+
+
+def _intentos(ruta: Path) -> int:
+    base, sep, n = ruta.stem.rpartition("~")
+    return int(n) if sep and n.isdigit() else 0
+
+
+def _nombre_base(ruta: Path) -> str:
+    base, sep, n = ruta.stem.rpartition("~")
+    return base if sep and n.isdigit() else ruta.stem
+
+
+def reclamar(limite: int = LOTE) -> list[Path]:
+    """Mueve hasta `limite` payloads (los más viejos) a procesando/."""
+    _asegurar_dirs()
+    reclamados = []
+    ahora = time.time()
+    for ruta in sorted(ENTRANTES.glob("*.json")):
+        # un reintento no se toma antes de su mtime (solo esos pagan el stat)
+        if "~" in ruta.name:
+            try:
+                if ruta.stat().st_mtime > ahora:
+                    continue
+            except FileNotFoundError:
+                continue
+        destino = PROCESANDO / ruta.name
+        try:
+            os.rename(ruta, destino)
+        except FileNotFoundError:
+            continue  # otro worker lo tomó primero
+        os.utime(destino)  # marca el reclamo para recuperar_huerfanos
+        reclamados.append(destino)
+        if len(reclamados) >= limite:
+            break
+    return reclamados
+
+
+def _estacionar(ruta: Path, error: str):
+    os.replace(ruta, ERRORES / ruta.name)
+    (ERRORES / f"{ruta.name}.err").write_text(error, encoding="utf-8")
+
+
+def _reintentar_o_estacionar(ruta: Path, error: str):
+    intento = _intentos(ruta) + 1
+    if intento >= MAX_INTENTOS:
+        logger.error("Inbox: %s estacionado en errores/ tras %s intentos", ruta.name, intento)
+        _estacionar(ruta, error)
+        return
+    espera = min(BACKOFF_MAX, BACKOFF * (2 ** (intento - 1)))
+    cuando = time.time() + random.uniform(espera / 2, espera)
+    destino = ENTRANTES / f"{_nombre_base(ruta)}~{intento}.json"
+    # el mtime marca cuándo toca; se fija antes del rename para que ningún
+    # worker lo vea en entrantes/ sin él
+    os.utime(ruta, (cuando, cuando))
+    os.replace(ruta, destino)
+    logger.warning("Inbox: %s falló (intento %s), reintento en %.0fs", ruta.name, intento, cuando - time.time())
+
+
+def reencolar_errores() -> int:
+    """Regresa a entrantes/ lo estacionado en errores/, con el contador de intentos en cero."""
+    _asegurar_dirs()
+    n = 0
+    for ruta in sorted(ERRORES.glob("*.json")):
+        try:
+            os.rename(ruta, ENTRANTES / f"{_nombre_base(ruta)}.json")
+        except FileNotFoundError:
+            continue
+        (ERRORES / f"{ruta.name}.err").unlink(missing_ok=True)
+        n += 1
+    return n
+
+
+def procesar_lote(rutas: list[Path]) -> dict:
+    """
+    Aplica cada payload y registra la latencia por etapa:
+      espera = recepción -> reclamo, lectura = disco + json, bd = procesar_payload.
+    """
+    stats = {"n": 0, "errores": 0, "espera_ms": [], "lectura_ms": 0.0, "bd_ms": 0.0}
+    reclamo_ns = time.time_ns()
+
+    for ruta in rutas:
+        stats["n"] += 1
+        stats["espera_ms"].append((reclamo_ns - _recibido_ns(ruta)) / 1e6)
+
+        t0 = time.perf_counter()
+        try:
+            body = json.loads(ruta.read_bytes().decode("utf-8"))
+        except Exception as e:
+            # payload inválido: reintentar no lo arregla, pero se conserva para revisarlo
+            stats["lectura_ms"] += (time.perf_counter() - t0) * 1000
+            stats["errores"] += 1
+            logger.error("Inbox: payload inválido %s: %s", ruta.name, e)
+            _estacionar(ruta, f"payload inválido: {e}")
+            continue
+        t1 = time.perf_counter()
+        stats["lectura_ms"] += (t1 - t0) * 1000
+
+        try:
+            procesar_payload(body)
+        except Exception as e:
+            stats["errores"] += 1
+            logger.exception("Inbox: fallo procesando %s", ruta.name)
+            _reintentar_o_estacionar(ruta, str(e))
+        else:
+            ruta.unlink(missing_ok=True)
+        stats["bd_ms"] += (time.perf_counter() - t1) * 1000
+
+    if stats["n"]:
+        espera = sorted(stats["espera_ms"])
+        logger.info(
+            "Inbox: lote=%s errores=%s espera_p50=%.1fms espera_max=%.1fms lectura=%.1fms bd=%.1fms",
+            stats["n"],
+            stats["errores"],
+            espera[len(espera) // 2],
+            espera[-1],
+            stats["lectura_ms"],
+            stats["bd_ms"],
+        )
+    return stats
+
+
+_ultima_revision = 0.0
+_revision_lock = threading.Lock()
+
+
+def _revisar_huerfanos():
+    """recuperar_huerfanos al arrancar y luego a lo más cada medio HUERFANO_SEGUNDOS."""
+    global _ultima_revision
+    with _revision_lock:
+        ahora = time.monotonic()
+        if _ultima_revision and ahora - _ultima_revision < HUERFANO_SEGUNDOS / 2:
+            return
+        _ultima_revision = ahora
+    n = recuperar_huerfanos()
+    if n:
+        logger.warning("Inbox: %s payloads huérfanos regresados a entrantes/", n)
+
+
+def drenar(limite: int = LOTE) -> int:
+    """Procesa lotes hasta vaciar entrantes/. Regresa cuántos payloads tomó."""
+    _revisar_huerfanos()
+    total = 0
+    while True:
+        rutas = reclamar(limite)
+        if not rutas:
+            return total
+        procesar_lote(rutas)
+        total += len(rutas)
+
+
+def recuperar_huerfanos(edad_segundos: int = HUERFANO_SEGUNDOS) -> int:
+    """
+    Regresa a entrantes/ lo que quedó en procesando/ por un worker que murió
+    a medio lote. Es seguro reprocesar: la ingesta descarta wa_message_id repetidos.
+    """
+    _asegurar_dirs()
+    limite = time.time() - edad_segundos
+    n = 0
+    for ruta in PROCESANDO.glob("*.json"):
+        try:
+            if ruta.stat().st_mtime < limite:
+                os.rename(ruta, ENTRANTES / ruta.name)
+                n += 1
+        except FileNotFoundError:
+            continue
+    return n
+
+
+despachador = Despachador("wa-inbox", drenar, hilos=HILOS)
@@ -0,0 +1,257 @@
+# digitales/ingesta.py
+from collections import Counter
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import media_cache, miniaturas
+from .models import MEDIA_TYPES, ClientesDigitales, MensajeWhatsApp, normaliza_tel_mx, preview_mensaje
+from .contacto import obtener_mensaje_whatsapp, replace_start
+from .eventos import publicar_mensajes, publicar_status
+from .idempotencia import wa_ids_vistos
+from .workers import en_segundo_plano
+
+# Media entrante: se baja a la caché local en cuanto llega, no cuando alguien abre el chat
+PRECARGA_MEDIA = bool(getattr(settings, "WHATSAPP_MEDIA_PRECARGA", True))
+PRECARGA_HILOS = int(getattr(settings, "WHATSAPP_MEDIA_PRECARGA_HILOS", 2))
+
+
+def procesar_payload(body: dict):
+    """
+    Aplica a BD un payload del webhook de Meta (mensajes entrantes y statuses).
+    Se ejecuta fuera del request, desde el worker del inbox.
+
+    Todo el payload se resuelve por lotes: el número de queries es constante
+    sin importar cuántos mensajes o statuses traiga.
+    """
+    entrantes, estados = _extraer(body)
+
+    # filtro en memoria: reintentos de Meta ya vistos no tocan la BD
+    entrantes = [e for e in entrantes if not wa_ids_vistos.contiene(e["wa_id"])]
+    if not (entrantes or estados):
+        return
+
+    with transaction.atomic():
+        if entrantes:
+            _guardar_entrantes(entrantes)
+        if estados:
+            _aplicar_estados(estados)
+
+
+def _extraer(body: dict) -> tuple[list[dict], list[dict]]:
+    entrantes = {}
+    estados = []
+
+    for entry in body.get("entry") or []:
+        for ch in entry.get("changes") or []:
+            value = ch.get("value") or {}
+
+            contacts = value.get("contacts") or []
+            nombres = {}
+            for c in contacts:
+                nombre = (c.get("profile") or {}).get("name", "") or ""
+                if c.get("wa_id") and nombre:
+                    nombres[c["wa_id"]] = nombre
+            profile_name = ""
+            if contacts:
+                profile_name = (contacts[0].get("profile") or {}).get("name", "") or ""
+
+            # ✅ 1) Mensajes
+            for msg in value.get("messages") or []:
+                wa_from = msg.get("from", "")
+                tel = normaliza_tel_mx(replace_start(wa_from))
+                wa_id = msg.get("id", "") or ""
+                if not tel or not wa_id or wa_id in entrantes:
+                    continue
+
+                entrantes[wa_id] = {
+                    "tel": tel,
+                    "wa_id": wa_id,
+                    "text": obtener_mensaje_whatsapp(msg),
+                    "nombre": nombres.get(wa_from) or profile_name,
+                    "raw": msg,  # ✅ mejor guardar el mensaje, no todo el webhook
+                }
+
+            # ✅ 2) Statuses
+            for s in value.get("statuses") or []:
+                if s.get("id") and s.get("status"):
+                    estados.append(s)
+
+    return list(entrantes.values()), estados
+
+
+def _media(msg: dict) -> dict:
+    # el webhook trae id, mime_type y sha256; el tamaño se conoce al bajarlo
+    t = msg.get("type") or ""
+    if t not in MEDIA_TYPES:
+        return {}
+    payload = msg.get(t) or {}
+    return {
+        "media_id": payload.get("id") or "",
+        "media_mime": payload.get("mime_type") or "",
+        "media_sha256": payload.get("sha256") or "",
+        "media_tipo": t,
+        "media_nombre": (payload.get("filename") or "")[:255],
+    }
+
+
+def _precargar_media(msgs):
+    for media_id in dict.fromkeys(m.media_id for m in msgs if m.media_id):
+        en_segundo_plano("wa-media-precarga", _precargar, media_id, max_workers=PRECARGA_HILOS)
+
+
+def _precargar(media_id: str):
+    meta = media_cache.obtener(media_id)
+    if miniaturas.disponible(meta["content_type"].split("/")[0]):
+        miniaturas.obtener(media_id)
+
+
+def _nombres(entrantes: list[dict]) -> dict[str, str]:
+    nombres = {}
+    for e in entrantes:
+        if e["nombre"] and not nombres.get(e["tel"]):
+            nombres[e["tel"]] = e["nombre"]
+    return nombres
+
+
+def _clientes_por_telefono(entrantes: list[dict]) -> dict[str, ClientesDigitales]:
+    nombres = _nombres(entrantes)
+    tels = {e["tel"] for e in entrantes}
+
+    clientes = {c.telefono: c for c in ClientesDigitales.objects.filter(telefono__in=tels)}
+    faltantes = tels - clientes.keys()
+    if faltantes:
+        nuevos = [ClientesDigitales(telefono=t, nombre=nombres.get(t, "")) for t in faltantes]
+        try:
+            with transaction.atomic():
+                ClientesDigitales.objects.bulk_create(nuevos)
+        except IntegrityError:
+            # otro worker creó alguno en paralelo; lo que falte se crea uno por uno
+            for t in faltantes:
+                ClientesDigitales.objects.get_or_create(telefono=t, defaults={"nombre": nombres.get(t, "")})
+        clientes.update({c.telefono: c for c in ClientesDigitales.objects.filter(telefono__in=faltantes)})
+
+    return clientes
+
+
+def _actualizar_clientes(clientes: dict[str, ClientesDigitales], entrantes: list[dict], msgs: list[MensajeWhatsApp]):
+    """
+    Un solo UPDATE para todos los clientes del lote: nombre si no tenía,
+    fechas de contacto, snapshot del último mensaje y el contador de no
+    leídos incrementado en BD (atómico frente a mark_read).
+    """
+    nombres = _nombres(entrantes)
+    now = timezone.now()
+    conteo = Counter(e["tel"] for e in entrantes)
+    ultimo = {m.telefono: m for m in msgs}  # msgs viene en orden de llegada
+
+    def por_cliente(campo, valor, default=None):
+        return Case(
+            *[When(pk=c.pk, then=Value(valor(tel))) for tel, c in clientes.items()],
+            default=F(campo) if default is None else default,
+            output_field=ClientesDigitales._meta.get_field(campo),
+        )
+
+    cambios = {
+        "primer_contacto_at": Coalesce("primer_contacto_at", Value(now)),
+        "ultimo_contacto_at": Value(now),
+        "actualizado": Value(now),
+        "unread_count": F("unread_count") + por_cliente("unread_count", lambda t: conteo[t], Value(0)),
+        "ultimo_msg_id": por_cliente("ultimo_msg_id", lambda t: ultimo[t].pk),
+        "ultimo_msg_preview": por_cliente("ultimo_msg_preview", lambda t: preview_mensaje(ultimo[t].body)),
+        "ultimo_msg_direction": Value("in"),
+        "ultimo_msg_at": por_cliente("ultimo_msg_at", lambda t: ultimo[t].created_at),
+    }
+    con_nombre = [When(pk=c.pk, nombre="", then=Value(nombres[tel])) for tel, c in clientes.items() if nombres.get(tel)]
+    if con_nombre:
+        cambios["nombre"] = Case(*con_nombre, default=F("nombre"))
+    ClientesDigitales.objects.filter(pk__in=[c.pk for c in clientes.values()]).update(**cambios)
+
+
+def _insertar_entrantes(entrantes: list[dict]):
+    clientes = _clientes_por_telefono(entrantes)
+
+    msgs = MensajeWhatsApp.bulk_guardar([
+        MensajeWhatsApp(
+            telefono=e["tel"],
+            cliente=clientes.get(e["tel"]),
+            direction="in",
+            body=e["text"],
+            wa_message_id=e["wa_id"],
+            status="received",
+            raw=e["raw"],
+            **_media(e["raw"]),
+        )
+        for e in entrantes
+    ])
+    _actualizar_clientes(clientes, entrantes, msgs)
+    transaction.on_commit(lambda: publicar_mensajes(msgs))
+    if PRECARGA_MEDIA:
+        transaction.on_commit(lambda: _precargar_media(msgs))
+
+
+def _guardar_entrantes(entrantes: list[dict]):
+    # insert optimista; el índice único de wa_message_id es quien decide
+    try:
+        with transaction.atomic():
+            _insertar_entrantes(entrantes)
+    except IntegrityError:
+        # fallback: algún id ya estaba en BD (otro proceso o cache frío)
+        ya = set(
+            MensajeWhatsApp.objects
+            .filter(wa_message_id__in=[e["wa_id"] for e in entrantes])
+            .values_list("wa_message_id", flat=True)
+        )
+        wa_ids_vistos.agregar(ya)
+        entrantes = [e for e in entrantes if e["wa_id"] not in ya]
+        if not entrantes:
+            return
+        _insertar_entrantes(entrantes)
+
+    # solo ya confirmados: si la transacción de afuera se revierte, el
+    # reintento del payload tiene que volver a insertarlos
+    ids = [e["wa_id"] for e in entrantes]
+    transaction.on_commit(lambda: wa_ids_vistos.agregar(ids))
+
+
+def _sello(ts) -> datetime | None:
+    try:
+        return datetime.fromtimestamp(int(ts), tz=dt_timezone.utc)
+    except (TypeError, ValueError):
+        return None
+
+
+def _aplicar_estados(estados: list[dict]):
+    # solo columnas de status: el raw (JSON grande) ni se lee ni se reescribe
+    msgs = {
+        m.wa_message_id: m
+        for m in (
+            MensajeWhatsApp.objects
+            .filter(wa_message_id__in={s["id"] for s in estados})
+            .only(
+                "id", "telefono", "wa_message_id", "status",
+                "sent_at", "delivered_at", "read_at", "failed_at", "error_code", "error_title",
+            )
+        )
+    }
+
+    cambiados = {}
+    campos = set()
+    for s in estados:
+        msg = msgs.get(s["id"])
+        if not msg:
+            continue
+
+        modificados = msg.avanzar_status(s["status"], when=_sello(s.get("timestamp")), errors=s.get("errors"))
+        if modificados:
+            cambiados[msg.pk] = msg
+            campos.update(modificados)
+
+    # callbacks repetidos o atrasados no cuestan escritura
+    if cambiados:
+        MensajeWhatsApp.objects.bulk_update(cambiados.values(), sorted(campos))
+        transaction.on_commit(lambda: publicar_status(cambiados.values()))
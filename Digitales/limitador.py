@@ -0,0 +1,135 @@
+# digitales/limitador.py
+"""
+Token bucket compartido entre procesos/hilos para las llamadas a Graph.
+
+El estado vive en un archivo SQLite local (una fila por cubeta), así todos
+los workers de la máquina (gunicorn, procesar_webhooks, campañas) respetan
+el mismo techo. Cuando Meta responde con throttling, la cubeta se pausa y
+su tasa baja a la mitad; se recupera sola conforme pasa el tiempo sin
+nuevos rechazos.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+RUTA = Path(getattr(settings, "WHATSAPP_RATE_DB", Path(getattr(settings, "WHATSAPP_SPOOL_DIR", "spool")) / "graph_rate.sqlite3"))
+
+FACTOR_MINIMO = 0.1
+# cuánto recupera el factor por segundo sin throttling (0.5 -> 1.0 en ~10 s)
+RECUPERA_POR_SEGUNDO = 0.05
+ESPERA_MAXIMA = 1.0
+
+_local = threading.local()
+
+
+def _conexion() -> sqlite3.Connection:
+    # por hilo y por proceso, como en .eventos
+    clave = (os.getpid(), str(RUTA))
+    con = getattr(_local, "con", None)
+    if con is None or _local.clave != clave:
+        RUTA.parent.mkdir(parents=True, exist_ok=True)
+        con = sqlite3.connect(str(RUTA), timeout=5, isolation_level=None)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute(
+            "CREATE TABLE IF NOT EXISTS cubetas ("
+            " nombre TEXT PRIMARY KEY,"
+            " tokens REAL NOT NULL,"
+            " ts REAL NOT NULL,"
+            " factor REAL NOT NULL DEFAULT 1.0,"
+            " pausa_hasta REAL NOT NULL DEFAULT 0)"
+        )
+        _local.con, _local.clave = con, clave
+    return con
+
+
+class CubetaTokens:
+    def __init__(self, nombre: str, tasa: float, capacidad: float | None = None):
+        self.nombre = nombre
+        self.tasa = float(tasa)
+        self.capacidad = float(capacidad or tasa)
+
+    def _transaccion(self, fn):
+        con = _conexion()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            fila = con.execute(
+                "SELECT tokens, ts, factor, pausa_hasta FROM cubetas WHERE nombre = ?",
+                (self.nombre,),
+            ).fetchone()
+            ahora = time.time()
+            if fila is None:
+                fila = (self.capacidad, ahora, 1.0, 0.0)
+                con.execute(
+                    "INSERT INTO cubetas (nombre, tokens, ts, factor, pausa_hasta) VALUES (?, ?, ?, ?, ?)",
+                    (self.nombre, *fila),
+                )
+            tokens, ts, factor, pausa_hasta = fila
+            transcurrido = max(0.0, ahora - ts)
+            factor = min(1.0, factor + transcurrido * RECUPERA_POR_SEGUNDO)
+            tokens = min(self.capacidad * factor, tokens + transcurrido * self.tasa * factor)
+
+            tokens, factor, pausa_hasta, resultado = fn(ahora, tokens, factor, pausa_hasta)
+
+            con.execute(
+                "UPDATE cubetas SET tokens = ?, ts = ?, factor = ?, pausa_hasta = ? WHERE nombre = ?",
+                (tokens, ahora, factor, pausa_hasta, self.nombre),
+            )
+            con.execute("COMMIT")
+            return resultado
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+
+    def _intentar(self) -> float:
+        def fn(ahora, tokens, factor, pausa_hasta):
+            if pausa_hasta > ahora:
+                return tokens, factor, pausa_hasta, pausa_hasta - ahora
+            if tokens >= 1:
+                return tokens - 1, factor, pausa_hasta, 0.0
+            return tokens, factor, pausa_hasta, (1 - tokens) / (self.tasa * factor)
+
+        return self._transaccion(fn)
+
+    def tomar(self, hasta: float | None = None) -> bool:
+        """
+        Bloquea hasta que haya un token disponible. Con `hasta` (time.monotonic)
+        no espera más allá: regresa False si el token llegaría después.
+        """
+        if self.tasa <= 0:
+            return True
+        while True:
+            try:
+                espera = self._intentar()
+            except sqlite3.Error:
+                # si el archivo no está disponible no frenamos los envíos
+                logger.exception("Limitador %s: no se pudo leer la cubeta", self.nombre)
+                return True
+            if espera <= 0:
+                return True
+            if hasta is not None and time.monotonic() + espera > hasta:
+                return False
+            time.sleep(min(espera, ESPERA_MAXIMA))
+
+    def frenar(self, segundos: float):
+        """Meta nos frenó: pausa la cubeta `segundos` y baja la tasa a la mitad."""
+        def fn(ahora, tokens, factor, pausa_hasta):
+            # varios rechazos de la misma ráfaga cuentan como uno solo
+            if pausa_hasta <= ahora:
+                factor = max(FACTOR_MINIMO, factor / 2)
+            return 0.0, factor, max(pausa_hasta, ahora + segundos), None
+
+        try:
+            self._transaccion(fn)
+        except sqlite3.Error:
+            logger.exception("Limitador %s: no se pudo registrar el throttling", self.nombre)
+
+
+mensajes = CubetaTokens("mensajes", float(getattr(settings, "WHATSAPP_GRAPH_MPS", 80)))
+media = CubetaTokens("media", float(getattr(settings, "WHATSAPP_GRAPH_MEDIA_RPS", 20)))
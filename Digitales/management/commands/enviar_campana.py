@@ -0,0 +1,29 @@
+# digitales/management/commands/enviar_campana.py
+from django.core.management.base import BaseCommand
+
+from Digitales.campanas import ejecutar_campana
+from Digitales.models import CampanaEnvio
+
+
+class Command(BaseCommand):
+    help = "Envía (o reanuda) campañas de plantillas de WhatsApp en este proceso."
+
+    def add_arguments(self, parser):
+        parser.add_argument("ids", nargs="*", type=int, help="ids de campaña; vacío = las pendientes y las que quedaron a medias")
+
+    def handle(self, *args, **opts):
+        ids = opts["ids"] or list(
+            CampanaEnvio.objects
+            .filter(estado__in=[CampanaEnvio.Estado.PENDIENTE, CampanaEnvio.Estado.ENVIANDO])
+            .order_by("id")
+            .values_list("id", flat=True)
+        )
+        for pk in ids:
+            # las que otro proceso está enviando (latido al día) no se tocan
+            if not ejecutar_campana(pk):
+                self.stdout.write(f"Campaña {pk}: no se tomó (terminada, cancelada o en curso en otro proceso)")
+                continue
+            c = CampanaEnvio.objects.get(pk=pk)
+            self.stdout.write(self.style.SUCCESS(
+                f"Campaña {pk}: {c.estado} ({c.enviados} enviados, {c.fallidos} fallidos de {c.total})"
+            ))
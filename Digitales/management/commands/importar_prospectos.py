@@ -0,0 +1,41 @@
+# digitales/management/commands/importar_prospectos.py
+import csv
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from Digitales.importacion import FORMATOS, LOTE, ErrorImportacion, formato_por_nombre, importar, leer_filas
+
+
+class Command(BaseCommand):
+    help = "Importa (o actualiza) prospectos desde un CSV, XLSX o JSONL."
+
+    def add_arguments(self, parser):
+        parser.add_argument("archivo")
+        parser.add_argument("--formato", choices=FORMATOS, help="por defecto, según la extensión")
+        parser.add_argument("--lote", type=int, default=LOTE)
+        parser.add_argument("--no-actualizar", action="store_true", help="no toca los teléfonos que ya existen")
+        parser.add_argument("--errores", help="escribe aquí el reporte de filas inválidas (CSV)")
+
+    def handle(self, *args, **opts):
+        formato = opts["formato"] or formato_por_nombre(opts["archivo"])
+        inicio = time.monotonic()
+        try:
+            with open(opts["archivo"], "rb") as fh:
+                reporte = importar(leer_filas(fh, formato), lote=opts["lote"], actualizar=not opts["no_actualizar"])
+        except (OSError, ErrorImportacion, UnicodeDecodeError) as e:
+            raise CommandError(str(e))
+
+        if opts["errores"] and reporte["errores"]:
+            with open(opts["errores"], "w", newline="", encoding="utf-8") as fh:
+                w = csv.DictWriter(fh, fieldnames=["fila", "error"])
+                w.writeheader()
+                w.writerows(reporte["errores"])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{reporte['total']} filas en {time.monotonic() - inicio:.1f}s: "
+            f"{reporte['creados']} creados, {reporte['actualizados']} actualizados, "
+            f"{reporte['omitidos']} omitidos, {reporte['errores_total']} con error"
+        ))
+        for e in reporte["errores"][:20]:
+            self.stderr.write(f"  fila {e['fila']}: {e['error']}")
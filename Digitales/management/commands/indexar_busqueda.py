@@ -0,0 +1,38 @@
+# digitales/management/commands/indexar_busqueda.py
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from Digitales import busqueda
+
+
+class Command(BaseCommand):
+    help = (
+        "Sincroniza el índice de búsqueda (FTS5) de prospectos y mensajes. "
+        "Es lo único que lo escribe: en producción corre con --continuo."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rehacer", action="store_true", help="borra el índice y lo llena desde cero")
+        parser.add_argument("--continuo", action="store_true", help="sigue sincronizando cada --intervalo segundos")
+        parser.add_argument("--intervalo", type=float, default=busqueda.INTERVALO)
+        parser.add_argument("--purgar", action="store_true", help="quita ya lo borrado en BD sin esperar WHATSAPP_BUSQUEDA_PURGA")
+
+    def handle(self, *args, **opts):
+        inicio = time.monotonic()
+        n = busqueda.rehacer() if opts["rehacer"] else busqueda.sincronizar()
+        if opts["purgar"]:
+            borrados = busqueda.purgar()
+            self.stdout.write(f"Quitados {borrados['clientes']} clientes y {borrados['mensajes']} mensajes borrados")
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexados {n['clientes']} clientes y {n['mensajes']} mensajes en {time.monotonic() - inicio:.1f}s"
+        ))
+        while opts["continuo"]:
+            time.sleep(opts["intervalo"])
+            try:
+                busqueda.sincronizar()
+            except Exception as e:
+                self.stderr.write(f"Búsqueda: {e}")
+            finally:
+                close_old_connections()
@@ -0,0 +1,81 @@
+# digitales/management/commands/normalizar_telefonos.py
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError
+from django.db.models import Count
+
+from citas.models import Citas, CitasPiso, PruebasManejo
+from CrmConformidad.models import Cliente
+from Digitales.models import ClientesDigitales, normaliza_tel_mx
+
+MODELOS = (Citas, CitasPiso, PruebasManejo, Cliente)
+
+
+class Command(BaseCommand):
+    help = (
+        "Llena telefono_norm en citas, citas de piso, pruebas de manejo y clientes "
+        "de conformidad, y reporta teléfonos duplicados."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lote", type=int, default=500)
+        parser.add_argument("--duplicados", action="store_true", help="además lista teléfonos repetidos por tabla")
+        parser.add_argument("--top", type=int, default=20, help="cuántos duplicados mostrar por tabla")
+
+    def handle(self, *args, **opts):
+        for modelo in MODELOS:
+            nombre = modelo._meta.db_table
+            try:
+                n = self.llenar(modelo, opts["lote"])
+            except DatabaseError as e:
+                self.stderr.write(f"{nombre}: no se pudo normalizar ({e})")
+                continue
+            self.stdout.write(self.style.SUCCESS(f"{nombre}: {n} teléfonos normalizados"))
+            if opts["duplicados"]:
+                self.duplicados(modelo, opts["top"])
+
+        if opts["duplicados"]:
+            self.prospectos_gemelos(opts["top"])
+
+    def llenar(self, modelo, lote: int) -> int:
+        pk = modelo._meta.pk.name
+        total, pendientes = 0, []
+        for obj in modelo.objects.only(pk, "telefono", "telefono_norm").iterator(chunk_size=2000):
+            norm = normaliza_tel_mx(obj.telefono)
+            if norm == obj.telefono_norm:
+                continue
+            obj.telefono_norm = norm
+            pendientes.append(obj)
+            if len(pendientes) >= lote:
+                modelo.objects.bulk_update(pendientes, ["telefono_norm"])
+                total += len(pendientes)
+                pendientes = []
+        if pendientes:
+            modelo.objects.bulk_update(pendientes, ["telefono_norm"])
+            total += len(pendientes)
+        return total
+
+    def duplicados(self, modelo, top: int):
+        grupos = (
+            modelo.objects
+            .exclude(telefono_norm="")
+            .values("telefono_norm")
+            .annotate(n=Count("pk"))
+            .filter(n__gt=1)
+            .order_by("-n", "telefono_norm")
+        )
+        total = grupos.count()
+        if not total:
+            return
+        self.stdout.write(f"  {total} teléfonos repetidos; los más frecuentes:")
+        for g in grupos[:top]:
+            self.stdout.write(f"    {g['telefono_norm']}: {g['n']} registros")
+
+    def prospectos_gemelos(self, top: int):
+        # el mismo celular como 52 + 10 (formularios) y 521 + 10 (WhatsApp)
+        tels = set(ClientesDigitales.objects.values_list("telefono", flat=True))
+        gemelos = sorted(t for t in tels if len(t) == 13 and t.startswith("521") and "52" + t[3:] in tels)
+        if not gemelos:
+            return
+        self.stdout.write(f"clientes_digitales: {len(gemelos)} prospectos duplicados como 52/521:")
+        for t in gemelos[:top]:
+            self.stdout.write(f"    {t} / 52{t[3:]}")
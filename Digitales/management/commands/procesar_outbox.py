@@ -0,0 +1,48 @@
+# digitales/management/commands/procesar_outbox.py
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from Digitales import outbox
+
+
+class Command(BaseCommand):
+    help = (
+        "Envía los mensajes pendientes del outbox de WhatsApp con un pool de workers. "
+        "Obligatorio si WHATSAPP_WORKERS_EN_WEB = False."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=outbox.HILOS)
+        parser.add_argument("--lote", type=int, default=outbox.LOTE)
+        parser.add_argument("--intervalo", type=float, default=1.0, help="segundos entre revisiones del outbox")
+        parser.add_argument("--once", action="store_true", help="envía lo pendiente y termina")
+
+    def handle(self, *args, **opts):
+        n = outbox.recuperar_huerfanos()
+        if n:
+            self.stdout.write(f"Marcados como fallidos {n} envíos interrumpidos")
+
+        if opts["once"]:
+            total = outbox.drenar(opts["lote"])
+            self.stdout.write(self.style.SUCCESS(f"Enviados {total} mensajes"))
+            return
+
+        def loop():
+            while True:
+                try:
+                    outbox.drenar(opts["lote"])
+                except Exception as e:
+                    self.stderr.write(f"Outbox: {e}")
+                finally:
+                    close_old_connections()
+                time.sleep(opts["intervalo"])
+
+        hilos = [threading.Thread(target=loop, daemon=True) for _ in range(max(1, opts["workers"]))]
+        for t in hilos:
+            t.start()
+        self.stdout.write(self.style.SUCCESS(f"Outbox: {len(hilos)} workers enviando"))
+        for t in hilos:
+            t.join()
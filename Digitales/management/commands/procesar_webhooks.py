@@ -0,0 +1,52 @@
+# digitales/management/commands/procesar_webhooks.py
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from Digitales import inbox
+
+
+class Command(BaseCommand):
+    help = "Drena el inbox local del webhook de WhatsApp con un pool de workers."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=inbox.HILOS)
+        parser.add_argument("--lote", type=int, default=inbox.LOTE)
+        parser.add_argument("--intervalo", type=float, default=1.0, help="segundos entre revisiones del spool")
+        parser.add_argument("--once", action="store_true", help="drena lo pendiente y termina")
+        parser.add_argument(
+            "--reencolar-errores",
+            action="store_true",
+            help="regresa a entrantes/ los payloads estacionados en errores/ antes de drenar",
+        )
+
+    def handle(self, *args, **opts):
+        n = inbox.recuperar_huerfanos()
+        if n:
+            self.stdout.write(f"Recuperados {n} payloads huérfanos")
+        if opts["reencolar_errores"]:
+            self.stdout.write(f"Reencolados {inbox.reencolar_errores()} payloads de errores/")
+
+        if opts["once"]:
+            total = inbox.drenar(opts["lote"])
+            self.stdout.write(self.style.SUCCESS(f"Procesados {total} payloads"))
+            return
+
+        def loop():
+            while True:
+                try:
+                    inbox.drenar(opts["lote"])
+                except Exception as e:
+                    self.stderr.write(f"Inbox: {e}")
+                finally:
+                    close_old_connections()
+                time.sleep(opts["intervalo"])
+
+        hilos = [threading.Thread(target=loop, daemon=True) for _ in range(max(1, opts["workers"]))]
+        for t in hilos:
+            t.start()
+        self.stdout.write(self.style.SUCCESS(f"Inbox: {len(hilos)} workers drenando {inbox.ENTRANTES}"))
+        for t in hilos:
+            t.join()
@@ -0,0 +1,31 @@
+# digitales/management/commands/recalcular_no_leidos.py
+from django.core.management.base import BaseCommand
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from Digitales.models import ClientesDigitales, MensajeWhatsApp
+
+
+def _contar(qs):
+    return Coalesce(Subquery(qs.annotate(n=Count("id")).values("n")[:1]), Value(0))
+
+
+class Command(BaseCommand):
+    help = "Recalcula ClientesDigitales.unread_count a partir de MensajeWhatsApp."
+
+    def handle(self, *args, **opts):
+        entrantes = (
+            MensajeWhatsApp.objects
+            .filter(telefono=OuterRef("telefono"), direction="in")
+            .order_by()
+            .values("telefono")
+        )
+        # dos UPDATE set-based: sin leer nunca y leídos hasta last_read_at
+        nunca = ClientesDigitales.objects.filter(last_read_at__isnull=True).update(
+            unread_count=_contar(entrantes),
+        )
+        leidos = ClientesDigitales.objects.filter(last_read_at__isnull=False).update(
+            unread_count=_contar(entrantes.filter(created_at__gt=OuterRef("last_read_at"))),
+        )
+
+        self.stdout.write(self.style.SUCCESS(f"unread_count recalculado para {nunca + leidos} clientes"))
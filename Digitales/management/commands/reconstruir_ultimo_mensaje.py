@@ -0,0 +1,27 @@
+# digitales/management/commands/reconstruir_ultimo_mensaje.py
+from django.core.management.base import BaseCommand
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Left
+
+from Digitales.models import ClientesDigitales, MensajeWhatsApp
+
+
+class Command(BaseCommand):
+    help = "Reconstruye el snapshot del último mensaje (ultimo_msg_*) de cada ClientesDigitales."
+
+    def handle(self, *args, **opts):
+        ultimo = (
+            MensajeWhatsApp.objects
+            .filter(telefono=OuterRef("telefono"))
+            .order_by("-created_at", "-id")
+        )
+
+        # mantenimiento: un UPDATE set-based; el preview queda sin normalizar espacios
+        n = ClientesDigitales.objects.update(
+            ultimo_msg_id=Subquery(ultimo.values("id")[:1]),
+            ultimo_msg_preview=Coalesce(Left(Subquery(ultimo.values("body")[:1]), 255), Value("")),
+            ultimo_msg_direction=Coalesce(Subquery(ultimo.values("direction")[:1]), Value("")),
+            ultimo_msg_at=Subquery(ultimo.values("created_at")[:1]),
+        )
+
+        self.stdout.write(self.style.SUCCESS(f"Snapshot reconstruido para {n} clientes"))
@@ -0,0 +1,338 @@
+# digitales/media_cache.py
+"""
+Caché en disco de la media de WhatsApp (MEDIA_ROOT/wa_cache), por media_id.
+
+Cada media se guarda una sola vez: `<media_id>` con el binario y
+`<media_id>.json` con content_type, tamaño, sha256 (el ETag) y fecha. El
+mtime del binario hace de marca LRU; al pasar del tope se borra lo que lleva
+más tiempo sin pedirse. En un miss, solo una descarga por media_id baja de
+Meta, en segundo plano y hasta terminar aunque el cliente que la pidió se
+vaya; quien la pide mientras tanto (el primero incluido) sigue el archivo
+temporal conforme crece, sin candado de por medio.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+
+from .contacto import abrir_media_whatsapp
+from .models import MensajeWhatsApp
+from .workers import en_segundo_plano
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = Path(getattr(settings, "WHATSAPP_MEDIA_CACHE_DIR", Path(settings.MEDIA_ROOT) / "wa_cache"))
+CACHE_MAX_BYTES = int(getattr(settings, "WHATSAPP_MEDIA_CACHE_MB", 2048)) * 1024 * 1024
+CHUNK = 64 * 1024
+# no re-tocar el mtime en cada hit: basta con saber qué se usó "recientemente"
+TOQUE_MINIMO = 60
+# descargas simultáneas de Meta por proceso
+DESCARGAS = int(getattr(settings, "WHATSAPP_MEDIA_DESCARGAS", 8))
+# cada cuánto revisa un lector que espera más bytes (por si se pierde un aviso)
+ESPERA_AVANCE = 5
+
+_MEDIA_ID = re.compile(r"[0-9A-Za-z_-]{1,128}")
+
+
+def _rutas(media_id: str) -> tuple[Path, Path]:
+    if not _MEDIA_ID.fullmatch(media_id or ""):
+        raise ValueError("media_id inválido")
+    carpeta = CACHE_DIR / media_id[-2:]
+    return carpeta / media_id, carpeta / f"{media_id}.json"
+
+
+def ruta_derivada(media_id: str, sufijo: str) -> Path:
+    """Archivo generado a partir de la media (p. ej. miniatura); entra al mismo LRU."""
+    ruta, _ = _rutas(media_id)
+    return ruta.with_name(f"{ruta.name}.{sufijo}")
+
+
+def leer(media_id: str) -> dict | None:
+    """Metadatos + ruta si la media ya está en caché; marca el acceso para el LRU."""
+    ruta, ruta_meta = _rutas(media_id)
+    try:
+        meta = json.loads(ruta_meta.read_text("utf-8"))
+        st = ruta.stat()
+    except (OSError, ValueError):
+        return None
+    if st.st_size != meta.get("size"):
+        return None
+
+    if time.time() - st.st_mtime > TOQUE_MINIMO:
+        try:
+            os.utime(ruta)
+        except OSError:
+            pass
+    meta["ruta"] = ruta
+    return meta
+
+
+_vuelos: dict[str, list] = {}
+_vuelos_lock = threading.Lock()
+
+
+@contextmanager
+def un_vuelo(clave: str):
+    """Un candado por clave, vivo solo mientras alguien lo use."""
+    with _vuelos_lock:
+        entrada = _vuelos.setdefault(clave, [threading.Lock(), 0])
+        entrada[1] += 1
+    try:
+        with entrada[0]:
+            yield
+    finally:
+        with _vuelos_lock:
+            entrada[1] -= 1
+            if not entrada[1]:
+                _vuelos.pop(clave, None)
+
+
+def obtener(media_id: str) -> dict:
+    """Regresa la media desde caché; si no está, espera a que termine su descarga."""
+    meta, descarga = _iniciar(media_id)
+    if descarga is None:
+        return meta
+    descarga.esperar()
+    meta = leer(media_id)
+    if meta is None:
+        raise RuntimeError(f"No se pudo guardar la media {media_id} en caché")
+    return meta
+
+
+def transmitir(media_id: str) -> dict:
+    """
+    Como obtener(), pero en un miss no espera la descarga completa: el meta
+    trae `stream`, un iterable que sigue al archivo conforme llega de Meta
+    (el primer byte sale al cliente en cuanto está en disco). Hay que cerrarlo.
+    """
+    meta, descarga = _iniciar(media_id)
+    if descarga is None:
+        return meta
+    return {
+        "media_id": media_id,
+        "content_type": descarga.content_type,
+        "size": descarga.size,
+        "stream": _Seguidor(descarga),
+    }
+
+
+_descargas: dict[str, "_Descarga"] = {}
+_descargas_lock = threading.Lock()
+
+
+def _iniciar(media_id: str) -> tuple[dict | None, "_Descarga | None"]:
+    """(meta, None) si ya está en caché; si no, (None, descarga en curso)."""
+    meta = leer(media_id)
+    if meta:
+        return meta, None
+    # el candado solo cubre decidir quién abre la conexión a Meta, no la descarga
+    with un_vuelo(media_id):
+        meta = leer(media_id)
+        if meta:
+            return meta, None
+        with _descargas_lock:
+            descarga = _descargas.get(media_id)
+        if descarga is None:
+            r, info = abrir_media_whatsapp(media_id)
+            descarga = _Descarga(media_id, r, info)
+            with _descargas_lock:
+                _descargas[media_id] = descarga
+            en_segundo_plano("wa-media-descarga", descarga.correr, max_workers=DESCARGAS)
+    return None, descarga
+
+
+class _Descarga:
+    """Una bajada de Meta al temporal de la caché; avisa a sus seguidores por cada chunk."""
+
+    def __init__(self, media_id: str, r, info: dict):
+        self.media_id = media_id
+        self.r = r
+        self.info = info
+        self.content_type = _content_type(r, info)
+        try:
+            self.size = int(r.headers.get("content-length") or 0) or None
+        except ValueError:
+            self.size = None
+        ruta, _ = _rutas(media_id)
+        ruta.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=ruta.parent, prefix=".tmp-")
+        self.fd, self.tmp, self.ruta = fd, Path(tmp), ruta
+        self.escritos = 0
+        self.terminada = False
+        self.error: BaseException | None = None
+        self.avance = threading.Condition()
+
+    def correr(self):
+        try:
+            for chunk in _bajar(self.media_id, self.r, self.info, destino=(self.fd, self.tmp)):
+                with self.avance:
+                    self.escritos += len(chunk)
+                    self.avance.notify_all()
+        except BaseException as e:
+            self.error = e
+            logger.warning("Caché de media: falló la descarga de %s: %s", self.media_id, e)
+        finally:
+            with _descargas_lock:
+                _descargas.pop(self.media_id, None)
+            with self.avance:
+                self.terminada = True
+                self.avance.notify_all()
+
+    def esperar_bytes(self, leidos: int) -> bool:
+        """Bloquea hasta que haya más de `leidos` bytes en disco; False si ya no habrá más."""
+        with self.avance:
+            while self.escritos <= leidos and not self.terminada:
+                self.avance.wait(ESPERA_AVANCE)
+            if self.escritos > leidos:
+                return True
+            if self.error is not None:
+                raise RuntimeError(f"Descarga de media interrumpida: {self.error}")
+            return False
+
+    def esperar(self):
+        with self.avance:
+            while not self.terminada:
+                self.avance.wait(ESPERA_AVANCE)
+        if self.error is not None:
+            raise self.error
+
+    def abrir(self):
+        # al terminar el temporal se renombra al definitivo; el fd abierto sigue valiendo
+        for ruta in (self.tmp, self.ruta):
+            try:
+                return open(ruta, "rb")
+            except FileNotFoundError:
+                continue
+        if self.error is not None:
+            raise RuntimeError(f"Descarga de media interrumpida: {self.error}")
+        raise FileNotFoundError(self.ruta)
+
+
+class _Seguidor:
+    """Lee el archivo de una _Descarga conforme crece. Cerrarlo no corta la descarga."""
+
+    def __init__(self, descarga: _Descarga):
+        self.descarga = descarga
+        self.fh = descarga.abrir()
+
+    def __iter__(self):
+        leidos = 0
+        while True:
+            chunk = self.fh.read(CHUNK)
+            if chunk:
+                leidos += len(chunk)
+                yield chunk
+            elif not self.descarga.esperar_bytes(leidos):
+                return
+
+    def close(self):
+        self.fh.close()
+
+
+def _content_type(r, info: dict) -> str:
+    return r.headers.get("content-type") or info.get("mime_type") or "application/octet-stream"
+
+
+def _bajar(media_id: str, r, info: dict, destino: tuple[int, Path] | None = None):
+    """
+    Copia el cuerpo de `r` a la caché por chunks, regresándolos conforme
+    llegan (ya escritos al temporal `destino`, para quien lo esté leyendo).
+    """
+    ruta, ruta_meta = _rutas(media_id)
+    ruta.parent.mkdir(parents=True, exist_ok=True)
+
+    sha = hashlib.sha256()
+    size = 0
+    fd, tmp = destino or tempfile.mkstemp(dir=ruta.parent, prefix=".tmp-")
+    try:
+        with r, os.fdopen(fd, "wb") as fh:
+            for chunk in r.iter_content(CHUNK):
+                fh.write(chunk)
+                fh.flush()
+                sha.update(chunk)
+                size += len(chunk)
+                yield chunk
+        os.replace(tmp, ruta)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+    meta = {
+        "media_id": media_id,
+        "content_type": _content_type(r, info),
+        "size": size,
+        "sha256": sha.hexdigest(),
+        "guardado": time.time(),
+    }
+    tmp_meta = ruta_meta.with_name(f".tmp-{ruta_meta.name}")
+    tmp_meta.write_text(json.dumps(meta), "utf-8")
+    os.replace(tmp_meta, ruta_meta)
+
+    MensajeWhatsApp.registrar_media(media_id, meta["content_type"], size, meta["sha256"])
+    contar(size)
+
+
+_total = None
+_total_lock = threading.Lock()
+
+
+def contar(size: int):
+    """Suma bytes nuevos al total de la caché y desaloja si se pasó del tope."""
+    global _total
+    with _total_lock:
+        if _total is None:
+            _total = sum(t for _, t, _ in _archivos())
+        else:
+            _total += size
+        excedido = _total > CACHE_MAX_BYTES
+    if excedido:
+        desalojar()
+
+
+def _archivos():
+    if not CACHE_DIR.exists():
+        return
+    for carpeta in CACHE_DIR.iterdir():
+        if not carpeta.is_dir():
+            continue
+        for ruta in carpeta.iterdir():
+            if ruta.suffix == ".json" or ruta.name.startswith(".tmp-"):
+                continue
+            try:
+                st = ruta.stat()
+            except OSError:
+                continue
+            yield ruta, st.st_size, st.st_mtime
+
+
+def desalojar(objetivo: float = 0.9) -> int:
+    """Borra lo menos usado hasta quedar en `objetivo` del tope. Regresa bytes liberados."""
+    global _total
+    with _total_lock:
+        archivos = sorted(_archivos(), key=lambda x: x[2])
+        total = sum(t for _, t, _ in archivos)
+        liberados = 0
+        for ruta, size, _ in archivos:
+            if total - liberados <= CACHE_MAX_BYTES * objetivo:
+                break
+            for r in (ruta, ruta.with_name(f"{ruta.name}.json")):
+                try:
+                    r.unlink()
+                except FileNotFoundError:
+                    pass
+            liberados += size
+        _total = total - liberados
+    if liberados:
+        logger.info("Caché de media: liberados %.1f MB", liberados / (1024 * 1024))
+    return liberados
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.5 on 2026-10-18 15:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Digitales', '0003_campanameta'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mensajewhatsapp',
+            name='delivered_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='mensajewhatsapp',
+            name='error_code',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='mensajewhatsapp',
+            name='error_title',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='mensajewhatsapp',
+            name='failed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='mensajewhatsapp',
+            name='read_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='mensajewhatsapp',
+            name='sent_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.5 on 2026-10-18 15:25
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def borrar_duplicados(apps, schema_editor):
+    # Reentregas de Meta que se colaron antes del índice único: se conserva la primera copia.
+    MensajeWhatsApp = apps.get_model("Digitales", "MensajeWhatsApp")
+    repetidos = (
+        MensajeWhatsApp.objects
+        .exclude(wa_message_id="")
+        .values("wa_message_id")
+        .annotate(n=Count("id"), primero=Min("id"))
+        .filter(n__gt=1)
+    )
+    for r in repetidos:
+        (
+            MensajeWhatsApp.objects
+            .filter(wa_message_id=r["wa_message_id"])
+            .exclude(id=r["primero"])
+            .delete()
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Digitales', '0004_mensaje_sellos_status'),
+    ]
+
+    operations = [
+        migrations.RunPython(borrar_duplicados, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='mensajewhatsapp',
+            constraint=models.UniqueConstraint(condition=models.Q(('wa_message_id__gt', '')), fields=('wa_message_id',), name='uniq_mensaje_wa_message_id'),
+        ),
+    ]
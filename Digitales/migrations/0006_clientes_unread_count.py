@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 15:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Digitales', '0005_mensaje_wa_message_id_unico'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clientesdigitales',
+            name='unread_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.5 on 2026-10-18 15:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Digitales', '0006_clientes_unread_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clientesdigitales',
+            name='ultimo_msg_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='clientesdigitales',
+            name='ultimo_msg_direction',
+            field=models.CharField(blank=True, default='', max_length=3),
+        ),
+        migrations.AddField(
+            model_name='clientesdigitales',
+            name='ultimo_msg_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='clientesdigitales',
+            name='ultimo_msg_preview',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+    ]
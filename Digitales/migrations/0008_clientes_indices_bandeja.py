@@ -0,0 +1,21 @@
+# Generated by Django 5.2.5 on 2026-10-18 15:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Digitales', '0007_clientes_ultimo_mensaje'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='clientesdigitales',
+            index=models.Index(fields=['-ultimo_contacto_at', '-id'], name='clientes_dig_bandeja_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='clientesdigitales',
+            index=models.Index(fields=['agencia', '-ultimo_contacto_at', '-id'], name='clientes_dig_agencia_idx'),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.5 on 2026-10-18 15:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Digitales', '0008_clientes_indices_bandeja'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CampanaEnvio',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('template_name', models.CharField(max_length=200)),
+                ('idioma', models.CharField(default='es_MX', max_length=20)),
+                ('params', models.JSONField(blank=True, default=list)),
+                ('filtro', models.JSONField(blank=True, default=dict)),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('enviando', 'Enviando'), ('terminada', 'Terminada'), ('cancelada', 'Cancelada')], default='pendiente', max_length=20)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('enviados', models.PositiveIntegerField(default=0)),
+                ('fallidos', models.PositiveIntegerField(default=0)),
+                ('creado', models.DateTimeField(auto_now_add=True)),
+                ('iniciado_at', models.DateTimeField(blank=True, null=True)),
+                ('terminado_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'digitales_campanas_envio',
+                'ordering': ['-creado'],
+                'managed': True,
+            },
+        ),
+        migrations.CreateModel(
+            name='CampanaEnvioDestinatario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('telefono', models.CharField(max_length=32)),
+                ('params', models.JSONField(blank=True, default=list)),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('enviando', 'Enviando'), ('enviado', 'Enviado'), ('fallido', 'Fallido')], default='pendiente', max_length=20)),
+                ('wa_message_id', models.CharField(blank=True, default='', max_length=120)),
+                ('error', models.CharField(blank=True, default='', max_length=500)),
+                ('enviado_at', models.DateTimeField(blank=True, null=True)),
+                ('campana', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='destinatarios', to='Digitales.campanaenvio')),
+                ('cliente', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='Digitales.clientesdigitales')),
+            ],
+            options={
+                'db_table': 'digitales_campanas_envio_destinatarios',
+                'managed': True,
+                'indexes': [models.Index(fields=['campana', 'estado', 'id'], name='digitales_c_campana_5e7290_idx')],
+                'constraints': [models.UniqueConstraint(fields=('campana', 'telefono'), name='uniq_campana_envio_telefono')],
+            },
+        ),
+    ]
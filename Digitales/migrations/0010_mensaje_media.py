@@ -0,0 +1,61 @@
+# Generated by Django 5.2.5 on 2026-10-18 15:39
+
+from django.db import migrations, models
+
+MEDIA_TYPES = ("image", "video", "audio", "document", "sticker")
+
+
+def llenar_media(apps, schema_editor):
+    # media_id/mime/sha256 de los mensajes existentes, sacados del raw
+    MensajeWhatsApp = apps.get_model("Digitales", "MensajeWhatsApp")
+    lote = []
+    for m in MensajeWhatsApp.objects.only("id", "raw").iterator(chunk_size=2000):
+        raw = m.raw if isinstance(m.raw, dict) else {}
+        if raw.get("upload") and raw.get("meta_type"):
+            m.media_id = (raw.get("upload") or {}).get("id") or ""
+            m.media_mime = raw.get("content_type") or ""
+        elif raw.get("type") in MEDIA_TYPES:
+            payload = raw.get(raw["type"]) or {}
+            m.media_id = payload.get("id") or ""
+            m.media_mime = payload.get("mime_type") or ""
+            m.media_sha256 = payload.get("sha256") or ""
+        else:
+            continue
+        m.media_mime = m.media_mime[:100]
+        lote.append(m)
+        if len(lote) >= 500:
+            MensajeWhatsApp.objects.bulk_update(lote, ["media_id", "media_mime", "media_sha256"])
+            lote = []
+    if lote:
+        MensajeWhatsApp.objects.bulk_update(lote, ["media_id", "media_mime", "media_sha256"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Digitales', '0009_campanas_envio'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mensajewhatsapp',
+            name='media_id',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=128),
+        ),
+        migrations.AddField(
+            model_name='mensajewhatsapp',
+            name='media_mime',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='mensajewhatsapp',
+            name='media_sha256',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='mensajewhatsapp',
+            name='media_size',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(llenar_media, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.5 on 2026-10-18 15:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Digitales', '0010_mensaje_media'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mensajewhatsapp',
+            name='intentos',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='mensajewhatsapp',
+            name='reclamado_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='mensajewhatsapp',
+            name='siguiente_intento_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='mensajewhatsapp',
+            index=models.Index(condition=models.Q(('status__in', ['queued', 'sending'])), fields=['status', 'id'], name='mensajes_outbox_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.5 on 2026-10-18 15:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Digitales', '0011_mensaje_outbox'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='clientesdigitales',
+            index=models.Index(fields=['estado', '-ultimo_contacto_at', '-id'], name='clientes_dig_estado_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='clientesdigitales',
+            index=models.Index(fields=['business', '-ultimo_contacto_at', '-id'], name='clientes_dig_business_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='clientesdigitales',
+            index=models.Index(fields=['asesor_digital', '-ultimo_contacto_at', '-id'], name='clientes_dig_asesor_dig_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='clientesdigitales',
+            index=models.Index(fields=['asesor_ventas', '-ultimo_contacto_at', '-id'], name='clientes_dig_asesor_ven_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='clientesdigitales',
+            index=models.Index(fields=['facturado', '-ultimo_contacto_at', '-id'], name='clientes_dig_facturado_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='clientesdigitales',
+            index=models.Index(fields=['creado'], name='clientes_dig_creado_idx'),
+        ),
+    ]
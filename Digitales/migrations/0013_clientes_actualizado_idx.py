@@ -0,0 +1,17 @@
+# Generated by Django 5.2.5 on 2026-10-18 15:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Digitales', '0012_prospectos_indices'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='clientesdigitales',
+            index=models.Index(fields=['actualizado'], name='clientes_dig_actualizado_idx'),
+        ),
+    ]
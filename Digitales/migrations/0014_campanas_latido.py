@@ -0,0 +1,28 @@
+# Generated by Django 5.2.5 on 2026-10-18 16:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Digitales', '0013_clientes_actualizado_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='campanaenvio',
+            name='ejecucion',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+        migrations.AddField(
+            model_name='campanaenvio',
+            name='latido_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='campanaenviodestinatario',
+            name='ejecucion',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+    ]
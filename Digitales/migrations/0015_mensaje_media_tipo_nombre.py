@@ -0,0 +1,50 @@
+# Generated by Django 5.2.5 on 2026-10-18 16:40
+
+from django.db import migrations, models
+
+MEDIA_TYPES = ("image", "video", "audio", "document", "sticker")
+
+
+def llenar_tipo_nombre(apps, schema_editor):
+    # tipo y nombre del adjunto de los mensajes existentes, sacados del raw
+    MensajeWhatsApp = apps.get_model("Digitales", "MensajeWhatsApp")
+    lote = []
+    for m in MensajeWhatsApp.objects.exclude(media_id="").only("id", "raw").iterator(chunk_size=2000):
+        raw = m.raw if isinstance(m.raw, dict) else {}
+        if raw.get("upload") and raw.get("meta_type"):
+            m.media_tipo = raw.get("meta_type") or ""
+            m.media_nombre = raw.get("filename") or ""
+        elif raw.get("type") in MEDIA_TYPES:
+            m.media_tipo = raw["type"]
+            m.media_nombre = (raw.get(raw["type"]) or {}).get("filename") or ""
+        else:
+            continue
+        m.media_tipo = m.media_tipo[:20]
+        m.media_nombre = m.media_nombre[:255]
+        lote.append(m)
+        if len(lote) >= 500:
+            MensajeWhatsApp.objects.bulk_update(lote, ["media_tipo", "media_nombre"])
+            lote = []
+    if lote:
+        MensajeWhatsApp.objects.bulk_update(lote, ["media_tipo", "media_nombre"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Digitales', '0014_campanas_latido'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mensajewhatsapp',
+            name='media_tipo',
+            field=models.CharField(blank=True, default='', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='mensajewhatsapp',
+            name='media_nombre',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.RunPython(llenar_tipo_nombre, migrations.RunPython.noop),
+    ]
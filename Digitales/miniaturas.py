@@ -0,0 +1,118 @@
+# digitales/miniaturas.py
+"""
+Miniaturas para las burbujas del chat: imagen reducida (Pillow) o cuadro
+de portada de un video (ffmpeg), guardadas junto al original en la caché de
+media (`<media_id>.thumb.<ext>`), así comparten el mismo tope y LRU.
+
+Pillow y ffmpeg son opcionales: sin ellos no hay miniatura y el front usa
+la URL completa.
+"""
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+
+from . import media_cache
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+LADO = int(getattr(settings, "WHATSAPP_THUMB_LADO", 320))
+CALIDAD = int(getattr(settings, "WHATSAPP_THUMB_CALIDAD", 70))
+FFMPEG = getattr(settings, "WHATSAPP_FFMPEG", None) or shutil.which("ffmpeg")
+
+# WebP pesa menos; si este Pillow no lo trae, JPEG
+FORMATO = "WEBP" if Image is not None and features.check("webp") else "JPEG"
+CONTENT_TYPE = {"WEBP": "image/webp", "JPEG": "image/jpeg"}[FORMATO]
+
+
+def disponible(tipo: str) -> bool:
+    """¿Se puede generar miniatura para este tipo de media en este servidor?"""
+    if Image is None:
+        return False
+    return tipo == "image" or (tipo == "video" and bool(FFMPEG))
+
+
+def obtener(media_id: str, tipo: str = "") -> Path | None:
+    """
+    Ruta de la miniatura (la genera la primera vez) o None si no se puede.
+    Con `tipo` ya conocido (image, video...) un media sin miniatura posible
+    regresa None sin descargar el original.
+    """
+    ruta = media_cache.ruta_derivada(media_id, f"thumb.{FORMATO.lower()}")
+    if ruta.exists():
+        return ruta
+    if Image is None or (tipo and not disponible(tipo)):
+        return None
+
+    with media_cache.un_vuelo(f"thumb:{media_id}"):
+        if ruta.exists():
+            return ruta
+        meta = media_cache.obtener(media_id)
+        tipo = (meta["content_type"] or "").split("/")[0]
+        if tipo == "image":
+            origen = meta["ruta"]
+        elif tipo == "video" and FFMPEG:
+            origen = _portada(meta["ruta"])
+        else:
+            return None
+        if origen is None:
+            return None
+
+        try:
+            _reducir(origen, ruta)
+        except Exception:
+            logger.exception("Miniatura %s: no se pudo generar", media_id)
+            return None
+        finally:
+            if origen != meta["ruta"]:
+                origen.unlink(missing_ok=True)
+        media_cache.contar(ruta.stat().st_size)
+    return ruta
+
+
+def _reducir(origen: Path, destino: Path):
+    with Image.open(origen) as img:
+        img.draft("RGB", (LADO * 2, LADO * 2))  # JPEG: decodifica ya reducido
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((LADO, LADO))
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        fd, tmp = tempfile.mkstemp(dir=destino.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                img.save(fh, FORMATO, quality=CALIDAD)
+            os.replace(tmp, destino)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+
+
+def _portada(video: Path) -> Path | None:
+    fd, tmp = tempfile.mkstemp(dir=video.parent, prefix=".tmp-", suffix=".jpg")
+    os.close(fd)
+    # primer cuadro clave después de 1 s (o el primero si el video es más corto)
+    for inicio in ("1", "0"):
+        try:
+            subprocess.run(
+                [FFMPEG, "-v", "error", "-y", "-ss", inicio, "-i", str(video), "-frames:v", "1", tmp],
+                check=True,
+                timeout=20,
+                stdin=subprocess.DEVNULL,
+                capture_output=True,
+            )
+        except (subprocess.SubprocessError, OSError) as e:
+            logger.warning("Portada de %s: ffmpeg falló (%s)", video.name, e)
+            break
+        if os.path.getsize(tmp):
+            return Path(tmp)
+    Path(tmp).unlink(missing_ok=True)
+    return None
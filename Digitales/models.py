@@ -1,16 +1,16 @@
 # digitales/models.py
 from django.db import models
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 
-def normaliza_tel_mx(raw: str) -> str:
-    digits = "".join(c for c in str(raw or "") if c.isdigit())
-    if not digits:
-        return ""
-    if len(digits) == 10:
-        return "52" + digits
-    if len(digits) == 12 and digits.startswith("52"):
-        return digits
-    return digits
+# viven en ryrback.telefonos (compartidos con citas y CrmConformidad); el
+# resto de Digitales los sigue importando de aquí
+from ryrback.telefonos import normaliza_tel_mx, variantes_tel_mx  # noqa: F401
+
+
+def preview_mensaje(body: str) -> str:
+    return " ".join(str(body or "").split())[:255]
+
 
 class ClientesDigitales(models.Model):
     nombre = models.CharField(max_length=200, blank=True, default="")
@@ -41,6 +41,14 @@ class ClientesDigitales(models.Model):
     ultimo_contacto_at = models.DateTimeField(null=True, blank=True)
 
     last_read_at = models.DateTimeField(null=True, blank=True)
+    # entrantes después de last_read_at; lo incrementa el webhook y lo resetea mark_read
+    unread_count = models.PositiveIntegerField(default=0)
+
+    # snapshot del último mensaje para la bandeja (evita subqueries por fila)
+    ultimo_msg_id = models.BigIntegerField(null=True, blank=True)
+    ultimo_msg_preview = models.CharField(max_length=255, blank=True, default="")
+    ultimo_msg_direction = models.CharField(max_length=3, blank=True, default="")
+    ultimo_msg_at = models.DateTimeField(null=True, blank=True)
 
     creado = models.DateTimeField(auto_now_add=True)
     actualizado = models.DateTimeField(auto_now=True)
@@ -48,6 +56,20 @@ class ClientesDigitales(models.Model):
     class Meta:
         db_table = "clientes_digitales"
         managed = True
+        indexes = [
+            # orden de la bandeja (keyset de chats_list) y su variante por agencia
+            models.Index(fields=["-ultimo_contacto_at", "-id"], name="clientes_dig_bandeja_idx"),
+            models.Index(fields=["agencia", "-ultimo_contacto_at", "-id"], name="clientes_dig_agencia_idx"),
+            # filtros del listado de prospectos, cada uno con el mismo orden del cursor
+            models.Index(fields=["estado", "-ultimo_contacto_at", "-id"], name="clientes_dig_estado_idx"),
+            models.Index(fields=["business", "-ultimo_contacto_at", "-id"], name="clientes_dig_business_idx"),
+            models.Index(fields=["asesor_digital", "-ultimo_contacto_at", "-id"], name="clientes_dig_asesor_dig_idx"),
+            models.Index(fields=["asesor_ventas", "-ultimo_contacto_at", "-id"], name="clientes_dig_asesor_ven_idx"),
+            models.Index(fields=["facturado", "-ultimo_contacto_at", "-id"], name="clientes_dig_facturado_idx"),
+            models.Index(fields=["creado"], name="clientes_dig_creado_idx"),
+            # sincronización incremental del índice de búsqueda
+            models.Index(fields=["actualizado"], name="clientes_dig_actualizado_idx"),
+        ]
 
     def touch_ultimo_contacto(self, when=None, save_now=False):
         when = when or timezone.now()
@@ -57,10 +79,63 @@ class ClientesDigitales(models.Model):
         if save_now:
             self.save(update_fields=["primer_contacto_at", "ultimo_contacto_at", "actualizado"])
 
+    def registrar_ultimo_mensaje(self, msg: "MensajeWhatsApp"):
+        """
+        Actualiza el snapshot del último mensaje. El UPDATE va condicionado
+        para que un mensaje más viejo nunca pise a uno más nuevo.
+        """
+        cambios = {
+            "ultimo_msg_id": msg.pk,
+            "ultimo_msg_preview": preview_mensaje(msg.body),
+            "ultimo_msg_direction": msg.direction,
+            "ultimo_msg_at": msg.created_at,
+        }
+        actualizados = (
+            ClientesDigitales.objects
+            .filter(pk=self.pk)
+            .filter(models.Q(ultimo_msg_at__isnull=True) | models.Q(ultimo_msg_at__lte=msg.created_at))
+            .update(**cambios)
+        )
+        if actualizados:
+            for k, v in cambios.items():
+                setattr(self, k, v)
+
+    @classmethod
+    def registrar_envios(cls, msgs: list["MensajeWhatsApp"], when=None):
+        """
+        Versión por lote de touch_ultimo_contacto + registrar_ultimo_mensaje
+        para envíos masivos: un solo UPDATE con el último mensaje de cada cliente.
+        """
+        when = when or timezone.now()
+        ultimo = {}
+        for m in msgs:
+            if m.cliente_id:
+                ultimo[m.cliente_id] = m
+        if not ultimo:
+            return
+
+        def por_cliente(campo, valor):
+            return models.Case(
+                *[models.When(pk=pk, then=models.Value(valor(m))) for pk, m in ultimo.items()],
+                default=models.F(campo),
+                output_field=cls._meta.get_field(campo),
+            )
+
+        cls.objects.filter(pk__in=ultimo.keys()).update(
+            primer_contacto_at=Coalesce("primer_contacto_at", models.Value(when)),
+            ultimo_contacto_at=models.Value(when),
+            actualizado=models.Value(when),
+            ultimo_msg_id=por_cliente("ultimo_msg_id", lambda m: m.pk),
+            ultimo_msg_preview=por_cliente("ultimo_msg_preview", lambda m: preview_mensaje(m.body)),
+            ultimo_msg_direction=por_cliente("ultimo_msg_direction", lambda m: m.direction),
+            ultimo_msg_at=por_cliente("ultimo_msg_at", lambda m: m.created_at),
+        )
+
     def mark_read(self, when=None):
         when = when or timezone.now()
         self.last_read_at = when
-        self.save(update_fields=["last_read_at", "actualizado"])
+        self.unread_count = 0
+        self.save(update_fields=["last_read_at", "unread_count", "actualizado"])
 
     def save(self, *args, **kwargs):
         self.telefono = normaliza_tel_mx(self.telefono)
@@ -70,6 +145,24 @@ class ClientesDigitales(models.Model):
         return f"{self.nombre} ({self.telefono})".strip()
 
 
+# Orden de avance de MensajeWhatsApp.status. Meta manda los callbacks
+# desordenados y repetidos; solo se aplica un status si es posterior al actual.
+STATUS_ORDEN = {
+    "received": 0,
+    # outbox: guardado localmente, todavía sin respuesta de Meta
+    "queued": 0,
+    "sending": 1,
+    "accepted": 2,
+    "sent": 3,
+    "delivered": 4,
+    "read": 5,
+    "failed": 6,
+}
+
+
+MEDIA_TYPES = ("image", "video", "audio", "document", "sticker")
+
+
 class MensajeWhatsApp(models.Model):
     class Direccion(models.TextChoices):
         IN = "in", "Entrante"
@@ -89,6 +182,29 @@ class MensajeWhatsApp(models.Model):
     wa_message_id = models.CharField(max_length=120, blank=True, default="", db_index=True)
     status = models.CharField(max_length=30, blank=True, default="sent")
 
+    # sellos por status (timestamp que reporta Meta en el callback)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    delivered_at = models.DateTimeField(null=True, blank=True)
+    read_at = models.DateTimeField(null=True, blank=True)
+    failed_at = models.DateTimeField(null=True, blank=True)
+    error_code = models.IntegerField(null=True, blank=True)
+    error_title = models.CharField(max_length=255, blank=True, default="")
+
+    # outbox de salientes (ver .outbox): reintentos y reclamo del worker
+    intentos = models.PositiveSmallIntegerField(default=0)
+    siguiente_intento_at = models.DateTimeField(null=True, blank=True)
+    reclamado_at = models.DateTimeField(null=True, blank=True)
+
+    # adjunto (si lo hay): se llena al recibir/enviar y se completa al bajarlo
+    media_id = models.CharField(max_length=128, blank=True, default="", db_index=True)
+    media_mime = models.CharField(max_length=100, blank=True, default="")
+    media_size = models.PositiveBigIntegerField(null=True, blank=True)
+    media_sha256 = models.CharField(max_length=64, blank=True, default="")
+    # tipo de WhatsApp (image/video/audio/document/sticker) y nombre del archivo,
+    # para pintar el adjunto sin leer `raw`
+    media_tipo = models.CharField(max_length=20, blank=True, default="")
+    media_nombre = models.CharField(max_length=255, blank=True, default="")
+
     raw = models.JSONField(default=dict, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -99,7 +215,72 @@ class MensajeWhatsApp(models.Model):
         indexes = [
             models.Index(fields=["telefono", "created_at"]),
             models.Index(fields=["wa_message_id"]),
+            # solo las filas pendientes del outbox: se queda chico aunque la tabla crezca
+            models.Index(
+                fields=["status", "id"],
+                condition=models.Q(status__in=["queued", "sending"]),
+                name="mensajes_outbox_idx",
+            ),
         ]
+        constraints = [
+            # los salientes fallidos se guardan sin id de Meta
+            models.UniqueConstraint(
+                fields=["wa_message_id"],
+                # SQL Server no acepta NOT en el filtro de un índice filtrado
+                condition=models.Q(wa_message_id__gt=""),
+                name="uniq_mensaje_wa_message_id",
+            ),
+        ]
+
+    @classmethod
+    def bulk_guardar(cls, msgs: list["MensajeWhatsApp"]) -> list["MensajeWhatsApp"]:
+        """bulk_create que deja el pk en cada mensaje aunque el backend no lo regrese."""
+        msgs = cls.objects.bulk_create(msgs)
+        faltan = [m for m in msgs if m.pk is None and m.wa_message_id]
+        if faltan:
+            ids = dict(
+                cls.objects
+                .filter(wa_message_id__in=[m.wa_message_id for m in faltan])
+                .values_list("wa_message_id", "id")
+            )
+            for m in faltan:
+                m.pk = ids.get(m.wa_message_id)
+        return msgs
+
+    @classmethod
+    def registrar_media(cls, media_id: str, mime: str = "", size: int | None = None, sha256: str = "") -> int:
+        """Completa los datos del adjunto en todos los mensajes que lo usan."""
+        if not media_id:
+            return 0
+        cambios = {"media_size": size, "media_sha256": sha256}
+        if mime:
+            cambios["media_mime"] = mime
+        return cls.objects.filter(media_id=media_id, media_size__isnull=True).update(**cambios)
+
+    def avanzar_status(self, nuevo: str, when=None, errors=None) -> list[str]:
+        """
+        Aplica `nuevo` solo si avanza respecto al status actual.
+        Regresa los campos modificados ([] si el callback es viejo o repetido).
+        """
+        rank = STATUS_ORDEN.get(nuevo)
+        if rank is None or rank <= STATUS_ORDEN.get(self.status, -1):
+            return []
+
+        self.status = nuevo
+        campos = ["status"]
+
+        sello = f"{nuevo}_at"
+        if sello in ("sent_at", "delivered_at", "read_at", "failed_at"):
+            setattr(self, sello, when or timezone.now())
+            campos.append(sello)
+
+        if errors:
+            err = errors[0] or {}
+            self.error_code = err.get("code")
+            self.error_title = str(err.get("title") or err.get("message") or "")[:255]
+            campos += ["error_code", "error_title"]
+
+        return campos
 
     def __str__(self):
         return f"{self.direction} {self.telefono} {self.created_at:%Y-%m-%d %H:%M}"
@@ -116,3 +297,79 @@ class CampanaMeta(models.Model):
     class Meta:
         db_table = "campanas_meta"
         managed = False
+
+
+class CampanaEnvio(models.Model):
+    """Envío masivo de una plantilla a un conjunto de leads (ver campanas.py)."""
+
+    class Estado(models.TextChoices):
+        PENDIENTE = "pendiente", "Pendiente"
+        ENVIANDO = "enviando", "Enviando"
+        TERMINADA = "terminada", "Terminada"
+        CANCELADA = "cancelada", "Cancelada"
+
+    template_name = models.CharField(max_length=200)
+    idioma = models.CharField(max_length=20, default="es_MX")
+    # mapeo de parámetros: ["texto fijo", {"campo": "nombre"}, {"valor": "x"}]
+    params = models.JSONField(default=list, blank=True)
+    filtro = models.JSONField(default=dict, blank=True)
+
+    estado = models.CharField(max_length=20, choices=Estado.choices, default=Estado.PENDIENTE)
+    total = models.PositiveIntegerField(default=0)
+    enviados = models.PositiveIntegerField(default=0)
+    fallidos = models.PositiveIntegerField(default=0)
+
+    creado = models.DateTimeField(auto_now_add=True)
+    iniciado_at = models.DateTimeField(null=True, blank=True)
+    terminado_at = models.DateTimeField(null=True, blank=True)
+    # quién la está enviando y su último latido; sin latido reciente otro
+    # proceso puede reanudarla (ver campanas.ejecutar_campana)
+    ejecucion = models.CharField(max_length=32, blank=True, default="")
+    latido_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = "digitales_campanas_envio"
+        managed = True
+        ordering = ["-creado"]
+
+    def __str__(self):
+        return f"{self.template_name} ({self.estado})"
+
+
+class CampanaEnvioDestinatario(models.Model):
+    class Estado(models.TextChoices):
+        PENDIENTE = "pendiente", "Pendiente"
+        ENVIANDO = "enviando", "Enviando"
+        ENVIADO = "enviado", "Enviado"
+        FALLIDO = "fallido", "Fallido"
+
+    campana = models.ForeignKey(CampanaEnvio, on_delete=models.CASCADE, related_name="destinatarios")
+    cliente = models.ForeignKey(
+        ClientesDigitales,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    telefono = models.CharField(max_length=32)
+    params = models.JSONField(default=list, blank=True)
+
+    estado = models.CharField(max_length=20, choices=Estado.choices, default=Estado.PENDIENTE)
+    # ejecución que lo reclamó (CampanaEnvio.ejecucion)
+    ejecucion = models.CharField(max_length=32, blank=True, default="")
+    wa_message_id = models.CharField(max_length=120, blank=True, default="")
+    error = models.CharField(max_length=500, blank=True, default="")
+    enviado_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = "digitales_campanas_envio_destinatarios"
+        managed = True
+        indexes = [
+            models.Index(fields=["campana", "estado", "id"]),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=["campana", "telefono"], name="uniq_campana_envio_telefono"),
+        ]
+
+    def __str__(self):
+        return f"{self.campana_id} {self.telefono} {self.estado}"
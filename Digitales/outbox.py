@@ -0,0 +1,205 @@
+# digitales/outbox.py
+"""
+Outbox de mensajes salientes.
+
+La vista solo inserta el MensajeWhatsApp con status `queued` y responde;
+los workers lo reclaman (`sending`), llaman a Graph y dejan `accepted` con
+el wa_message_id, o lo reprograman / marcan `failed`. Como el registro
+existe antes de hablar con Meta, un envío aceptado nunca se queda sin fila.
+
+Orden: por teléfono solo se envía el mensaje pendiente más viejo, así dos
+mensajes al mismo cliente no se adelantan aunque haya varios workers.
+
+Workers: cada proceso web arranca su despachador al cargar (ryrback/wsgi.py,
+WHATSAPP_WORKERS_EN_WEB), así los reintentos programados salen aunque nadie
+vuelva a encolar tras un reinicio. Si se apaga, `manage.py procesar_outbox`
+es obligatorio.
+"""
+import logging
+import random
+import threading
+import time
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Min, Q
+from django.utils import timezone
+
+from .contacto import GRAPH_PRESUPUESTO, ErrorMeta, enviar_texto_whatsapp
+from .eventos import publicar_mensajes, publicar_status
+from .models import ClientesDigitales, MensajeWhatsApp
+from .workers import Despachador
+
+logger = logging.getLogger(__name__)
+
+HILOS = int(getattr(settings, "WHATSAPP_OUTBOX_HILOS", 4))
+LOTE = int(getattr(settings, "WHATSAPP_OUTBOX_LOTE", 20))
+MAX_INTENTOS = int(getattr(settings, "WHATSAPP_OUTBOX_INTENTOS", 5))
+# backoff entre intentos (s): base * 2^intento, con jitter, hasta el tope
+BACKOFF = float(getattr(settings, "WHATSAPP_OUTBOX_BACKOFF", 5))
+BACKOFF_MAX = float(getattr(settings, "WHATSAPP_OUTBOX_BACKOFF_MAX", 300))
+# un `sending` más viejo que esto es de un worker que murió a medio envío.
+# Nunca menos que lo que puede tardar una llamada viva a Graph con todos sus
+# reintentos por throttling: si no, se marcaría `failed` un envío en curso y
+# el siguiente del teléfono se le adelantaría.
+HUERFANO_SEGUNDOS = max(int(getattr(settings, "WHATSAPP_OUTBOX_HUERFANO", 120)), int(GRAPH_PRESUPUESTO) + 60)
+
+PENDIENTE = "queued"
+ENVIANDO = "sending"
+
+
+def encolar_texto(to: str, text: str) -> MensajeWhatsApp:
+    now = timezone.now()
+    with transaction.atomic():
+        cliente, _ = ClientesDigitales.objects.get_or_create(
+            telefono=to,
+            defaults={"primer_contacto_at": None, "ultimo_contacto_at": None},
+        )
+        cliente.touch_ultimo_contacto(now, save_now=True)
+
+        msg = MensajeWhatsApp.objects.create(
+            telefono=to,
+            cliente=cliente,
+            direction="out",
+            body=text,
+            status=PENDIENTE,
+            raw={"outbox": {"tipo": "text"}},
+        )
+        cliente.registrar_ultimo_mensaje(msg)
+        transaction.on_commit(despachador.despertar)
+    publicar_mensajes([msg])
+    return msg
+
+
+def reclamar(limite: int = LOTE) -> list[MensajeWhatsApp]:
+    """
+    Toma hasta `limite` mensajes listos para enviar, uno por teléfono y solo
+    si ese teléfono no tiene otro envío en curso. El reclamo es un UPDATE
+    condicionado por fila: si otro worker lo ganó, simplemente se salta.
+    """
+    now = timezone.now()
+    # cabeza de cada teléfono: su pendiente más viejo, sin ventana que limite
+    # cuántos teléfonos se revisan (un teléfono con cola larga en backoff no
+    # debe esconder a los demás)
+    cabezas = (
+        MensajeWhatsApp.objects
+        .filter(status=PENDIENTE, direction="out")
+        .values("telefono")
+        .annotate(primero=Min("id"))
+        .values("primero")
+    )
+    # un `sending` con el lease vencido es de un worker muerto: no bloquea el teléfono
+    ocupados = MensajeWhatsApp.objects.filter(
+        status=ENVIANDO,
+        reclamado_at__gte=now - timedelta(seconds=HUERFANO_SEGUNDOS),
+    ).values("telefono")
+    # la cabeza en backoff bloquea a los siguientes de su teléfono aunque aún no toque reintentarla
+    candidatos = list(
+        MensajeWhatsApp.objects
+        .filter(pk__in=cabezas)
+        .filter(Q(siguiente_intento_at__isnull=True) | Q(siguiente_intento_at__lte=now))
+        .exclude(telefono__in=ocupados)
+        .order_by("id")
+        .values_list("id", flat=True)[: limite * 2]
+    )
+
+    ids = []
+    for pk in candidatos:
+        if MensajeWhatsApp.objects.filter(pk=pk, status=PENDIENTE).update(status=ENVIANDO, reclamado_at=now):
+            ids.append(pk)
+        if len(ids) >= limite:
+            break
+
+    return list(MensajeWhatsApp.objects.filter(pk__in=ids).order_by("id"))
+
+
+def _reintentable(e: Exception) -> bool:
+    # ReadTimeout no: Meta pudo haberlo aceptado y reenviar duplicaría el mensaje
+    if isinstance(e, (requests.ConnectionError, requests.ConnectTimeout)):
+        return True
+    return isinstance(e, ErrorMeta) and (e.status_code == 429 or e.status_code >= 500)
+
+
+def enviar(msg: MensajeWhatsApp):
+    now = timezone.now()
+    try:
+        wa_res = enviar_texto_whatsapp(to=msg.telefono, text=msg.body)
+    except Exception as e:
+        msg.intentos += 1
+        campos = ["status", "intentos", "siguiente_intento_at", "error_title"]
+        msg.error_title = str(e)[:255]
+        if _reintentable(e) and msg.intentos < MAX_INTENTOS:
+            espera = min(BACKOFF_MAX, BACKOFF * (2 ** (msg.intentos - 1)))
+            msg.status = PENDIENTE
+            msg.siguiente_intento_at = now + timedelta(seconds=random.uniform(espera / 2, espera))
+            logger.warning("Outbox %s: intento %s falló (%s), reintento en %s", msg.pk, msg.intentos, e, msg.siguiente_intento_at)
+        else:
+            msg.status = "failed"
+            msg.failed_at = now
+            msg.siguiente_intento_at = None
+            campos.append("failed_at")
+            logger.error("Outbox %s: envío fallido tras %s intentos: %s", msg.pk, msg.intentos, e)
+        msg.save(update_fields=campos)
+        publicar_status([msg])
+        return
+
+    msg.wa_message_id = (wa_res.get("messages") or [{}])[0].get("id", "") or ""
+    msg.status = "accepted"
+    msg.intentos += 1
+    msg.error_title = ""
+    msg.raw = {**(msg.raw or {}), **wa_res}
+    msg.save(update_fields=["wa_message_id", "status", "intentos", "error_title", "raw"])
+    publicar_status([msg])
+
+
+_ultima_revision = 0.0
+_revision_lock = threading.Lock()
+
+
+def _revisar_huerfanos():
+    """recuperar_huerfanos a lo más cada medio lease, desde cualquier worker del proceso."""
+    global _ultima_revision
+    with _revision_lock:
+        ahora = time.monotonic()
+        if ahora - _ultima_revision < HUERFANO_SEGUNDOS / 2:
+            return
+        _ultima_revision = ahora
+    recuperar_huerfanos()
+
+
+def drenar(limite: int = LOTE) -> int:
+    _revisar_huerfanos()
+    total = 0
+    while True:
+        msgs = reclamar(limite)
+        if not msgs:
+            return total
+        for msg in msgs:
+            enviar(msg)
+        total += len(msgs)
+
+
+def recuperar_huerfanos(edad: int = HUERFANO_SEGUNDOS) -> int:
+    """
+    `sending` de un worker caído: no sabemos si Meta lo aceptó, así que no
+    se reenvía a ciegas; queda `failed` para que el asesor decida.
+    """
+    now = timezone.now()
+    qs = MensajeWhatsApp.objects.filter(status=ENVIANDO, reclamado_at__lt=now - timedelta(seconds=edad))
+    msgs = list(qs)
+    if not msgs:
+        return 0
+    qs.filter(pk__in=[m.pk for m in msgs]).update(
+        status="failed",
+        failed_at=now,
+        error_title="interrumpido: verificar en WhatsApp",
+    )
+    for m in msgs:
+        m.status, m.failed_at, m.error_title = "failed", now, "interrumpido: verificar en WhatsApp"
+    publicar_status(msgs)
+    return len(msgs)
+
+
+despachador = Despachador("wa-outbox", drenar, hilos=HILOS)
@@ -0,0 +1,92 @@
+# digitales/paginacion.py
+import base64
+import json
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+
+
+def codificar_cursor(valores: dict) -> str:
+    data = json.dumps(valores, separators=(",", ":"), default=str).encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def decodificar_cursor(cursor: str) -> dict:
+    try:
+        pad = "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(cursor + pad))
+        if not isinstance(data, dict):
+            raise ValueError
+        return data
+    except (ValueError, TypeError):
+        raise ValidationError({"detail": "Cursor inválido"})
+
+
+def _fecha(valor):
+    return datetime.fromisoformat(valor) if valor else None
+
+
+def despues_de(campo: str, valor, pk) -> Q:
+    """
+    Filas que van después de (valor, pk) en orden `-campo, -id`.
+    Asume NULLs al final en orden descendente (SQL Server / SQLite).
+    """
+    if valor is None:
+        return Q(**{f"{campo}__isnull": True, "id__lt": pk})
+    return (
+        Q(**{f"{campo}__lt": valor})
+        | Q(**{campo: valor, "id__lt": pk})
+        | Q(**{f"{campo}__isnull": True})
+    )
+
+
+class KeysetPagination(BasePagination):
+    """
+    Paginación por cursor (keyset) sobre `-campo, -id`.
+
+    El cuerpo de la respuesta sigue siendo la lista de siempre; el cursor de
+    la siguiente página va en el header `X-Next-Cursor` (vacío = no hay más).
+    """
+
+    campo = "ultimo_contacto_at"
+    page_size = 50
+    max_page_size = 500
+    header = "X-Next-Cursor"
+
+    def ordenar(self, queryset):
+        return queryset.order_by(f"-{self.campo}", "-id")
+
+    def get_limit(self, request) -> int:
+        try:
+            limit = int(request.query_params.get("limit", self.page_size))
+        except ValueError:
+            limit = self.page_size
+        return max(1, min(limit, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        limit = self.get_limit(request)
+        qs = self.ordenar(queryset)
+
+        cursor = request.query_params.get("cursor") or ""
+        if cursor:
+            c = decodificar_cursor(cursor)
+            try:
+                qs = qs.filter(despues_de(self.campo, _fecha(c.get("v")), int(c["id"])))
+            except (KeyError, ValueError, TypeError):
+                raise ValidationError({"detail": "Cursor inválido"})
+
+        rows = list(qs[: limit + 1])
+        self.siguiente = ""
+        if len(rows) > limit:
+            ultimo = rows[limit - 1]
+            valor = getattr(ultimo, self.campo)
+            self.siguiente = codificar_cursor({"v": valor.isoformat() if valor else None, "id": ultimo.pk})
+        return rows[:limit]
+
+    def get_paginated_response(self, data):
+        resp = Response(data)
+        resp[self.header] = self.siguiente
+        return resp
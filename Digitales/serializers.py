@@ -1,9 +1,11 @@
 # digitales/serializers.py
 from rest_framework import serializers
-from .models import ClientesDigitales, MensajeWhatsApp
+from .models import ClientesDigitales, CampanaEnvio, CampanaEnvioDestinatario
 from django.utils import timezone
 from datetime import timedelta
 from django.urls import reverse
+from django.utils.functional import cached_property
+from . import miniaturas
 class ClientesDigitalesSerializer(serializers.ModelSerializer):
     class Meta:
         model = ClientesDigitales
@@ -34,129 +36,136 @@ class ClientesDigitalesSerializer(serializers.ModelSerializer):
             "actualizado",
         ]
 
-EDIT_WINDOW_MINUTES = 15
-
-class WhatsAppMessageSerializer(serializers.ModelSerializer):
-    mine = serializers.SerializerMethodField()
-    text = serializers.CharField(source="body", read_only=True)
-    time = serializers.SerializerMethodField()
-
-    # edición
-    editable = serializers.SerializerMethodField()
-    edit_expires_at = serializers.SerializerMethodField()
-    is_template = serializers.SerializerMethodField()
-    is_media = serializers.SerializerMethodField()
+    def __init__(self, *args, campos=None, **kwargs):
+        """`campos`: subconjunto de fields a serializar (respuestas ligeras del grid)."""
+        super().__init__(*args, **kwargs)
+        if campos:
+            for nombre in set(self.fields) - set(campos):
+                self.fields.pop(nombre)
+
+    def update(self, instance, validated_data):
+        # solo las columnas que trae la petición: unread_count, ultimo_msg_* y
+        # demás los actualizan la ingesta y los chats al mismo tiempo
+        for campo, valor in validated_data.items():
+            setattr(instance, campo, valor)
+        instance.save(update_fields=[*validated_data, "actualizado"])
+        return instance
 
-    # ✅ adjuntos listos para UI
-    attachments = serializers.SerializerMethodField()
+EDIT_WINDOW_MINUTES = 15
 
+def _iso(dt):
+    if not dt:
+        return None
+    value = timezone.localtime(dt).isoformat()
+    if value.endswith("+00:00"):
+        value = value[:-6] + "Z"
+    return value
+
+
+class WhatsAppMessageListSerializer(serializers.BaseSerializer):
+    """
+    Representación de mensajes para el chat (listas, updates, SSE, envíos),
+    en una sola pasada por mensaje y sin leer `raw`: el adjunto sale de las
+    columnas media_*. `now` y el prefijo de URL de media se resuelven una
+    vez por serializer (con many=True el child se reutiliza en toda la lista).
+    """
+
+    @cached_property
+    def _now(self):
+        return timezone.now()
+
+    def _partir_url(self, nombre: str) -> tuple[str, str]:
+        path = reverse(nombre, args=["0"])
+        req = self.context.get("request")
+        url = req.build_absolute_uri(path) if req else path
+        prefijo, _, sufijo = url.rpartition("/0/")
+        return prefijo + "/", "/" + sufijo
+
+    @cached_property
+    def _media_url(self) -> tuple[str, str]:
+        return self._partir_url("digitales-media-proxy")
+
+    @cached_property
+    def _thumb_url(self) -> tuple[str, str]:
+        return self._partir_url("digitales-media-thumb")
+
+    def _attachments(self, obj) -> list[dict]:
+        media_id = obj.media_id
+        if not media_id:
+            return []
+        kind = obj.media_tipo
+        prefijo, sufijo = self._media_url
+        thumb_url = None
+        if miniaturas.disponible(kind):
+            t_prefijo, t_sufijo = self._thumb_url
+            thumb_url = f"{t_prefijo}{media_id}{t_sufijo}"
+        return [{
+            "id": media_id,
+            "kind": "file" if kind == "document" else kind,
+            "url": f"{prefijo}{media_id}{sufijo}",
+            "thumb_url": thumb_url,
+            "mime": obj.media_mime,
+            "name": obj.media_nombre,
+            "size": obj.media_size or 0,
+        }]
+
+    def to_representation(self, obj):
+        body = obj.body or ""
+        b = body.strip()
+        mine = obj.direction == "out"
+
+        is_template = b.startswith("[TEMPLATE:")
+        # adjunto enviado desde el CRM (enviar_media_view) o marcador en el texto
+        is_media = (mine and bool(obj.media_id)) or b.startswith("[FILE:") or "\n[FILE:" in b
+
+        created = timezone.localtime(obj.created_at) if obj.created_at else None
+        expira = obj.created_at + timedelta(minutes=EDIT_WINDOW_MINUTES) if obj.created_at else None
+
+        return {
+            "id": obj.pk,
+            "telefono": obj.telefono,
+            "direction": obj.direction,
+            "mine": mine,
+            "text": body,
+            "body": body,
+            "wa_message_id": obj.wa_message_id,
+            "status": obj.status,
+            "sent_at": _iso(obj.sent_at),
+            "delivered_at": _iso(obj.delivered_at),
+            "read_at": _iso(obj.read_at),
+            "failed_at": _iso(obj.failed_at),
+            "error_code": obj.error_code,
+            "error_title": obj.error_title,
+            "created_at": _iso(obj.created_at),
+            "time": created.strftime("%I:%M %p").lower() if created else "",
+            "editable": bool(mine and expira and not is_template and not is_media and self._now <= expira),
+            "edit_expires_at": expira.isoformat() if expira else None,
+            "is_template": is_template,
+            "is_media": is_media,
+            "attachments": self._attachments(obj),
+        }
+
+
+class CampanaEnvioSerializer(serializers.ModelSerializer):
     class Meta:
-        model = MensajeWhatsApp
+        model = CampanaEnvio
         fields = [
             "id",
-            "telefono",
-            "direction",
-            "mine",
-            "text",
-            "body",
-            "wa_message_id",
-            "status",
-            "raw",
-            "created_at",
-            "time",
-
-            "editable",
-            "edit_expires_at",
-            "is_template",
-            "is_media",
-
-            "attachments",
+            "template_name",
+            "idioma",
+            "params",
+            "filtro",
+            "estado",
+            "total",
+            "enviados",
+            "fallidos",
+            "creado",
+            "iniciado_at",
+            "terminado_at",
         ]
 
-    def get_mine(self, obj):
-        return obj.direction == "out"
-
-    def get_time(self, obj):
-        if not obj.created_at:
-            return ""
-        dt = timezone.localtime(obj.created_at)
-        return dt.strftime("%I:%M %p").lower()
-
-    def get_is_template(self, obj):
-        b = (obj.body or "").strip()
-        return b.startswith("[TEMPLATE:")
-
-    def get_is_media(self, obj):
-        # si tiene media_id en raw o el body tiene marcador
-        raw = obj.raw or {}
-        if raw.get("meta_type") in ("image","video","audio","document","sticker"):
-            return True
-        b = (obj.body or "").strip()
-        return b.startswith("[FILE:") or "\n[FILE:" in b
-
-    def get_edit_expires_at(self, obj):
-        if not obj.created_at:
-            return None
-        return (obj.created_at + timedelta(minutes=EDIT_WINDOW_MINUTES)).isoformat()
-
-    def get_editable(self, obj):
-        if obj.direction != "out":
-            return False
-        if not obj.created_at:
-            return False
-        if self.get_is_template(obj):
-            return False
-        if self.get_is_media(obj):
-            return False
-        return timezone.now() <= (obj.created_at + timedelta(minutes=EDIT_WINDOW_MINUTES))
-
-    def get_attachments(self, obj):
-        """
-        Regresa lista normalizada para el frontend:
-        [{id, kind, url, mime, name, size}]
-        """
-        raw = obj.raw or {}
-
-        # 1) Caso SALIENTE (tu enviar_media_view guarda: raw.upload.id, raw.meta_type, filename, content_type)
-        if isinstance(raw, dict) and raw.get("upload") and raw.get("meta_type"):
-            media_id = (raw.get("upload") or {}).get("id") or ""
-            if media_id:
-                kind = raw.get("meta_type")  # image/video/audio/document
-                req = self.context.get("request")
-                #url = req.build_absolute_uri(f"/digitales/media/{media_id}/") if req else f"/digitales/media/{media_id}/"
-                req = self.context.get("request")
-                path = reverse("digitales-media-proxy", args=[media_id])
-                url = req.build_absolute_uri(path) if req else path
-                return [{
-                    "id": media_id,
-                    "kind": "file" if kind == "document" else kind,
-                    "url": url,
-                    "mime": raw.get("content_type") or "",
-                    "name": raw.get("filename") or "",
-                    "size": 0,
-                }]
-
-        # 2) Caso ENTRANTE (webhook): raw es el msg de WhatsApp con type y payload
-        if isinstance(raw, dict):
-            t = (raw.get("type") or "").lower()
-            if t in ("image","video","audio","document","sticker"):
-                payload = raw.get(t) or {}
-                media_id = payload.get("id") or ""
-                if media_id:
-                    req = self.context.get("request")
-                    #url = req.build_absolute_uri(f"/digitales/media/{media_id}/") if req else f"/digitales/media/{media_id}/"
-                    req = self.context.get("request")
-                    path = reverse("digitales-media-proxy", args=[media_id])
-                    url = req.build_absolute_uri(path) if req else path
-                    name = payload.get("filename") or ""
-                    mime = payload.get("mime_type") or ""
-                    return [{
-                        "id": media_id,
-                        "kind": "sticker" if t == "sticker" else ("file" if t == "document" else t),
-                        "url": url,
-                        "mime": mime,
-                        "name": name,
-                        "size": 0,
-                    }]
-
-        return []
\ No newline at end of file
+
+class CampanaEnvioDestinatarioSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CampanaEnvioDestinatario
+        fields = ["id", "cliente", "telefono", "params", "estado", "wa_message_id", "error", "enviado_at"]
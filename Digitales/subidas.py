@@ -0,0 +1,154 @@
+# digitales/subidas.py
+"""
+Subidas grandes sin cargarlas en memoria.
+
+Entrada: `LimiteUploadHandler` corta cada archivo en cuanto rebasa el límite
+de su tipo y, junto con TemporaryFileUploadHandler, manda el resto directo a
+disco por chunks. Salida: `CuerpoMultipart` arma el multipart hacia Graph
+leyendo ese archivo por chunks, en lugar de que `requests` lo materialice.
+"""
+import logging
+import os
+import time
+import uuid
+
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile, TemporaryFileUploadHandler
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+# Límites de WhatsApp Cloud API por tipo de media
+LIMITES_MEDIA = {
+    "image": 5 * MB,
+    "video": 16 * MB,
+    "audio": 16 * MB,
+    "document": 100 * MB,
+    **getattr(settings, "WHATSAPP_MEDIA_LIMITES", {}),
+}
+
+
+def tipo_por_mime(ct: str) -> str:
+    # mismo criterio que usa WhatsApp para decidir image/video/audio/document
+    ct = ct or ""
+    for tipo in ("image", "video", "audio"):
+        if ct.startswith(f"{tipo}/"):
+            return tipo
+    return "document"
+
+
+class LimiteUploadHandler(FileUploadHandler):
+    """
+    Primer handler de la cadena: cuenta bytes por archivo y lo descarta
+    (SkipFile) al pasarse del límite de su tipo, sin esperar a que termine
+    de llegar. Lo rechazado queda en `rechazados` para reportarlo.
+    """
+
+    def __init__(self, request=None, limites: dict | None = None, defecto: int | None = None):
+        super().__init__(request)
+        self.limites = LIMITES_MEDIA if limites is None else limites
+        self.defecto = defecto or self.limites.get("document") or 100 * MB
+        self.rechazados: list[dict] = []
+        self.total = 0
+        self._inicio = time.monotonic()
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        self._inicio = time.monotonic()
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        self.tipo = tipo_por_mime(content_type)
+        self.limite = self.limites.get(self.tipo, self.defecto)
+        self.recibidos = 0
+        if content_length and content_length > self.limite:
+            self._rechazar()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.recibidos += len(raw_data)
+        self.total += len(raw_data)
+        if self.recibidos > self.limite:
+            self._rechazar()
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+    def upload_complete(self):
+        seg = max(time.monotonic() - self._inicio, 1e-6)
+        logger.info(
+            "Upload %s: %.1f MB en %.2fs (%.1f MB/s), %s rechazados",
+            getattr(self.request, "path", ""), self.total / MB, seg, self.total / MB / seg, len(self.rechazados),
+        )
+
+    def _rechazar(self):
+        self.rechazados.append({
+            "filename": self.file_name,
+            "error": f"Excede el límite de {self.limite / MB:g} MB para {self.tipo}",
+        })
+        raise SkipFile()
+
+
+def usar_subida_en_disco(request, limites: dict | None = None, defecto: int | None = None) -> LimiteUploadHandler:
+    """
+    Cambia los upload handlers del request: límite por tipo y todo a archivo
+    temporal. Hay que llamarlo antes de tocar request.data / request.FILES.
+    """
+    http_request = getattr(request, "_request", request)
+    limite = LimiteUploadHandler(http_request, limites, defecto)
+    try:
+        http_request.upload_handlers = [limite, TemporaryFileUploadHandler(http_request)]
+    except AttributeError:
+        # el body ya se parseó (p. ej. lo leyó el check de CSRF); se queda como vino
+        logger.warning("Upload %s: el body ya se había leído, sin límites por tipo", http_request.path)
+    return limite
+
+
+class CuerpoMultipart:
+    """
+    Cuerpo multipart/form-data con un solo archivo, leído por chunks.
+    Tiene __iter__ y __len__, así `requests` lo manda en streaming con
+    Content-Length (sin chunked encoding, que Graph no siempre acepta).
+    Cada iteración vuelve al inicio del archivo, para poder reintentar.
+    """
+
+    CHUNK = 64 * 1024
+
+    def __init__(self, campos: dict, campo_archivo: str, archivo, filename: str, content_type: str):
+        self.boundary = uuid.uuid4().hex
+        self.archivo = archivo
+        self._inicio = archivo.tell()
+
+        filename = (filename or "file").replace('"', "%22")
+        partes = [
+            f'--{self.boundary}\r\nContent-Disposition: form-data; name="{k}"\r\n\r\n{v}\r\n'
+            for k, v in campos.items()
+        ]
+        partes.append(
+            f"--{self.boundary}\r\n"
+            f'Content-Disposition: form-data; name="{campo_archivo}"; filename="{filename}"\r\n'
+            f"Content-Type: {content_type or 'application/octet-stream'}\r\n\r\n"
+        )
+        self._cabecera = "".join(partes).encode("utf-8")
+        self._cierre = f"\r\n--{self.boundary}--\r\n".encode("ascii")
+
+        archivo.seek(0, os.SEEK_END)
+        self.tamano = archivo.tell() - self._inicio
+        archivo.seek(self._inicio)
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self):
+        return len(self._cabecera) + self.tamano + len(self._cierre)
+
+    def __iter__(self):
+        self.archivo.seek(self._inicio)
+        yield self._cabecera
+        while True:
+            chunk = self.archivo.read(self.CHUNK)
+            if not chunk:
+                break
+            yield chunk
+        yield self._cierre
@@ -1,3 +1,1126 @@
-from django.test import TestCase
+import asyncio
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import MemoryFileUploadHandler
+from django.db import connection
+from django.db.models import F
+from django.http.multipartparser import MultiPartParser
+from django.test import AsyncRequestFactory, SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import busqueda, campanas, contacto, eventos, importacion, inbox, ingesta, limitador, media_cache, outbox, subidas
+from .contacto import ErrorMeta, GRAPH_PRESUPUESTO
+from .idempotencia import wa_ids_vistos
+from .importacion import importar, leer_filas
+from .models import CampanaEnvio, CampanaEnvioDestinatario, ClientesDigitales, MensajeWhatsApp
+from .paginacion import codificar_cursor
+from .serializers import WhatsAppMessageListSerializer
+from .subidas import CuerpoMultipart
+from .views import contacto_stream, ProspectosViewSet
+
+
+def payload(mensajes=(), estados=()):
+    """Payload del webhook de Meta con mensajes de texto (id, from) y statuses."""
+    return {
+        "entry": [{
+            "changes": [{
+                "value": {
+                    "contacts": [{"wa_id": tel, "profile": {"name": "Cliente"}} for _, tel in mensajes],
+                    "messages": [
+                        {"id": wa_id, "from": tel, "type": "text", "text": {"body": f"hola {wa_id}"}}
+                        for wa_id, tel in mensajes
+                    ],
+                    "statuses": list(estados),
+                },
+            }],
+        }],
+    }
+
+
+def status(wa_id, nombre, ts):
+    return {"id": wa_id, "status": nombre, "timestamp": str(ts)}
+
+
+class IngestaTestCase(TestCase):
+    def setUp(self):
+        wa_ids_vistos._items.clear()
+        self.addCleanup(wa_ids_vistos._items.clear)
+        parche = mock.patch.object(ingesta, "PRECARGA_MEDIA", False)
+        parche.start()
+        self.addCleanup(parche.stop)
+
+    def procesar(self, body):
+        with self.captureOnCommitCallbacks(execute=True):
+            ingesta.procesar_payload(body)
+
+
+class ProcesamientoLoteTests(IngestaTestCase):
+    def test_mensajes_y_statuses_de_un_payload(self):
+        MensajeWhatsApp.objects.create(
+            telefono="525500000009", direction="out", body="hola", wa_message_id="wamid.out", status="accepted",
+        )
+        self.procesar(payload(
+            [("wamid.a", "5215500000001"), ("wamid.b", "5215500000001"), ("wamid.c", "5215500000002")],
+            [status("wamid.out", "delivered", 1_700_000_100), status("wamid.nadie", "read", 1_700_000_100)],
+        ))
+
+        self.assertEqual(MensajeWhatsApp.objects.filter(direction="in").count(), 3)
+        self.assertEqual(
+            dict(ClientesDigitales.objects.values_list("telefono", "unread_count")),
+            {"525500000001": 2, "525500000002": 1},
+        )
+        self.assertEqual(MensajeWhatsApp.objects.get(wa_message_id="wamid.out").status, "delivered")
+
+    def test_queries_no_crecen_con_el_payload(self):
+        def queries(n, base):
+            body = payload(
+                [(f"wamid.{base}{i}", f"52155{base}{i:05d}") for i in range(n)],
+                [status(f"wamid.{base}{i}", "read", 1_700_000_100) for i in range(n)],
+            )
+            with CaptureQueriesContext(connection) as q:
+                self.procesar(body)
+            return len(q)
+
+        self.assertEqual(queries(2, 10), queries(20, 20))
+        self.assertEqual(MensajeWhatsApp.objects.filter(direction="in").count(), 22)
+
+
+class InboxReintentosTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        base = Path(tmp.name)
+        for nombre in ("ENTRANTES", "PROCESANDO", "ERRORES"):
+            p = mock.patch.object(inbox, nombre, base / nombre.lower())
+            p.start()
+            self.addCleanup(p.stop)
+        p = mock.patch.object(inbox.despachador, "despertar")
+        p.start()
+        self.addCleanup(p.stop)
+
+    def drenar(self, procesar):
+        with mock.patch.object(inbox, "procesar_payload", side_effect=procesar):
+            return inbox.drenar()
+
+    def test_fallo_regresa_a_entrantes_con_backoff(self):
+        inbox.encolar(b'{"entry": []}')
+        self.assertEqual(self.drenar(RuntimeError("bd caída")), 1)
+
+        [ruta] = list(inbox.ENTRANTES.glob("*.json"))
+        self.assertTrue(ruta.name.endswith("~1.json"))
+        self.assertGreater(ruta.stat().st_mtime, time.time())
+        # aún no toca reintentarlo
+        self.assertEqual(self.drenar(None), 0)
+
+        os.utime(ruta, (time.time() - 1, time.time() - 1))
+        procesar = mock.Mock()
+        self.assertEqual(self.drenar(procesar), 1)
+        procesar.assert_called_once_with({"entry": []})
+        self.assertEqual(list(inbox.ENTRANTES.iterdir()), [])
+
+    def test_se_estaciona_tras_max_intentos(self):
+        inbox.encolar(b'{"entry": []}')
+        for _ in range(inbox.MAX_INTENTOS):
+            for ruta in inbox.ENTRANTES.glob("*.json"):
+                os.utime(ruta, (0, 0))
+            self.drenar(RuntimeError("bd caída"))
+
+        self.assertEqual(list(inbox.ENTRANTES.glob("*.json")), [])
+        self.assertEqual(len(list(inbox.ERRORES.glob("*.json"))), 1)
+
+        self.assertEqual(inbox.reencolar_errores(), 1)
+        [ruta] = list(inbox.ENTRANTES.glob("*.json"))
+        self.assertNotIn("~", ruta.name)
+        self.assertEqual(list(inbox.ERRORES.iterdir()), [])
+
+    def test_json_invalido_se_conserva_en_errores(self):
+        inbox.encolar(b"{no es json")
+        with self.assertLogs("Digitales.inbox", "ERROR"):
+            self.drenar(None)
+        [ruta] = list(inbox.ERRORES.glob("*.json"))
+        self.assertEqual(ruta.read_bytes(), b"{no es json")
+        self.assertTrue((inbox.ERRORES / f"{ruta.name}.err").exists())
+
+
+class StatusTests(IngestaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.msg = MensajeWhatsApp.objects.create(
+            telefono="525512345678", direction="out", body="hola", wa_message_id="wamid.out", status="accepted",
+        )
+
+    def procesar(self, *estados):
+        super().procesar(payload(estados=estados))
+        self.msg.refresh_from_db()
+
+    def test_status_atrasado_no_retrocede(self):
+        self.procesar(status("wamid.out", "read", 1_700_000_200))
+        read_at = self.msg.read_at
+        self.procesar(status("wamid.out", "delivered", 1_700_000_100), status("wamid.out", "sent", 1_700_000_050))
+
+        self.assertEqual(self.msg.status, "read")
+        self.assertEqual(self.msg.read_at, read_at)
+
+    def test_statuses_desordenados_en_un_payload(self):
+        self.procesar(
+            status("wamid.out", "delivered", 1_700_000_100),
+            status("wamid.out", "sent", 1_700_000_050),
+            status("wamid.out", "read", 1_700_000_200),
+        )
+        self.assertEqual(self.msg.status, "read")
+        self.assertIsNotNone(self.msg.delivered_at)
+        self.assertEqual(int(self.msg.read_at.timestamp()), 1_700_000_200)
+
+    def test_failed_guarda_el_error(self):
+        self.procesar({
+            "id": "wamid.out", "status": "failed", "timestamp": "1700000300",
+            "errors": [{"code": 131026, "title": "Message undeliverable"}],
+        })
+        self.assertEqual(self.msg.status, "failed")
+        self.assertEqual(self.msg.error_code, 131026)
+        self.assertEqual(self.msg.error_title, "Message undeliverable")
+
+
+class IdempotenciaTests(IngestaTestCase):
+    def test_reentrega_no_duplica(self):
+        body = payload([("wamid.a", "5215512345678"), ("wamid.b", "5215512345678")])
+        self.procesar(body)
+        self.procesar(body)
+
+        self.assertEqual(MensajeWhatsApp.objects.filter(wa_message_id__in=["wamid.a", "wamid.b"]).count(), 2)
+        cliente = ClientesDigitales.objects.get(telefono="525512345678")
+        self.assertEqual(cliente.unread_count, 2)
+
+    def test_reentrega_con_cache_frio_no_duplica(self):
+        body = payload([("wamid.a", "5215512345678")])
+        self.procesar(body)
+        wa_ids_vistos._items.clear()
+        self.procesar(payload([("wamid.a", "5215512345678"), ("wamid.c", "5215512345678")]))
+
+        self.assertEqual(MensajeWhatsApp.objects.filter(wa_message_id="wamid.a").count(), 1)
+        self.assertTrue(MensajeWhatsApp.objects.filter(wa_message_id="wamid.c").exists())
+
+    def test_rollback_no_marca_ids_como_vistos(self):
+        body = payload([("wamid.a", "5215512345678")], [status("wamid.x", "delivered", 100)])
+        with mock.patch.object(ingesta, "_aplicar_estados", side_effect=RuntimeError("bd caída")):
+            with self.assertRaises(RuntimeError):
+                self.procesar(body)
+
+        self.assertFalse(MensajeWhatsApp.objects.filter(wa_message_id="wamid.a").exists())
+        self.assertFalse(wa_ids_vistos.contiene("wamid.a"))
+
+        # el reintento del inbox sí lo guarda
+        self.procesar(body)
+        self.assertTrue(MensajeWhatsApp.objects.filter(wa_message_id="wamid.a").exists())
+
+
+class ProspectoEdicionTests(TestCase):
+    def setUp(self):
+        self.cliente = ClientesDigitales.objects.create(
+            telefono="525500000001", nombre="Ana", unread_count=2, ultimo_msg_preview="hola",
+        )
+
+    def test_upsert_no_toca_columnas_denormalizadas(self):
+        r = self.client.post(
+            "/digitales/api/prospectos/",
+            {"telefono": "5500000001", "nombre": "Ana Pérez", "unread_count": 0, "ultimo_msg_preview": "x"},
+            content_type="application/json",
+        )
+        self.assertEqual(r.status_code, 200)
+        self.cliente.refresh_from_db()
+        self.assertEqual((self.cliente.nombre, self.cliente.unread_count, self.cliente.ultimo_msg_preview), ("Ana Pérez", 2, "hola"))
+
+    def test_patch_no_pisa_mensajes_que_llegan_mientras_tanto(self):
+        get_object = ProspectosViewSet.get_object
+
+        def leer_y_llega_mensaje(vista):
+            obj = get_object(vista)
+            # la ingesta guarda un mensaje entre la lectura y el save de la vista
+            ClientesDigitales.objects.filter(pk=obj.pk).update(unread_count=F("unread_count") + 1, ultimo_msg_preview="nuevo")
+            return obj
+
+        with mock.patch.object(ProspectosViewSet, "get_object", leer_y_llega_mensaje):
+            r = self.client.patch(
+                f"/digitales/api/prospectos/{self.cliente.pk}/", {"estado": "Cita"}, content_type="application/json",
+            )
+        self.assertEqual(r.status_code, 200)
+        self.cliente.refresh_from_db()
+        self.assertEqual((self.cliente.estado, self.cliente.unread_count, self.cliente.ultimo_msg_preview), ("Cita", 3, "nuevo"))
+
+
+class ChatsCursorTests(TestCase):
+    def setUp(self):
+        ahora = timezone.now()
+        self.ids = []
+        # el orden es -ultimo_contacto_at, -id; los que nunca han tenido contacto van al final
+        for i, (minutos, unread) in enumerate([(1, 0), (2, 3), (2, 0), (5, 1), (None, 0)]):
+            c = ClientesDigitales.objects.create(telefono=f"52550000010{i}")
+            ClientesDigitales.objects.filter(pk=c.pk).update(
+                ultimo_contacto_at=ahora - timedelta(minutes=minutos) if minutos is not None else None,
+                unread_count=unread,
+            )
+            self.ids.append(c.pk)
+
+    def paginas(self, **params):
+        vistos, cursor = [], ""
+        while True:
+            r = self.client.get("/digitales/chats/", {**params, "limit": 2, "cursor": cursor})
+            self.assertEqual(r.status_code, 200)
+            vistos.append([c["id"] for c in r.json()])
+            cursor = r["X-Next-Cursor"]
+            if not cursor:
+                return vistos
+
+    def test_recorre_todo_sin_repetir(self):
+        a, b, c, d, e = self.ids
+        self.assertEqual(self.paginas(), [[a, c], [b, d], [e]])
+
+    def test_filtro_unread(self):
+        _, b, _, d, _ = self.ids
+        self.assertEqual(self.paginas(unread=1), [[b, d]])
+
+    def test_cursor_invalido_es_400(self):
+        r = self.client.get("/digitales/chats/", {"cursor": "no-es-un-cursor"})
+        self.assertEqual(r.status_code, 400)
+
+
+class ContactoPaginadoTests(TestCase):
+    TEL = "525500000201"
+
+    def setUp(self):
+        self.cliente = ClientesDigitales.objects.create(telefono=self.TEL)
+        ClientesDigitales.objects.filter(pk=self.cliente.pk).update(unread_count=4)
+        ahora = timezone.now()
+        self.ids = []
+        # dos mensajes en el mismo instante: el cursor desempata por id
+        for minutos in (10, 8, 8, 5, 1):
+            m = MensajeWhatsApp.objects.create(telefono=self.TEL, direction="in", body=f"m{minutos}")
+            MensajeWhatsApp.objects.filter(pk=m.pk).update(created_at=ahora - timedelta(minutes=minutos))
+            self.ids.append(m.pk)
+
+    def get(self, **params):
+        return self.client.get("/digitales/contacto/", {"tel": self.TEL, "limit": 2, **params})
+
+    def test_paginas_hacia_atras(self):
+        r = self.get()
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual([m["id"] for m in r.json()["mensajes"]], self.ids[3:])
+        self.cliente.refresh_from_db()
+        self.assertEqual(self.cliente.unread_count, 0)
+
+        ClientesDigitales.objects.filter(pk=self.cliente.pk).update(unread_count=1)
+        r = self.get(before=r.json()["before"])
+        self.assertEqual([m["id"] for m in r.json()["mensajes"]], self.ids[1:3])
+        r = self.get(before=r.json()["before"])
+        self.assertEqual([m["id"] for m in r.json()["mensajes"]], self.ids[:1])
+        self.assertIsNone(r.json()["before"])
+        # el scroll hacia atrás no marca leído
+        self.cliente.refresh_from_db()
+        self.assertEqual(self.cliente.unread_count, 1)
+
+    def test_before_invalido_es_400(self):
+        for before in ("basura", codificar_cursor({"id": 1}), codificar_cursor({"t": "ayer", "id": 1})):
+            self.assertEqual(self.get(before=before).status_code, 400, before)
+
+
+class AdjuntosSerializerTests(TestCase):
+    def test_adjunto_sale_de_las_columnas_sin_leer_raw(self):
+        campos = ingesta._media({"type": "document", "document": {"id": "m1", "mime_type": "application/pdf", "filename": "cotizacion.pdf"}})
+        MensajeWhatsApp.objects.create(telefono="525500000001", direction="in", media_size=10, **campos)
+        msg = MensajeWhatsApp.objects.defer("raw").get()
+
+        with self.assertNumQueries(0):
+            data = WhatsAppMessageListSerializer(msg).data
+
+        [adjunto] = data["attachments"]
+        self.assertEqual(
+            {k: adjunto[k] for k in ("id", "kind", "mime", "name", "size")},
+            {"id": "m1", "kind": "file", "mime": "application/pdf", "name": "cotizacion.pdf", "size": 10},
+        )
+        self.assertTrue(adjunto["url"].endswith("/m1/"))
+        self.assertFalse(data["is_media"])
+
+
+class GraphSessionTests(SimpleTestCase):
+    def setUp(self):
+        puertos = self.puertos = []
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                puertos.append(self.client_address[1])
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"{}")
+
+            def log_message(self, *args):
+                pass
+
+        servidor = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=servidor.serve_forever, daemon=True).start()
+        self.addCleanup(servidor.server_close)
+        self.addCleanup(servidor.shutdown)
+        self.url = f"http://127.0.0.1:{servidor.server_port}/v1/media"
+        parche = mock.patch.object(contacto, "_session", None)
+        parche.start()
+        self.addCleanup(parche.stop)
+
+    def test_una_sesion_y_conexion_reutilizada(self):
+        sesion = contacto.graph_session()
+        self.assertIs(contacto.graph_session(), sesion)
+        self.addCleanup(sesion.close)
+
+        for _ in range(3):
+            r = contacto._graph("GET", self.url, json_body=False)
+            self.assertEqual(r.status_code, 200)
+        # keep-alive: las tres llamadas salieron por la misma conexión
+        self.assertEqual(len(self.puertos), 3)
+        self.assertEqual(len(set(self.puertos)), 1)
+
+    def test_post_no_se_reintenta(self):
+        retry = contacto.graph_session().get_adapter("https://graph.facebook.com").max_retries
+        self.assertNotIn("POST", retry.allowed_methods)
+        self.assertEqual(retry.read, 0)
+
+
+class CampanaLeaseTests(TestCase):
+    def setUp(self):
+        for i in range(3):
+            ClientesDigitales.objects.create(telefono=f"52550000000{i}", agencia="Centro")
+        self.campana = campanas.crear_campana("promo", "es_MX", [], {"agencia": "Centro"})
+        p = mock.patch.object(
+            campanas, "enviar_template_whatsapp", side_effect=lambda to, **kw: {"messages": [{"id": f"wamid.{to}"}]},
+        )
+        self.enviar = p.start()
+        self.addCleanup(p.stop)
+        p = mock.patch.object(campanas, "MPS", 0)
+        p.start()
+        self.addCleanup(p.stop)
+
+    def test_crear_es_atomico(self):
+        with mock.patch.object(CampanaEnvioDestinatario.objects, "bulk_create", side_effect=RuntimeError("bd")):
+            with self.assertRaises(RuntimeError):
+                campanas.crear_campana("promo", "es_MX", [], {"agencia": "Centro"})
+        self.assertEqual(CampanaEnvio.objects.count(), 1)
+
+    def test_no_se_toma_con_el_latido_al_dia(self):
+        CampanaEnvio.objects.filter(pk=self.campana.pk).update(
+            estado=CampanaEnvio.Estado.ENVIANDO, ejecucion="otra", latido_at=timezone.now(),
+        )
+        self.assertFalse(campanas.ejecutar_campana(self.campana.pk))
+        self.enviar.assert_not_called()
+
+    def test_dos_reclamos_no_comparten_destinatarios(self):
+        a = campanas._reclamar_lote(self.campana, "a")
+        b = campanas._reclamar_lote(self.campana, "b")
+        self.assertEqual(len(a), 3)
+        # ya no quedan pendientes para la segunda
+        self.assertIsNone(b)
+
+    def test_lease_vencido_se_reanuda(self):
+        inicio = timezone.now() - timedelta(hours=1)
+        CampanaEnvio.objects.filter(pk=self.campana.pk).update(
+            estado=CampanaEnvio.Estado.ENVIANDO,
+            ejecucion="muerta",
+            iniciado_at=inicio,
+            latido_at=timezone.now() - timedelta(seconds=campanas.LEASE + 5),
+        )
+        colgado = CampanaEnvioDestinatario.objects.filter(campana=self.campana).order_by("id").first()
+        CampanaEnvioDestinatario.objects.filter(pk=colgado.pk).update(
+            estado=CampanaEnvioDestinatario.Estado.ENVIANDO, ejecucion="muerta",
+        )
+
+        self.assertTrue(campanas.ejecutar_campana(self.campana.pk))
+
+        self.campana.refresh_from_db()
+        colgado.refresh_from_db()
+        self.assertEqual(self.campana.estado, CampanaEnvio.Estado.TERMINADA)
+        self.assertEqual(self.campana.iniciado_at, inicio)
+        self.assertEqual((self.campana.enviados, self.campana.fallidos), (2, 1))
+        # no se reenvía a ciegas lo que quedó a medias
+        self.assertEqual(colgado.estado, CampanaEnvioDestinatario.Estado.FALLIDO)
+        self.assertEqual(self.enviar.call_count, 2)
+
+
+class LimitadorTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        ruta = mock.patch.object(limitador, "RUTA", Path(tmp.name) / "rate.sqlite3")
+        ruta.start()
+        self.addCleanup(ruta.stop)
+        self.ahora = 1000.0
+        reloj = mock.patch("Digitales.limitador.time.time", side_effect=lambda: self.ahora)
+        reloj.start()
+        self.addCleanup(reloj.stop)
+        self.cubeta = limitador.CubetaTokens("prueba", 10)
+
+    def factor(self):
+        return limitador._conexion().execute("SELECT factor FROM cubetas WHERE nombre = 'prueba'").fetchone()[0]
+
+    def test_frenar_divide_la_tasa_una_vez_por_pausa_y_se_recupera(self):
+        self.assertEqual(self.cubeta._intentar(), 0.0)
+
+        self.cubeta.frenar(5)
+        self.assertAlmostEqual(self.factor(), 0.5)
+        # otro rechazo de la misma ráfaga: la pausa sigue, el factor no baja otra vez
+        self.ahora += 1
+        self.cubeta.frenar(5)
+        self.assertAlmostEqual(self.factor(), 0.55)
+        self.assertAlmostEqual(self.cubeta._intentar(), 5.0)
+
+        # ya fuera de la pausa un nuevo rechazo sí la divide
+        self.ahora += 6
+        self.cubeta.frenar(1)
+        self.assertAlmostEqual(self.factor(), (0.55 + 6 * limitador.RECUPERA_POR_SEGUNDO) / 2)
+
+        self.ahora += 60
+        self.cubeta._intentar()
+        self.assertEqual(self.factor(), 1.0)
+
+    def test_factor_no_baja_del_minimo(self):
+        for _ in range(10):
+            self.ahora += 1
+            self.cubeta.frenar(0.5)
+        self.assertAlmostEqual(self.factor(), limitador.FACTOR_MINIMO)
+
+    def test_tomar_con_plazo_no_espera_de_mas(self):
+        self.cubeta.frenar(30)
+        with mock.patch("Digitales.limitador.time.sleep") as dormir:
+            self.assertFalse(self.cubeta.tomar(hasta=time.monotonic() + 5))
+        dormir.assert_not_called()
+
+
+class GraphPlazoTests(SimpleTestCase):
+    def throttled(self):
+        r = mock.Mock(status_code=429, headers={"Retry-After": "30"}, text="throttled")
+        r.json.return_value = {"error": {"code": 130429}}
+        return r
+
+    def test_throttling_sin_plazo_falla_de_inmediato(self):
+        cubeta = mock.Mock(nombre="mensajes")
+        cubeta.tomar.return_value = True
+        sesion = mock.Mock()
+        sesion.request.return_value = self.throttled()
+        with mock.patch.object(contacto, "graph_session", return_value=sesion), \
+                mock.patch.object(contacto.limitador, "mensajes", cubeta), \
+                mock.patch("Digitales.contacto.time.sleep") as dormir:
+            with self.assertRaises(ErrorMeta) as ctx:
+                contacto.editar_texto_whatsapp("5215500000001", "wamid.1", "hola", hasta=contacto.plazo_interactivo())
+        self.assertEqual(ctx.exception.status_code, 429)
+        self.assertEqual(sesion.request.call_count, 1)
+        # la pausa igual queda registrada para los demás workers
+        cubeta.frenar.assert_called_once()
+        dormir.assert_not_called()
+
+    def test_sin_token_dentro_del_plazo(self):
+        cubeta = mock.Mock(nombre="mensajes")
+        cubeta.tomar.return_value = False
+        sesion = mock.Mock()
+        with mock.patch.object(contacto, "graph_session", return_value=sesion), \
+                mock.patch.object(contacto.limitador, "mensajes", cubeta):
+            with self.assertRaises(ErrorMeta):
+                contacto.enviar_template_whatsapp("5215500000001", "hola", hasta=contacto.plazo_interactivo())
+        sesion.request.assert_not_called()
+
+
+class EnviarMediaTests(TestCase):
+    def test_cada_envio_aceptado_se_guarda_aunque_falle_otro(self):
+        def enviar(to, media_id, **kw):
+            if media_id == "m2":
+                raise ErrorMeta("Meta send error 400", 400)
+            return {"messages": [{"id": f"wamid.{media_id}"}]}
+
+        def subir(f, filename, content_type, **kw):
+            return {"id": "m1" if filename == "a.jpg" else "m2"}
+
+        with mock.patch("Digitales.views.subir_media_whatsapp", side_effect=subir), \
+                mock.patch("Digitales.views.enviar_media_whatsapp", side_effect=enviar):
+            r = self.client.post("/digitales/mensajes/enviar-media/", {
+                "to": "5500000001",
+                "files": [
+                    SimpleUploadedFile("a.jpg", b"a", content_type="image/jpeg"),
+                    SimpleUploadedFile("b.jpg", b"b", content_type="image/jpeg"),
+                ],
+            })
+
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual([f["filename"] for f in r.json()["failed"]], ["b.jpg"])
+        msg = MensajeWhatsApp.objects.get()
+        self.assertEqual((msg.wa_message_id, msg.media_id, msg.cliente.ultimo_msg_id), ("wamid.m1", "m1", msg.pk))
+
+
+class CuerpoMultipartTests(SimpleTestCase):
+    def test_streaming_reiterable_y_valido(self):
+        contenido = bytes(range(256)) * 1000
+        archivo = io.BytesIO(b"ya leido" + contenido)
+        archivo.seek(len(b"ya leido"))
+        cuerpo = CuerpoMultipart({"messaging_product": "whatsapp"}, "file", archivo, 'a "b".pdf', "application/pdf")
+
+        partes = list(cuerpo)
+        # por chunks: ningún pedazo trae el archivo completo
+        self.assertLessEqual(max(len(p) for p in partes), CuerpoMultipart.CHUNK)
+        datos = b"".join(partes)
+        self.assertEqual(len(datos), len(cuerpo))
+        # un reintento vuelve a mandar el mismo cuerpo
+        self.assertEqual(b"".join(cuerpo), datos)
+
+        meta = {"CONTENT_TYPE": cuerpo.content_type, "CONTENT_LENGTH": str(len(datos))}
+        post, files = MultiPartParser(meta, io.BytesIO(datos), [MemoryFileUploadHandler()]).parse()
+        self.assertEqual(post["messaging_product"], "whatsapp")
+        self.assertEqual(files["file"].read(), contenido)
+        self.assertEqual(files["file"].content_type, "application/pdf")
+
+
+class LimiteUploadTests(TestCase):
+    def test_archivo_que_excede_su_tipo_se_rechaza_sin_subir(self):
+        with mock.patch.dict(subidas.LIMITES_MEDIA, {"image": 10}), \
+                mock.patch("Digitales.views.subir_media_whatsapp") as subir:
+            r = self.client.post("/digitales/mensajes/enviar-media/", {
+                "to": "5500000001",
+                "files": [SimpleUploadedFile("grande.jpg", b"x" * 20, content_type="image/jpeg")],
+            })
+        self.assertEqual(r.status_code, 400)
+        self.assertEqual([f["filename"] for f in r.json()["failed"]], ["grande.jpg"])
+        subir.assert_not_called()
+
+
+class RespuestaLenta:
+    """Respuesta de Meta que entrega el segundo chunk solo cuando se le permite."""
+
+    def __init__(self):
+        self.headers = {"content-type": "image/jpeg", "content-length": "6"}
+        self.sigue = threading.Event()
+
+    def iter_content(self, n):
+        yield b"abc"
+        self.sigue.wait(5)
+        yield b"def"
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class MediaCacheDescargaTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        for parche in (
+            mock.patch.object(media_cache, "CACHE_DIR", Path(tmp.name)),
+            mock.patch.object(media_cache.MensajeWhatsApp, "registrar_media"),
+            mock.patch.object(media_cache, "contar"),
+        ):
+            parche.start()
+            self.addCleanup(parche.stop)
+        self.r = RespuestaLenta()
+        parche = mock.patch.object(media_cache, "abrir_media_whatsapp", return_value=(self.r, {}))
+        self.abrir = parche.start()
+        self.addCleanup(parche.stop)
+
+    def test_lectores_siguen_la_descarga_sin_bloquearse(self):
+        primero = media_cache.transmitir("m1")
+        chunks = iter(primero["stream"])
+        self.assertEqual(next(chunks), b"abc")
+
+        # con la descarga a medias, otro request no espera a que termine
+        segundo = media_cache.transmitir("m1")
+        self.assertEqual(self.abrir.call_count, 1)
+        # el primer cliente se va: la descarga sigue y llena la caché
+        primero["stream"].close()
+
+        self.r.sigue.set()
+        self.assertEqual(b"".join(segundo["stream"]), b"abcdef")
+        segundo["stream"].close()
+
+        meta = media_cache.obtener("m1")
+        self.assertEqual((meta["size"], meta["ruta"].read_bytes()), (6, b"abcdef"))
+        self.assertEqual(self.abrir.call_count, 1)
+
+
+class MediaProxyTests(TestCase):
+    CONTENIDO = bytes(range(256)) * 4
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        ruta = Path(tmp.name) / "media.bin"
+        ruta.write_bytes(self.CONTENIDO)
+        self.meta = {
+            "ruta": ruta,
+            "content_type": "image/jpeg",
+            "size": len(self.CONTENIDO),
+            "sha256": "abc123",
+            "guardado": time.time() - 60,
+        }
+        for fn in ("obtener", "transmitir"):
+            parche = mock.patch(f"Digitales.views.media_cache.{fn}", return_value=self.meta)
+            parche.start()
+            self.addCleanup(parche.stop)
+
+    def get(self, **headers):
+        return self.client.get("/digitales/media/m1/", headers=headers)
+
+    def test_completo(self):
+        r = self.get()
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(b"".join(r.streaming_content), self.CONTENIDO)
+        self.assertEqual(r["ETag"], '"abc123"')
+        self.assertEqual(r["Accept-Ranges"], "bytes")
+
+    def test_rango_es_206(self):
+        r = self.get(range="bytes=10-19")
+        self.assertEqual(r.status_code, 206)
+        self.assertEqual(r["Content-Range"], f"bytes 10-19/{len(self.CONTENIDO)}")
+        self.assertEqual(b"".join(r.streaming_content), self.CONTENIDO[10:20])
+
+    def test_rango_sufijo(self):
+        r = self.get(range="bytes=-5")
+        self.assertEqual(r.status_code, 206)
+        self.assertEqual(b"".join(r.streaming_content), self.CONTENIDO[-5:])
+
+    def test_rango_fuera_del_archivo_es_416(self):
+        r = self.get(range=f"bytes={len(self.CONTENIDO)}-")
+        self.assertEqual(r.status_code, 416)
+        self.assertEqual(r["Content-Range"], f"bytes */{len(self.CONTENIDO)}")
+
+    def test_etag_igual_es_304(self):
+        r = self.get(if_none_match='"abc123"')
+        self.assertEqual(r.status_code, 304)
+        self.assertEqual(r.content, b"")
+
+    def test_if_range_viejo_manda_todo(self):
+        r = self.get(range="bytes=0-9", if_range='"otro"')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(b"".join(r.streaming_content), self.CONTENIDO)
+
+
+class MediaInfoCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.ahora = 100.0
+        self.pedidos = []
+
+        def info(media_id):
+            self.pedidos.append(media_id)
+            return {"id": media_id, "url": f"https://cdn/{media_id}/{len(self.pedidos)}"}
+
+        for parche in (
+            mock.patch.dict(contacto._media_info, clear=True),
+            mock.patch.object(contacto, "get_media_info_whatsapp", side_effect=info),
+            mock.patch("Digitales.contacto.time.monotonic", side_effect=lambda: self.ahora),
+        ):
+            parche.start()
+            self.addCleanup(parche.stop)
+
+    def test_ttl_y_refrescar(self):
+        primero = contacto.media_info_whatsapp("m1")
+        self.ahora += contacto.MEDIA_INFO_TTL - 1
+        self.assertEqual(contacto.media_info_whatsapp("m1"), primero)
+        self.assertEqual(self.pedidos, ["m1"])
+
+        self.assertNotEqual(contacto.media_info_whatsapp("m1", refrescar=True), primero)
+        self.ahora += contacto.MEDIA_INFO_TTL
+        contacto.media_info_whatsapp("m1")
+        self.assertEqual(self.pedidos, ["m1"] * 3)
+
+    def test_tope_descarta_lo_mas_viejo(self):
+        with mock.patch.object(contacto, "MEDIA_INFO_MAXIMO", 10):
+            for i in range(11):
+                contacto.media_info_whatsapp(f"m{i}")
+        self.assertEqual(len(contacto._media_info), 10)
+        self.assertNotIn("m0", contacto._media_info)
+        self.assertIn("m10", contacto._media_info)
+
+    def test_url_vencida_pide_info_nuevo_una_vez(self):
+        vencida = mock.Mock(status_code=403, text="expired")
+        buena = mock.Mock(status_code=200)
+        with mock.patch.object(contacto, "_graph", side_effect=[vencida, buena]) as graph:
+            r, info = contacto.abrir_media_whatsapp("m1")
+        self.assertIs(r, buena)
+        self.assertEqual(self.pedidos, ["m1", "m1"])
+        self.assertEqual(graph.call_args.args[1], info["url"])
+        vencida.close.assert_called_once()
+
+
+class MiniaturaTests(TestCase):
+    def test_documento_no_se_descarga_para_miniatura(self):
+        MensajeWhatsApp.objects.create(
+            telefono="525500000001", direction="in", media_id="doc1",
+            media_mime="application/pdf", media_tipo="document",
+        )
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        with mock.patch("Digitales.miniaturas.media_cache.ruta_derivada", return_value=Path(tmp.name) / "doc1.thumb"), \
+                mock.patch("Digitales.miniaturas.media_cache.obtener") as obtener:
+            r = self.client.get("/digitales/media/doc1/thumb/")
+        self.assertEqual(r.status_code, 404)
+        obtener.assert_not_called()
+
+
+class PrecargaMediaTests(IngestaTestCase):
+    def test_media_entrante_se_precarga_al_confirmar(self):
+        body = payload([("wamid.m1", "5215500000001"), ("wamid.m2", "5215500000001")])
+        mensajes = body["entry"][0]["changes"][0]["value"]["messages"]
+        for m, tipo, mime in zip(mensajes, ("image", "document"), ("image/jpeg", "application/pdf")):
+            m.update({"type": tipo, tipo: {"id": f"media.{tipo}", "mime_type": mime}})
+
+        with mock.patch.object(ingesta, "PRECARGA_MEDIA", True), \
+                mock.patch.object(ingesta, "en_segundo_plano") as fondo:
+            with self.captureOnCommitCallbacks(execute=False) as callbacks:
+                ingesta.procesar_payload(body)
+            # nada sale a Meta antes de que el lote quede guardado
+            fondo.assert_not_called()
+            for cb in callbacks:
+                cb()
+
+        self.assertEqual(
+            [c.args[1:] for c in fondo.call_args_list],
+            [(ingesta._precargar, "media.image"), (ingesta._precargar, "media.document")],
+        )
+
+    def test_miniatura_solo_si_el_tipo_la_admite(self):
+        with mock.patch.object(ingesta.media_cache, "obtener", side_effect=lambda media_id: {
+            "content_type": "image/jpeg" if media_id == "img" else "application/pdf",
+        }), mock.patch.object(ingesta.miniaturas, "disponible", side_effect=lambda tipo: tipo == "image"), \
+                mock.patch.object(ingesta.miniaturas, "obtener") as miniatura:
+            ingesta._precargar("img")
+            ingesta._precargar("doc")
+        miniatura.assert_called_once_with("img")
+
+
+class OutboxTests(TestCase):
+    def encolado(self, tel, **kwargs):
+        return MensajeWhatsApp.objects.create(telefono=tel, direction="out", body="hola", status=outbox.PENDIENTE, **kwargs)
+
+    def test_un_envio_por_telefono_en_orden(self):
+        a1 = self.encolado("525500000001")
+        self.encolado("525500000001")
+        b1 = self.encolado("525500000002")
+
+        self.assertEqual([m.pk for m in outbox.reclamar()], [a1.pk, b1.pk])
+        # con a1 en curso, el segundo de ese teléfono espera
+        self.assertEqual(outbox.reclamar(), [])
+
+    def test_reintento_programado_bloquea_a_los_siguientes(self):
+        self.encolado("525500000001", siguiente_intento_at=timezone.now() + timedelta(minutes=1))
+        self.encolado("525500000001")
+        self.assertEqual(outbox.reclamar(), [])
+
+    def test_cola_larga_en_backoff_no_esconde_a_otros_telefonos(self):
+        self.encolado("525500000001", siguiente_intento_at=timezone.now() + timedelta(minutes=1))
+        for _ in range(30):
+            self.encolado("525500000001")
+        otro = self.encolado("525500000002")
+
+        self.assertEqual([m.pk for m in outbox.reclamar(limite=2)], [otro.pk])
+
+    def test_lease_cubre_los_reintentos_de_graph(self):
+        self.assertGreater(outbox.HUERFANO_SEGUNDOS, GRAPH_PRESUPUESTO)
+
+    def test_sending_vencido_no_bloquea_y_se_recupera(self):
+        viejo = timezone.now() - timedelta(seconds=outbox.HUERFANO_SEGUNDOS + 5)
+        huerfano = self.encolado("525500000001")
+        MensajeWhatsApp.objects.filter(pk=huerfano.pk).update(status=outbox.ENVIANDO, reclamado_at=viejo)
+        siguiente = self.encolado("525500000001")
+
+        self.assertEqual([m.pk for m in outbox.reclamar()], [siguiente.pk])
+
+        self.assertEqual(outbox.recuperar_huerfanos(), 1)
+        huerfano.refresh_from_db()
+        self.assertEqual(huerfano.status, "failed")
+        self.assertTrue(huerfano.error_title.startswith("interrumpido"))
+
+    def test_recuperar_no_toca_envios_en_curso(self):
+        msg = self.encolado("525500000001")
+        outbox.reclamar()
+        self.assertEqual(outbox.recuperar_huerfanos(), 0)
+        msg.refresh_from_db()
+        self.assertEqual(msg.status, outbox.ENVIANDO)
+
+    def test_drenar_envia_y_reprograma_errores_reintentables(self):
+        ok = self.encolado("525500000001")
+        caido = self.encolado("525500000002")
+
+        def enviar(to, text):
+            if to == caido.telefono:
+                raise ErrorMeta("Meta send error 503", 503)
+            return {"messages": [{"id": "wamid.ok"}]}
+
+        with mock.patch.object(outbox, "enviar_texto_whatsapp", side_effect=enviar):
+            self.assertEqual(outbox.drenar(), 2)
+
+        ok.refresh_from_db()
+        caido.refresh_from_db()
+        self.assertEqual((ok.status, ok.wa_message_id), ("accepted", "wamid.ok"))
+        self.assertEqual((caido.status, caido.intentos), (outbox.PENDIENTE, 1))
+        self.assertGreater(caido.siguiente_intento_at, timezone.now())
+
+    def test_polling_ve_el_envio_fallido(self):
+        msg = self.encolado("525500000001")
+        # el cliente ya tiene el mensaje encolado; falla después en el worker
+        after = msg.created_at.isoformat()
+        with mock.patch.object(outbox, "enviar_texto_whatsapp", side_effect=ErrorMeta("Meta send error 400", 400)):
+            outbox.drenar()
+
+        res = self.client.get("/digitales/contacto/updates/", {"tel": msg.telefono, "after": after})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()["mensajes"], [])
+        self.assertEqual([(s["id"], s["status"]) for s in res.json()["status"]], [(msg.pk, "failed")])
+
+
+class ImportacionTests(TestCase):
+    def importar_csv(self, texto, **kwargs):
+        return importar(leer_filas(io.BytesIO(texto.encode("utf-8")), "csv"), **kwargs)
+
+    def test_errores_por_fila_no_detienen_la_carga(self):
+        reporte = self.importar_csv(
+            "telefono,nombre,correo,facturado\n"
+            "5512345678,Ana,ana@example.com,si\n"
+            ",Sin teléfono,,\n"
+            "123,Corto,,\n"
+            "5587654321,Beto,no-es-correo,\n"
+            "5511112222,Caro,,tal vez\n"
+            "5533334444,Dani,,no\n"
+        )
+        self.assertEqual(reporte["total"], 6)
+        self.assertEqual(reporte["creados"], 2)
+        self.assertEqual(reporte["errores_total"], 4)
+        self.assertEqual(
+            [(e["fila"], e["error"]) for e in reporte["errores"]],
+            [
+                (3, "El teléfono es obligatorio"),
+                (4, "Teléfono inválido"),
+                (5, "correo inválido"),
+                (6, "facturado: se esperaba sí/no"),
+            ],
+        )
+        ana = ClientesDigitales.objects.get(telefono="525512345678")
+        self.assertEqual((ana.nombre, ana.facturado), ("Ana", True))
+
+    def test_actualiza_solo_campos_con_valor(self):
+        ClientesDigitales.objects.create(telefono="525512345678", nombre="Ana", agencia="Norte")
+        reporte = self.importar_csv("telefono;nombre;agencia\n55 1234 5678;;Sur\n")
+
+        self.assertEqual((reporte["creados"], reporte["actualizados"]), (0, 1))
+        ana = ClientesDigitales.objects.get(telefono="525512345678")
+        self.assertEqual((ana.nombre, ana.agencia), ("Ana", "Sur"))
+
+    def test_no_actualizar_omite_existentes(self):
+        ClientesDigitales.objects.create(telefono="525512345678", nombre="Ana")
+        reporte = self.importar_csv("telefono,nombre\n5512345678,Otra\n", actualizar=False)
+
+        self.assertEqual(reporte["omitidos"], 1)
+        self.assertEqual(ClientesDigitales.objects.get(telefono="525512345678").nombre, "Ana")
+
+    def test_max_length(self):
+        reporte = self.importar_csv(f"telefono,nombre\n5512345678,{'x' * 300}\n")
+        self.assertEqual(reporte["errores"], [{"fila": 2, "error": "nombre: máximo 200 caracteres"}])
+
+    def test_jsonl_numera_por_linea_con_lineas_vacias(self):
+        texto = '{"telefono": "5512345678"}\n\n\n{"telefono": "12"}\nno es json\n'
+        reporte = importar(leer_filas(io.BytesIO(texto.encode("utf-8")), "jsonl"))
+        self.assertEqual(
+            [(e["fila"], e["error"]) for e in reporte["errores"]],
+            [(4, "Teléfono inválido"), (5, "JSON inválido")],
+        )
+
+    def test_alta_concurrente_del_mismo_telefono(self):
+        # otro proceso lo crea después de que el lote consultó los existentes
+        ClientesDigitales.objects.create(telefono="525512345678", nombre="Ana", agencia="Norte")
+        with mock.patch.object(importacion, "_existentes", return_value={}):
+            reporte = self.importar_csv("telefono,agencia\n5512345678,Sur\n5587654321,Centro\n")
+
+        self.assertEqual((reporte["creados"], reporte["actualizados"], reporte["errores_total"]), (1, 1, 0))
+        self.assertEqual(ClientesDigitales.objects.get(telefono="525512345678").agencia, "Sur")
+        self.assertTrue(ClientesDigitales.objects.filter(telefono="525587654321").exists())
+
+
+class ProspectosListadoTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        contactos = [now, now, now - timedelta(hours=1), None, None, None, now - timedelta(days=2)]
+        for i, cuando in enumerate(contactos):
+            ClientesDigitales.objects.create(telefono=f"52551000000{i}", nombre=f"P{i}", ultimo_contacto_at=cuando)
+
+    def recorrer(self, url, limit):
+        vistos, cursor, paginas = [], "", 0
+        while True:
+            r = self.client.get(url, {"limit": limit, "cursor": cursor})
+            self.assertEqual(r.status_code, 200)
+            vistos += [p["id"] for p in r.json()]
+            cursor = r["X-Next-Cursor"]
+            paginas += 1
+            if not cursor:
+                return vistos, paginas
+
+    def test_recorre_todo_con_nulls_y_empates(self):
+        esperado = list(
+            ClientesDigitales.objects.order_by("-ultimo_contacto_at", "-id").values_list("id", flat=True)
+        )
+        for limit in (1, 2, 3, 50):
+            vistos, paginas = self.recorrer("/digitales/api/prospectos/", limit)
+            self.assertEqual(vistos, esperado, f"limit={limit}")
+            self.assertEqual(paginas, max(1, -(-len(esperado) // limit)))
+
+    def test_nulls_van_al_final(self):
+        vistos, _ = self.recorrer("/digitales/api/prospectos/", 2)
+        nulos = set(ClientesDigitales.objects.filter(ultimo_contacto_at__isnull=True).values_list("id", flat=True))
+        self.assertEqual(set(vistos[-len(nulos):]), nulos)
+
+    def test_cursor_invalido_es_400(self):
+        for cursor in ("%%%", codificar_cursor({"v": "no-es-fecha", "id": 1}), codificar_cursor({"v": None})):
+            r = self.client.get("/digitales/api/prospectos/", {"cursor": cursor})
+            self.assertEqual(r.status_code, 400, cursor)
+
+    def test_fields_recorta_columnas_y_respuesta(self):
+        with CaptureQueriesContext(connection) as q:
+            r = self.client.get("/digitales/api/prospectos/", {"fields": "id,nombre,no_existe", "limit": 3})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual([set(p) for p in r.json()], [{"id", "nombre"}] * 3)
+        # una sola consulta: ningún campo diferido se carga después fila por fila
+        self.assertEqual(len(q), 1)
+        self.assertNotIn("correo", q[0]["sql"])
+
+        # el cursor sigue funcionando aunque no se pidió ultimo_contacto_at
+        r = self.client.get("/digitales/api/prospectos/", {"fields": "nombre", "limit": 3, "cursor": r["X-Next-Cursor"]})
+        self.assertEqual([set(p) for p in r.json()], [{"nombre"}] * 3)
+
+
+PUBLICAR_EN_OTRO_PROCESO = """
+import sys
+from pathlib import Path
+
+import django
+django.setup()
+
+from Digitales import eventos
+eventos.RUTA = Path(sys.argv[1])
+eventos.publicar_eventos([(sys.argv[2], tipo, int(pk)) for tipo, pk in zip(sys.argv[3::2], sys.argv[4::2])])
+"""
+
+
+class StreamEventosTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.ruta = Path(tmp.name) / "eventos.sqlite3"
+        parche = mock.patch.object(eventos, "RUTA", self.ruta)
+        parche.start()
+        self.addCleanup(parche.stop)
+
+    async def abrir_stream(self, tel):
+        resp = await contacto_stream(AsyncRequestFactory().get("/digitales/contacto/stream/", {"tel": tel}))
+        chunks = aiter(resp.streaming_content)
+        self.assertIn(b"retry:", await anext(chunks))
+        return chunks
+
+    async def siguiente_evento(self, chunks):
+        while True:
+            chunk = await asyncio.wait_for(anext(chunks), 10)
+            if chunk.strip():
+                return chunk.decode()
+
+    def publicar_en_otro_proceso(self, tel, *eventos_):
+        args = [str(x) for par in eventos_ for x in par]
+        subprocess.run(
+            [sys.executable, "-c", PUBLICAR_EN_OTRO_PROCESO, str(self.ruta), tel, *args],
+            check=True, cwd=settings.BASE_DIR, env=os.environ.copy(),
+        )
+
+    async def test_eventos_de_otro_proceso_llegan_al_stream(self):
+        tel = "525512345678"
+        enviado = await MensajeWhatsApp.objects.acreate(
+            telefono=tel, direction="out", body="hola", wa_message_id="wamid.out", status="accepted",
+        )
+        chunks = await self.abrir_stream(tel)
+        try:
+            entrante = await MensajeWhatsApp.objects.acreate(telefono=tel, direction="in", body="qué tal", status="received")
+            await MensajeWhatsApp.objects.filter(pk=enviado.pk).aupdate(status="read")
+            await asyncio.to_thread(self.publicar_en_otro_proceso, tel, ("mensaje", entrante.pk), ("status", enviado.pk))
+
+            mensaje = await self.siguiente_evento(chunks)
+            self.assertIn("event: mensaje", mensaje)
+            self.assertIn("qué tal", mensaje)
+            estado = await self.siguiente_evento(chunks)
+            self.assertIn("event: status", estado)
+            self.assertIn('"status": "read"', estado)
+        finally:
+            await chunks.aclose()
+
+    async def test_otro_telefono_no_llega(self):
+        tel = "525512345678"
+        chunks = await self.abrir_stream(tel)
+        try:
+            otro = await MensajeWhatsApp.objects.acreate(telefono="525500000000", direction="in", body="x", status="received")
+            propio = await MensajeWhatsApp.objects.acreate(telefono=tel, direction="in", body="mío", status="received")
+
+            await asyncio.to_thread(eventos.publicar_mensajes, [otro, propio])
+            evento = await self.siguiente_evento(chunks)
+            self.assertIn("mío", evento)
+            self.assertNotIn('"body": "x"', evento)
+        finally:
+            await chunks.aclose()
+
+
+class BusquedaTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        parche = mock.patch.object(busqueda, "RUTA", Path(tmp.name) / "busqueda.sqlite3")
+        parche.start()
+        self.addCleanup(parche.stop)
+
+        self.garcia = ClientesDigitales.objects.create(telefono="525511112222", nombre="José García López")
+        self.ana = ClientesDigitales.objects.create(telefono="525533334444", nombre="Ana Núñez")
+        for cliente in (self.garcia, self.ana):
+            MensajeWhatsApp.objects.create(
+                telefono=cliente.telefono, cliente=cliente, direction="in", body="¿Cuál es el precio del automóvil?",
+            )
+        busqueda.sincronizar()
+
+    def buscar(self, **params):
+        r = self.client.get("/digitales/buscar/", params)
+        self.assertEqual(r.status_code, 200)
+        return r.json()
+
+    def test_sin_acentos_ni_mayusculas(self):
+        self.assertEqual(busqueda.buscar_clientes("jose garcia"), [self.garcia.pk])
+        self.assertEqual(busqueda.buscar_clientes("NUÑEZ"), [self.ana.pk])
+        self.assertEqual(len(busqueda.buscar_mensajes("cual precio automovil")), 2)
+
+    def test_fragmento_de_telefono(self):
+        self.assertEqual(busqueda.buscar_clientes("1111 2222"), [self.garcia.pk])
+
+    def test_mensajes_de_un_solo_chat(self):
+        res = self.buscar(q="precio", tipo="mensajes", telefono="5533334444")
+        self.assertEqual([m["telefono"] for m in res["mensajes"]], [self.ana.telefono])
+        # un teléfono sin chat no regresa mensajes de otros
+        self.assertEqual(self.buscar(q="precio", tipo="mensajes", telefono="5599999999")["mensajes"], [])
+
+    def test_purga_quita_lo_borrado(self):
+        MensajeWhatsApp.objects.filter(cliente=self.ana).delete()
+        self.ana.delete()
+        self.assertEqual(busqueda.purgar(), {"clientes": 1, "mensajes": 1})
+        self.assertEqual(busqueda.buscar_clientes("ana"), [])
+        self.assertEqual(len(busqueda.buscar_mensajes("precio")), 1)
@@ -6,7 +6,9 @@ from .views import (
     bienvenido,
     webhook,
     chats_list,
+    buscar_view,
     contacto_por_telefono,
+    cliente_360_view,
     enviar_mensaje_view,
     enviar_plantilla_view,
     enviar_media_view,
@@ -14,8 +16,13 @@ from .views import (
     ProspectosViewSet,
     campanas_meta_recientes,
     contacto_updates,
+    contacto_stream,
     editar_mensaje_view,
     media_proxy_view,
+    media_thumb_view,
+    campana_enviar_view,
+    campana_detalle_view,
+    campana_cancelar_view,
 )
 
 router = DefaultRouter()
@@ -28,7 +35,9 @@ urlpatterns = [
     # chat
     path("chats/", chats_list),
     path("chats/mark-read/", mark_read_view),
+    path("buscar/", buscar_view),
     path("contacto/", contacto_por_telefono),
+    path("cliente-360/", cliente_360_view),
 
     # mensajes
     path("mensajes/enviar/", enviar_mensaje_view),
@@ -39,6 +48,11 @@ urlpatterns = [
     # api
     path("api/", include(router.urls)),
     path("api/campanas-meta/", campanas_meta_recientes),
+    path("campanas/enviar/", campana_enviar_view),
+    path("campanas/<int:pk>/", campana_detalle_view),
+    path("campanas/<int:pk>/cancelar/", campana_cancelar_view),
     path("contacto/updates/", contacto_updates),
+    path("contacto/stream/", contacto_stream),
     path("media/<str:media_id>/", media_proxy_view, name="digitales-media-proxy"),
+    path("media/<str:media_id>/thumb/", media_thumb_view, name="digitales-media-thumb"),
 ]
@@ -1,33 +1,160 @@
 # digitales/views.py
 import json
 import mimetypes
-from datetime import timedelta
-from django.http import HttpResponse
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone as dt_timezone
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.dateparse import parse_date, parse_datetime
 from django.views.decorators.csrf import csrf_exempt
 from django.utils import timezone
-from django.db.models import Q, OuterRef, Subquery
+from django.db.models import Count, Max, Q
 from rest_framework.decorators import api_view, permission_classes, parser_classes
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
+from rest_framework.exceptions import ValidationError
 from rest_framework import status, viewsets
-from rest_framework.parsers import MultiPartParser, FormParser
-
-from .models import ClientesDigitales, MensajeWhatsApp, normaliza_tel_mx, CampanaMeta
-from .serializers import ClientesDigitalesSerializer, WhatsAppMessageSerializer
+from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
+from rest_framework.decorators import action
+
+from citas.models import Citas, CitasPiso, PruebasManejo
+from citas.serializers import CitasSerializer, CitasPisoSerializer, PruebasManejoSerializer
+from CrmConformidad.models import ExpedienteConformidad
+from CrmConformidad.serializers import CasoSerializer
+from .models import ClientesDigitales, MensajeWhatsApp, normaliza_tel_mx, variantes_tel_mx, CampanaMeta, CampanaEnvio
+from .serializers import (
+    ClientesDigitalesSerializer,
+    WhatsAppMessageListSerializer,
+    CampanaEnvioSerializer,
+    CampanaEnvioDestinatarioSerializer,
+)
+from .campanas import crear_campana, lanzar_campana
+from .inbox import encolar
+from .outbox import encolar_texto
+from . import busqueda
+from .eventos import bus, datos_status, publicar_mensajes
+from .paginacion import KeysetPagination, codificar_cursor, decodificar_cursor
+from .workers import en_segundo_plano
+from .subidas import MB, usar_subida_en_disco, tipo_por_mime
+from .importacion import ErrorImportacion, formato_por_nombre, importar, leer_filas
 from .contacto import (
-    obtener_mensaje_whatsapp,
-    replace_start,
-    enviar_texto_whatsapp,
     enviar_template_whatsapp,
     subir_media_whatsapp,
     enviar_media_whatsapp,
     editar_texto_whatsapp,
+    plazo_interactivo,
 )
 
+# tope del archivo de importación de prospectos (MB)
+IMPORT_MAX_MB = int(getattr(settings, "PROSPECTOS_IMPORT_MAX_MB", 50))
+
+
+class ProspectosPagination(KeysetPagination):
+    campo = "ultimo_contacto_at"
+    page_size = 100
+
+
+PROSPECTOS_FILTROS = ("agencia", "estado", "business", "canal_contacto", "asesor_digital", "asesor_ventas")
+PROSPECTOS_BOOLEANOS = ("facturado", "cita_efectiva", "cita_virtual", "solicitud_credito")
+# ?<prefijo>_desde=&<prefijo>_hasta= (fecha o fecha-hora ISO; `hasta` con solo fecha incluye el día)
+PROSPECTOS_RANGOS = {"creado": "creado", "contacto": "ultimo_contacto_at", "primer_contacto": "primer_contacto_at"}
+
+
+def _rango_fecha(campo: str, valor: str, fin: bool) -> Q:
+    try:
+        dt = parse_datetime(valor)
+        d = parse_date(valor) if dt is None else None
+    except ValueError:
+        dt = d = None
+    if dt is None and d is None:
+        raise ValidationError({"detail": f"Fecha inválida: {valor}"})
+
+    if d is not None:
+        dt = datetime.combine(d + timedelta(days=1) if fin else d, datetime.min.time())
+    if settings.USE_TZ and timezone.is_naive(dt):
+        dt = timezone.make_aware(dt)
+    if not fin:
+        return Q(**{f"{campo}__gte": dt})
+    return Q(**{f"{campo}__lt" if d is not None else f"{campo}__lte": dt})
+
+
+# el upsert de create no los toca: los mantienen la ingesta y los chats
+# (contadores y último mensaje) o el propio modelo
+PROSPECTO_NO_EDITABLES = {
+    "id", "telefono", "creado", "actualizado", "primer_contacto_at", "ultimo_contacto_at",
+    "last_read_at", "unread_count",
+    "ultimo_msg_id", "ultimo_msg_preview", "ultimo_msg_direction", "ultimo_msg_at",
+}
+
+
 class ProspectosViewSet(viewsets.ModelViewSet):
+    """
+    Listado paginado por cursor (ver KeysetPagination): ?limit=&cursor=
+    Filtros: agencia, estado, business, canal_contacto, asesor_digital,
+    asesor_ventas, asesor (cualquiera de los dos), facturado / cita_efectiva /
+    cita_virtual / solicitud_credito (1/0) y rangos creado_*, contacto_*,
+    primer_contacto_* (_desde / _hasta).
+    ?fields=id,nombre,telefono regresa solo esas columnas.
+    """
     permission_classes = [AllowAny]
     queryset = ClientesDigitales.objects.all().order_by("-ultimo_contacto_at", "-actualizado", "-creado")
     serializer_class = ClientesDigitalesSerializer
+    pagination_class = ProspectosPagination
+
+    def initial(self, request, *args, **kwargs):
+        # antes de autenticar: el check de CSRF podría parsear el body
+        if self.action == "importar":
+            self.limite = usar_subida_en_disco(request, limites={}, defecto=IMPORT_MAX_MB * MB)
+        super().initial(request, *args, **kwargs)
+
+    def campos(self) -> list[str] | None:
+        raw = self.request.query_params.get("fields") if self.action == "list" else None
+        if not raw:
+            return None
+        disponibles = ClientesDigitalesSerializer.Meta.fields
+        campos = [c for c in (x.strip() for x in raw.split(",")) if c in disponibles]
+        return campos or None
+
+    def get_serializer(self, *args, **kwargs):
+        if "campos" not in kwargs:
+            kwargs["campos"] = self.campos()
+        return super().get_serializer(*args, **kwargs)
+
+    def get_queryset(self):
+        qs = super().get_queryset()
+        if self.action != "list":
+            return qs
+
+        params = self.request.query_params
+        for campo in PROSPECTOS_FILTROS:
+            valor = (params.get(campo) or "").strip()
+            if valor:
+                qs = qs.filter(**{campo: valor})
+        asesor = (params.get("asesor") or "").strip()
+        if asesor:
+            qs = qs.filter(Q(asesor_digital=asesor) | Q(asesor_ventas=asesor))
+
+        for campo in PROSPECTOS_BOOLEANOS:
+            valor = (params.get(campo) or "").lower()
+            if valor in ("1", "true", "0", "false"):
+                qs = qs.filter(**{campo: valor in ("1", "true")})
+
+        for prefijo, campo in PROSPECTOS_RANGOS.items():
+            desde = params.get(f"{prefijo}_desde")
+            hasta = params.get(f"{prefijo}_hasta")
+            if desde:
+                qs = qs.filter(_rango_fecha(campo, desde, fin=False))
+            if hasta:
+                qs = qs.filter(_rango_fecha(campo, hasta, fin=True))
+
+        campos = self.campos()
+        if campos:
+            # el cursor necesita id y ultimo_contacto_at aunque no se pidan
+            qs = qs.only(*{*campos, "id", "ultimo_contacto_at"})
+        return qs
 
     def create(self, request, *args, **kwargs):
         data = request.data.copy()
@@ -40,18 +167,18 @@ class ProspectosViewSet(viewsets.ModelViewSet):
 
         obj = ClientesDigitales.objects.filter(telefono=tel).first()
         if obj:
+            cambios = {"responsable", "actualizado"}
             for k, v in data.items():
-                if k == "telefono":
+                if k not in ClientesDigitalesSerializer.Meta.fields or k in PROSPECTO_NO_EDITABLES:
                     continue
                 if v is not None and str(v).strip() != "":
                     setattr(obj, k, v)
-
-            obj.telefono = tel
+                    cambios.add(k)
 
             if getattr(obj, "asesor_digital", "") or getattr(obj, "asesor_ventas", ""):
                 obj.responsable = " / ".join([x for x in [obj.asesor_digital, obj.asesor_ventas] if x])
 
-            obj.save()
+            obj.save(update_fields=cambios)
             return Response(self.get_serializer(obj).data, status=status.HTTP_200_OK)
 
         data["telefono"] = tel
@@ -108,6 +235,42 @@ class ProspectosViewSet(viewsets.ModelViewSet):
 
         return Response(self.get_serializer(obj).data, status=status.HTTP_200_OK)
 
+    @action(detail=False, methods=["post"], parser_classes=[MultiPartParser, FormParser, JSONParser])
+    def importar(self, request):
+        """
+        Carga masiva: `archivo` (CSV, XLSX o JSONL; `formato` opcional si la
+        extensión no lo dice) o un JSON con la lista de prospectos.
+        `actualizar=0` deja intactos los teléfonos que ya existen.
+        """
+        limite = self.limite
+        form = request.data if not isinstance(request.data, list) else request.query_params
+        actualizar = str(form.get("actualizar", "1")).lower() not in ("0", "false", "no")
+        archivo = request.FILES.get("archivo")
+
+        try:
+            if archivo is not None:
+                formato = (request.data.get("formato") or formato_por_nombre(archivo.name)).lower()
+                reporte = importar(leer_filas(archivo, formato), actualizar=actualizar)
+            elif isinstance(request.data, list):
+                reporte = importar(enumerate(request.data, start=1), actualizar=actualizar)
+            elif limite.rechazados:
+                return Response({"ok": False, "error": limite.rechazados[0]["error"]}, status=status.HTTP_400_BAD_REQUEST)
+            else:
+                return Response({"ok": False, "error": "Falta archivo"}, status=status.HTTP_400_BAD_REQUEST)
+        except (ErrorImportacion, UnicodeDecodeError) as e:
+            return Response({"ok": False, "error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({"ok": True, **reporte}, status=status.HTTP_200_OK)
+
+
+MENSAJES_POR_PAGINA = 50
+MENSAJES_POR_PAGINA_MAX = 200
+
+
+class ChatsPagination(KeysetPagination):
+    campo = "ultimo_contacto_at"
+    page_size = 200
+
 
 def bienvenido(request):
     return HttpResponse("Funcionando Digitales WhatsApp R&R, desde Django")
@@ -128,171 +291,311 @@ def webhook(request):
     if request.method != "POST":
         return HttpResponse("method not allowed", status=405)
 
+    # Solo persistimos el payload crudo en el inbox local; los workers de
+    # .inbox lo aplican a BD fuera del request para que Meta reciba el 200 de inmediato.
     try:
-        body = json.loads(request.body.decode("utf-8"))
+        encolar(request.body)
     except Exception:
-        return HttpResponse("ok")
+        # sin spool no hay dónde guardarlo: que Meta lo reintente
+        return HttpResponse("error", status=500)
 
-    try:
-        entries = body.get("entry") or []
-        for entry in entries:
-            changes = entry.get("changes") or []
-            for ch in changes:
-                value = ch.get("value") or {}
-
-                contacts = value.get("contacts") or []
-                profile_name = ""
-                if contacts:
-                    profile_name = (contacts[0].get("profile") or {}).get("name", "") or ""
-
-                # ✅ 1) Mensajes
-                messages = value.get("messages") or []
-                for msg in messages:
-                    wa_from = msg.get("from", "")
-                    tel = normaliza_tel_mx(replace_start(wa_from))
-                    wa_id = msg.get("id", "") or ""
-                    text = obtener_mensaje_whatsapp(msg)
-
-                    if not tel or not wa_id:
-                        continue
-
-                    if MensajeWhatsApp.objects.filter(wa_message_id=wa_id).exists():
-                        continue
-
-                    cliente, _ = ClientesDigitales.objects.get_or_create(
-                        telefono=tel,
-                        defaults={"nombre": profile_name or ""},
-                    )
-
-                    if profile_name and not cliente.nombre:
-                        cliente.nombre = profile_name
-                        cliente.save(update_fields=["nombre", "actualizado"])
-
-                    cliente.touch_ultimo_contacto(save_now=True)
-
-                    MensajeWhatsApp.objects.create(
-                        telefono=tel,
-                        cliente=cliente,
-                        direction="in",
-                        body=text,
-                        wa_message_id=wa_id,
-                        status="received",
-                        raw=msg,  # ✅ mejor guardar el mensaje, no todo el webhook
-                    )
-
-                # ✅ 2) Statuses
-                statuses = value.get("statuses") or []
-                for s in statuses:
-                    wa_id = s.get("id")
-                    st = s.get("status")
-                    errors = s.get("errors") or []
-                    ts = s.get("timestamp")
-                    if not (wa_id and st):
-                        continue
-
-                    msg = MensajeWhatsApp.objects.filter(wa_message_id=wa_id).first()
-                    if not msg:
-                        continue
-
-                    new_raw = dict(msg.raw or {})
-                    new_raw["status_payload"] = s
-                    if errors:
-                        new_raw["errors"] = errors
-                    if ts:
-                        new_raw["status_timestamp"] = ts
-
-                    msg.status = st
-                    msg.raw = new_raw
-                    msg.save(update_fields=["status", "raw"])
-
-        return HttpResponse("ok")
+    return HttpResponse("ok")
 
-    except Exception:
-        return HttpResponse("ok")
-
-
-def _unread_count(cliente: ClientesDigitales) -> int:
-    qs = MensajeWhatsApp.objects.filter(telefono=cliente.telefono, direction="in")
-    if cliente.last_read_at:
-        qs = qs.filter(created_at__gt=cliente.last_read_at)
-    return qs.count()
 
 # digitales/views.py
-from django.http import HttpResponse
+import re
+from django.http import FileResponse, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
-from .contacto import download_media_whatsapp
+from . import media_cache, miniaturas
+
+_RANGO = re.compile(r"bytes=(\d*)-(\d*)")
+
+
+def _rango(request, size: int, etag: str, last_modified: int):
+    """
+    (inicio, fin) del header Range, None si hay que mandar todo, o "416".
+    Solo un rango; varios rangos o un If-Range que no coincide = archivo completo.
+    """
+    header = request.META.get("HTTP_RANGE", "").strip()
+    if not header:
+        return None
+    if_range = request.META.get("HTTP_IF_RANGE", "").strip()
+    if if_range and if_range not in (etag, http_date(last_modified)):
+        return None
+
+    m = _RANGO.fullmatch(header)
+    if not m or m.group(1) == m.group(2) == "":
+        return None
+    if m.group(1) == "":
+        # sufijo: los últimos N bytes
+        n = int(m.group(2))
+        if not n:
+            return "416"
+        return max(0, size - n), size - 1
+    inicio = int(m.group(1))
+    fin = min(int(m.group(2)), size - 1) if m.group(2) else size - 1
+    if inicio >= size or fin < inicio:
+        return "416"
+    return inicio, fin
+
+
+def _leer_rango(f, inicio: int, largo: int):
+    with f:
+        f.seek(inicio)
+        while largo > 0:
+            chunk = f.read(min(media_cache.CHUNK, largo))
+            if not chunk:
+                break
+            largo -= len(chunk)
+            yield chunk
+
 
 @api_view(["GET"])
 @permission_classes([AllowAny])
 def media_proxy_view(request, media_id: str):
     try:
-        blob, content_type = download_media_whatsapp(media_id)
-        resp = HttpResponse(blob, content_type=content_type)
+        # con Range necesitamos el archivo completo en disco para saltar al byte pedido
+        if request.META.get("HTTP_RANGE"):
+            meta = media_cache.obtener(media_id)
+        else:
+            meta = media_cache.transmitir(media_id)
+    except Exception as e:
+        return HttpResponse(f"error: {str(e)}", status=400, content_type="text/plain")
 
-        # Para documentos: si quieres forzar descarga, puedes setear Content-Disposition.
-        # Aquí lo dejamos inline para imágenes/video/audio.
-        resp["Cache-Control"] = "private, max-age=300"
+    if "stream" in meta:
+        # miss: se le manda al cliente conforme llega de Meta (y se guarda en caché)
+        resp = StreamingHttpResponse(meta["stream"], content_type=meta["content_type"])
+        if meta["size"]:
+            resp["Content-Length"] = meta["size"]
+        resp["Cache-Control"] = "private, max-age=86400"
         return resp
+
+    # el contenido de un media_id no cambia: ETag fuerte = sha256 del binario
+    etag = quote_etag(meta["sha256"])
+    last_modified = int(meta["guardado"])
+    size = meta["size"]
+    resp = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if resp is None:
+        rango = _rango(request, size, etag, last_modified)
+        if rango == "416":
+            resp = HttpResponse(status=416)
+            resp["Content-Range"] = f"bytes */{size}"
+        elif rango:
+            inicio, fin = rango
+            resp = StreamingHttpResponse(
+                _leer_rango(open(meta["ruta"], "rb"), inicio, fin - inicio + 1),
+                status=206,
+                content_type=meta["content_type"],
+            )
+            resp["Content-Range"] = f"bytes {inicio}-{fin}/{size}"
+            resp["Content-Length"] = fin - inicio + 1
+        else:
+            # FileResponse usa wsgi.file_wrapper (sendfile) cuando el servidor lo tiene
+            resp = FileResponse(open(meta["ruta"], "rb"), content_type=meta["content_type"])
+
+    # Para documentos: si quieres forzar descarga, puedes setear Content-Disposition.
+    # Aquí lo dejamos inline para imágenes/video/audio.
+    resp["Accept-Ranges"] = "bytes"
+    resp["ETag"] = etag
+    resp["Last-Modified"] = http_date(last_modified)
+    resp["Cache-Control"] = "private, max-age=86400"
+    return resp
+
+@api_view(["GET"])
+@permission_classes([AllowAny])
+def media_thumb_view(request, media_id: str):
+    # el tipo guardado evita bajar un documento o audio completo solo para
+    # descubrir que no tiene miniatura
+    guardado = MensajeWhatsApp.objects.filter(media_id=media_id).values_list("media_mime", "media_tipo").first()
+    tipo = ""
+    if guardado:
+        mime, media_tipo = guardado
+        tipo = mime.split("/")[0] if mime else media_tipo
+    try:
+        ruta = miniaturas.obtener(media_id, tipo=tipo)
     except Exception as e:
         return HttpResponse(f"error: {str(e)}", status=400, content_type="text/plain")
-    
+    if ruta is None:
+        # sin miniatura posible (documento, audio, sin Pillow/ffmpeg): usar la URL completa
+        return HttpResponse(status=404)
+
+    st = ruta.stat()
+    etag = quote_etag(f"{media_id}-{int(st.st_mtime)}-{st.st_size}")
+    last_modified = int(st.st_mtime)
+    resp = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if resp is None:
+        resp = FileResponse(open(ruta, "rb"), content_type=miniaturas.CONTENT_TYPE)
+    resp["ETag"] = etag
+    resp["Last-Modified"] = http_date(last_modified)
+    resp["Cache-Control"] = "private, max-age=86400"
+    return resp
+
+
+def _parse_after(after: str):
+    if not after:
+        return None
+    try:
+        after_dt = timezone.datetime.fromisoformat(after.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if timezone.is_naive(after_dt):
+        after_dt = timezone.make_aware(after_dt, timezone=dt_timezone.utc)
+    return after_dt
+
+
 @api_view(["GET"])
 @permission_classes([AllowAny])
 def contacto_updates(request):
     tel = normaliza_tel_mx(request.query_params.get("tel", ""))
-    after = request.query_params.get("after", "")
+    after_dt = _parse_after(request.query_params.get("after", ""))
 
     if not tel:
         return Response({"ok": False, "error": "Falta tel"}, status=400)
 
-    qs = MensajeWhatsApp.objects.filter(telefono=tel).order_by("created_at")
+    qs = MensajeWhatsApp.objects.defer("raw").filter(telefono=tel).order_by("created_at")
+    # envíos que fallaron después de encolarse (outbox en otro proceso): sin
+    # esto quien consulta por polling no se entera hasta recargar el chat
+    fallidos = MensajeWhatsApp.objects.none()
 
-    if after:
-        try:
-            after_dt = timezone.datetime.fromisoformat(after.replace("Z", "+00:00"))
-            if timezone.is_naive(after_dt):
-                after_dt = timezone.make_aware(after_dt, timezone=timezone.utc)
-            qs = qs.filter(created_at__gt=after_dt)
-        except Exception:
-            pass
+    if after_dt:
+        qs = qs.filter(created_at__gt=after_dt)
+        fallidos = MensajeWhatsApp.objects.filter(
+            telefono=tel, direction="out", failed_at__gt=after_dt, created_at__lte=after_dt,
+        ).order_by("failed_at")
 
     return Response(
         {
             "ok": True,
-            "mensajes": WhatsAppMessageSerializer(qs, many=True, context={"request": request}).data,
+            "mensajes": WhatsAppMessageListSerializer(qs, many=True, context={"request": request}).data,
+            "status": [datos_status(m) for m in fallidos],
             "server_now": timezone.now().isoformat(),
         },
         status=status.HTTP_200_OK,
     )
 
 
+SSE_KEEPALIVE = 20
+SSE_RESYNC = getattr(settings, "WHATSAPP_SSE_RESYNC", 60)
+
+
+def _mensajes_despues(tel: str, after_dt) -> list[dict]:
+    qs = MensajeWhatsApp.objects.defer("raw").filter(telefono=tel, created_at__gt=after_dt).order_by("created_at")
+    return list(WhatsAppMessageListSerializer(qs, many=True).data)
+
+
+def _cargar_eventos(tel: str, eventos: list[tuple[str, int]]) -> list[tuple[str, dict]]:
+    """(tipo, msg_id) del log de eventos -> (tipo, data) con el estado actual en BD."""
+    msgs = {m.pk: m for m in MensajeWhatsApp.objects.defer("raw").filter(telefono=tel, pk__in={i for _, i in eventos})}
+    out = []
+    for tipo, msg_id in eventos:
+        msg = msgs.get(msg_id)
+        if msg is None:
+            continue
+        if tipo == "mensaje":
+            out.append((tipo, WhatsAppMessageListSerializer(msg).data))
+        else:
+            out.append((tipo, datos_status(msg)))
+    return out
+
+
+def _sse(evento: dict, event_id: str = "") -> str:
+    data = json.dumps(evento["data"], cls=DjangoJSONEncoder, ensure_ascii=False)
+    linea_id = f"id: {event_id}\n" if event_id else ""
+    return f"{linea_id}event: {evento['tipo']}\ndata: {data}\n\n"
+
+
+async def contacto_stream(request):
+    """
+    Server-Sent Events de un chat: ?tel=&after=
+    Empuja `mensaje` y `status` en cuanto se publican, desde cualquier proceso
+    de la máquina (log de .eventos, con retraso de a lo más WHATSAPP_EVENTOS_POLL).
+    Cada SSE_RESYNC s (o si la cola se desborda) vuelve a consultar BD por si
+    se perdió algo. Requiere servir por ASGI (solo esta ruta, ver ryrback/asgi.py).
+    """
+    if request.method != "GET":
+        return HttpResponse("method not allowed", status=405)
+
+    tel = normaliza_tel_mx(request.GET.get("tel", ""))
+    if not tel:
+        return HttpResponse("Falta tel", status=400, content_type="text/plain")
+
+    # EventSource manda Last-Event-ID al reconectar (usamos created_at como id)
+    after_dt = _parse_after(request.GET.get("after", "") or request.headers.get("Last-Event-ID", ""))
+    sub = bus.suscribir(tel)
+
+    async def stream():
+        ultimo = after_dt or timezone.now()
+        ultimo_resync = time.monotonic()
+        enviados = deque(maxlen=500)
+
+        def emitir_mensaje(data):
+            nonlocal ultimo
+            if data["id"] in enviados:
+                return ""
+            enviados.append(data["id"])
+            creado = parse_datetime(data.get("created_at") or "")
+            if creado and creado > ultimo:
+                ultimo = creado
+            return _sse({"tipo": "mensaje", "data": data}, data.get("created_at") or "")
+
+        try:
+            yield "retry: 3000\n\n"
+            if after_dt:
+                for data in await sync_to_async(_mensajes_despues)(tel, ultimo):
+                    yield emitir_mensaje(data)
+
+            while True:
+                eventos = await sub.siguiente(SSE_KEEPALIVE)
+
+                if sub.desbordada or (SSE_RESYNC and time.monotonic() - ultimo_resync >= SSE_RESYNC):
+                    sub.desbordada = False
+                    ultimo_resync = time.monotonic()
+                    for data in await sync_to_async(_mensajes_despues)(tel, ultimo):
+                        yield emitir_mensaje(data)
+
+                if not eventos:
+                    yield ": ping\n\n"
+                    continue
+                for tipo, data in await sync_to_async(_cargar_eventos)(tel, eventos):
+                    yield emitir_mensaje(data) if tipo == "mensaje" else _sse({"tipo": tipo, "data": data})
+        finally:
+            bus.cancelar(sub)
+
+    resp = StreamingHttpResponse(stream(), content_type="text/event-stream")
+    resp["Cache-Control"] = "no-cache"
+    resp["X-Accel-Buffering"] = "no"
+    return resp
+
+
 @api_view(["GET"])
 @permission_classes([AllowAny])
 def chats_list(request):
-    limit = 200
-
-    last_msg_qs = (
-        MensajeWhatsApp.objects
-        .filter(telefono=OuterRef("telefono"))
-        .order_by("-created_at")
+    """
+    Bandeja paginada por cursor (ver KeysetPagination): ?limit=&cursor=
+    Filtros: agencia, business, estado, unread=1
+    """
+    qs = ClientesDigitales.objects.only(
+        "id", "telefono", "nombre", "agencia", "business", "estado",
+        "unread_count", "ultimo_msg_preview", "ultimo_msg_at", "ultimo_contacto_at",
     )
+    for campo in ("agencia", "business", "estado"):
+        valor = (request.query_params.get(campo) or "").strip()
+        if valor:
+            qs = qs.filter(**{campo: valor})
+    if request.query_params.get("unread") in ("1", "true"):
+        qs = qs.filter(unread_count__gt=0)
 
-    clientes = (
-        ClientesDigitales.objects
-        .all()
-        .annotate(
-            last_text=Subquery(last_msg_qs.values("body")[:1]),
-            last_time=Subquery(last_msg_qs.values("created_at")[:1]),
-        )
-        .order_by("-ultimo_contacto_at", "-actualizado", "-creado")[:limit]
-    )
+    paginator = ChatsPagination()
+    clientes = paginator.paginate_queryset(qs, request)
 
     data = []
     for c in clientes:
         last_time_str = ""
-        if c.last_time:
-            last_time_str = timezone.localtime(c.last_time).strftime("%I:%M %p").lower()
+        if c.ultimo_msg_at:
+            last_time_str = timezone.localtime(c.ultimo_msg_at).strftime("%I:%M %p").lower()
 
         data.append(
             {
@@ -302,39 +605,189 @@ def chats_list(request):
                 "agencia": c.agencia or "",
                 "linea": c.business or "",
                 "estado": c.estado or "",
-                "unread": _unread_count(c),
-                "last_text": c.last_text or "",
+                "unread": c.unread_count,
+                "last_text": c.ultimo_msg_preview or "",
                 "last_time": last_time_str,
             }
         )
 
-    return Response(data, status=status.HTTP_200_OK)
+    return paginator.get_paginated_response(data)
+
+
+BUSQUEDA_POR_PAGINA = 20
+BUSQUEDA_POR_PAGINA_MAX = 100
+
+
+@api_view(["GET"])
+@permission_classes([AllowAny])
+def buscar_view(request):
+    """
+    Búsqueda en prospectos (nombre, teléfono, correo, auto_interes,
+    comentarios) y en el texto de los mensajes, sin importar acentos.
+    ?q=&tipo=clientes|mensajes (vacío = ambos)&limit=&offset=&telefono=
+    (`telefono` limita los mensajes a un chat). Resultados por relevancia;
+    `siguiente` trae el offset de la siguiente página de cada lista.
+    Solo lee el índice: lo mantiene `manage.py indexar_busqueda --continuo`.
+    """
+    q = (request.query_params.get("q") or "").strip()
+    tipo = request.query_params.get("tipo") or ""
+    try:
+        limit = max(1, min(int(request.query_params.get("limit") or BUSQUEDA_POR_PAGINA), BUSQUEDA_POR_PAGINA_MAX))
+        offset = max(0, int(request.query_params.get("offset") or 0))
+    except ValueError:
+        return Response({"ok": False, "error": "limit/offset inválidos"}, status=status.HTTP_400_BAD_REQUEST)
+
+    res = {"q": q, "clientes": [], "mensajes": [], "siguiente": {"clientes": None, "mensajes": None}}
+    if not q:
+        return Response(res)
+
+    if tipo in ("", "clientes"):
+        ids = busqueda.buscar_clientes(q, limit + 1, offset)
+        clientes = ClientesDigitales.objects.only(
+            "id", "telefono", "nombre", "correo", "agencia", "estado", "auto_interes", "ultimo_contacto_at",
+        ).in_bulk(ids[:limit])
+        res["clientes"] = [
+            {
+                "id": c.id,
+                "telefono": c.telefono,
+                "nombre": c.nombre or "Prospecto",
+                "correo": c.correo,
+                "agencia": c.agencia,
+                "estado": c.estado,
+                "auto_interes": c.auto_interes,
+                "ultimo_contacto_at": c.ultimo_contacto_at,
+            }
+            for c in (clientes.get(pk) for pk in ids[:limit])
+            if c is not None
+        ]
+        if len(ids) > limit:
+            res["siguiente"]["clientes"] = offset + limit
+
+    if tipo in ("", "mensajes"):
+        cliente_id = None
+        tel = normaliza_tel_mx(request.query_params.get("telefono", ""))
+        if tel:
+            cliente_id = ClientesDigitales.objects.filter(telefono=tel).values_list("id", flat=True).first() or -1
+        hits = busqueda.buscar_mensajes(q, limit + 1, offset, cliente_id=cliente_id)
+        msgs = (
+            MensajeWhatsApp.objects
+            .select_related("cliente")
+            .only("id", "telefono", "direction", "created_at", "cliente__nombre")
+            .in_bulk([pk for pk, _ in hits[:limit]])
+        )
+        res["mensajes"] = [
+            {
+                "id": m.id,
+                "telefono": m.telefono,
+                "nombre": (m.cliente.nombre if m.cliente else "") or "Prospecto",
+                "direction": m.direction,
+                "created_at": m.created_at,
+                "fragmento": fragmento,
+            }
+            for m, fragmento in ((msgs.get(pk), fragmento) for pk, fragmento in hits[:limit])
+            if m is not None
+        ]
+        if len(hits) > limit:
+            res["siguiente"]["mensajes"] = offset + limit
+
+    return Response(res)
 
 
 @api_view(["GET"])
 @permission_classes([AllowAny])
 def contacto_por_telefono(request):
+    """
+    Regresa los `limit` mensajes más recientes (en orden cronológico) y un
+    cursor `before` para pedir la página anterior: ?tel=&limit=&before=
+    """
     tel = normaliza_tel_mx(request.query_params.get("tel", ""))
 
     if not tel:
         return Response({"ok": False, "error": "Falta tel"}, status=status.HTTP_400_BAD_REQUEST)
 
+    try:
+        limit = int(request.query_params.get("limit", MENSAJES_POR_PAGINA))
+    except ValueError:
+        limit = MENSAJES_POR_PAGINA
+    limit = max(1, min(limit, MENSAJES_POR_PAGINA_MAX))
+
+    # índice (telefono, created_at): se recorre desde el final
+    mensajes = MensajeWhatsApp.objects.defer("raw").filter(telefono=tel).order_by("-created_at", "-id")
+
+    before = request.query_params.get("before") or ""
+    if before:
+        try:
+            c = decodificar_cursor(before)
+            t = timezone.datetime.fromisoformat(c["t"])
+            mensajes = mensajes.filter(Q(created_at__lt=t) | Q(created_at=t, id__lt=int(c["id"])))
+        except (ValidationError, KeyError, ValueError, TypeError):
+            return Response({"ok": False, "error": "before inválido"}, status=status.HTTP_400_BAD_REQUEST)
+
+    pagina = list(mensajes[: limit + 1])
+    siguiente = None
+    if len(pagina) > limit:
+        pagina = pagina[:limit]
+        siguiente = codificar_cursor({"t": pagina[-1].created_at.isoformat(), "id": pagina[-1].pk})
+    pagina.reverse()
+
     prospecto = ClientesDigitales.objects.filter(telefono=tel).first()
-    mensajes = MensajeWhatsApp.objects.filter(telefono=tel).order_by("created_at")
 
-    if prospecto:
+    # solo al abrir el chat; al hacer scroll hacia atrás no cambia lo leído
+    if prospecto and not before:
         prospecto.mark_read()
 
     return Response(
         {
             "ok": True,
             "prospecto": ClientesDigitalesSerializer(prospecto).data if prospecto else None,
-            "mensajes": WhatsAppMessageSerializer(mensajes, many=True, context={"request": request}).data            
+            "mensajes": WhatsAppMessageListSerializer(pagina, many=True, context={"request": request}).data,
+            "before": siguiente,
         },
         status=status.HTTP_200_OK,
     )
 
 
+@api_view(["GET"])
+@permission_classes([AllowAny])
+def cliente_360_view(request):
+    """
+    Todo lo que hay de un teléfono en el CRM: prospecto(s), citas, citas de
+    piso, pruebas de manejo, expedientes de conformidad y resumen del chat.
+    Cada tabla se consulta por igualdad sobre su teléfono normalizado
+    (indexado), contemplando las formas 52 / 521 del mismo celular.
+    """
+    variantes = variantes_tel_mx(request.query_params.get("telefono", ""))
+    if not variantes:
+        return Response({"ok": False, "error": "Falta telefono"}, status=status.HTTP_400_BAD_REQUEST)
+
+    prospectos = ClientesDigitales.objects.filter(telefono__in=variantes).order_by("-ultimo_contacto_at", "-id")
+    citas = Citas.objects.filter(telefono_norm__in=variantes).order_by("-fecha_hora_cita", "-id")
+    citas_piso = CitasPiso.objects.filter(telefono_norm__in=variantes).order_by("-fecha_hora_cita", "-id")
+    pruebas = PruebasManejo.objects.filter(telefono_norm__in=variantes).order_by("-fecha_hora_cita", "-id")
+    expedientes = (
+        ExpedienteConformidad.objects
+        .filter(cliente__telefono_norm__in=variantes)
+        .select_related("cliente")
+        .prefetch_related("documentos")
+        .order_by("-id_exp")
+    )
+    chat = MensajeWhatsApp.objects.filter(telefono__in=variantes).aggregate(
+        total=Count("id"),
+        ultimo_at=Max("created_at"),
+    )
+
+    return Response({
+        "ok": True,
+        "telefono": variantes[0],
+        "prospectos": ClientesDigitalesSerializer(prospectos, many=True).data,
+        "citas": CitasSerializer(citas, many=True).data,
+        "citas_piso": CitasPisoSerializer(citas_piso, many=True).data,
+        "pruebas_manejo": PruebasManejoSerializer(pruebas, many=True).data,
+        "conformidad": CasoSerializer(expedientes, many=True, context={"request": request}).data,
+        "mensajes": chat,
+    })
+
+
 @api_view(["POST"])
 @permission_classes([AllowAny])
 def mark_read_view(request):
@@ -359,48 +812,27 @@ def enviar_mensaje_view(request):
     if not to or not text:
         return Response({"ok": False, "error": "Falta to o text"}, status=status.HTTP_400_BAD_REQUEST)
 
-    now = timezone.now()
-
+    # solo se guarda en el outbox; los workers de .outbox hablan con Meta
     try:
-        cliente, _ = ClientesDigitales.objects.get_or_create(
-            telefono=to,
-            defaults={"primer_contacto_at": None, "ultimo_contacto_at": None},
-        )
-
-        wa_res = enviar_texto_whatsapp(to=to, text=text)
-
-        update_fields = []
-        if not cliente.primer_contacto_at:
-            cliente.primer_contacto_at = now
-            update_fields.append("primer_contacto_at")
-
-        cliente.ultimo_contacto_at = now
-        update_fields.append("ultimo_contacto_at")
+        msg = encolar_texto(to, text)
+    except Exception as e:
+        return Response({"ok": False, "error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-        if update_fields:
-            update_fields.append("actualizado")
-            cliente.save(update_fields=update_fields)
+    return Response(
+        {"ok": True, "id": msg.pk, "status": msg.status, "mensaje": WhatsAppMessageListSerializer(msg).data},
+        status=status.HTTP_202_ACCEPTED,
+    )
 
-        wa_message_id = ""
-        try:
-            wa_message_id = (wa_res.get("messages") or [{}])[0].get("id", "") or ""
-        except Exception:
-            wa_message_id = ""
 
-        MensajeWhatsApp.objects.create(
-            telefono=to,
-            cliente=cliente,
-            direction="out",
-            body=text,
-            wa_message_id=wa_message_id,
-            status="accepted",
-            raw=wa_res,
-        )
+# subidas simultáneas a Graph (pool compartido por todo el proceso)
+MEDIA_HILOS = int(getattr(settings, "WHATSAPP_MEDIA_HILOS", 4))
 
-        return Response({"ok": True, "data": wa_res}, status=status.HTTP_200_OK)
 
-    except Exception as e:
-        return Response({"ok": False, "error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+def _subir_archivo(f, hasta: float) -> tuple[str, str, dict]:
+    name = getattr(f, "name", "archivo")
+    ct = getattr(f, "content_type", "") or (mimetypes.guess_type(name)[0] or "")
+    up = subir_media_whatsapp(f, filename=name, content_type=ct, hasta=hasta)
+    return ct, tipo_por_mime(ct), up
 
 
 @api_view(["POST"])
@@ -415,6 +847,9 @@ def enviar_media_view(request):
 
     Envía 1 mensaje por archivo (WhatsApp style).
     """
+    # los archivos van a disco por chunks y se cortan al pasar el límite de WhatsApp
+    limite = usar_subida_en_disco(request)
+
     to = normaliza_tel_mx(request.data.get("to", ""))
     caption = (request.data.get("text") or "").strip()
     files = request.FILES.getlist("files") or []
@@ -422,6 +857,8 @@ def enviar_media_view(request):
     if not to:
         return Response({"ok": False, "error": "Falta to"}, status=status.HTTP_400_BAD_REQUEST)
     if not files:
+        if limite.rechazados:
+            return Response({"ok": False, "error": "Archivos demasiado grandes", "failed": limite.rechazados}, status=status.HTTP_400_BAD_REQUEST)
         return Response({"ok": False, "error": "Faltan files"}, status=status.HTTP_400_BAD_REQUEST)
 
     now = timezone.now()
@@ -436,37 +873,32 @@ def enviar_media_view(request):
     cliente.ultimo_contacto_at = now
     cliente.save(update_fields=["primer_contacto_at", "ultimo_contacto_at", "actualizado"])
 
+    # un solo plazo para todo el request: subidas y envíos no esperan cupo en
+    # Graph más allá de él (el archivo que no alcance sale en `failed`)
+    hasta = plazo_interactivo()
+
+    # 1) subir todo en paralelo; 2) enviar en el orden original conforme
+    # terminan las subidas, para que WhatsApp muestre las fotos en secuencia
+    subidas = [en_segundo_plano("wa-media-upload", _subir_archivo, f, hasta, max_workers=MEDIA_HILOS) for f in files]
+
     sent = []
-    failed = []
+    failed = list(limite.rechazados)
 
-    for f in files:
+    for f, subida in zip(files, subidas):
+        name = getattr(f, "name", "archivo")
         try:
-            name = getattr(f, "name", "archivo")
-            ct = getattr(f, "content_type", "") or (mimetypes.guess_type(name)[0] or "")
-
-            # decide tipo WhatsApp por mime
-            if (ct or "").startswith("image/"):
-                wtype = "image"
-            elif (ct or "").startswith("video/"):
-                wtype = "video"
-            elif (ct or "").startswith("audio/"):
-                wtype = "audio"
-            else:
-                wtype = "document"
-
-            # 1) subir
-            up = subir_media_whatsapp(f, filename=name, content_type=ct)
+            ct, wtype, up = subida.result()
             media_id = up.get("id") or ""
             if not media_id:
                 raise RuntimeError(f"No regresó media_id: {up}")
 
-            # 2) enviar
             wa_res = enviar_media_whatsapp(
                 to=to,
                 media_id=media_id,
                 media_type=wtype,
                 caption=caption if caption else "",
                 filename=name if wtype == "document" else "",
+                hasta=hasta,
             )
 
             wa_message_id = ""
@@ -482,13 +914,18 @@ def enviar_media_view(request):
             else:
                 body = f"[FILE:{name}]"
 
-            MensajeWhatsApp.objects.create(
+            msg = MensajeWhatsApp(
                 telefono=to,
                 cliente=cliente,
                 direction="out",
                 body=body,
                 wa_message_id=wa_message_id,
                 status="accepted",
+                media_id=media_id,
+                media_mime=ct,
+                media_size=getattr(f, "size", None),
+                media_tipo=wtype,
+                media_nombre=name[:255],
                 raw={
                     "upload": up,
                     "send": wa_res,
@@ -497,11 +934,16 @@ def enviar_media_view(request):
                     "content_type": ct,
                 },
             )
+            # se guarda en cuanto Meta lo acepta: si el request muere con
+            # archivos pendientes, lo ya enviado no se queda sin fila
+            msg.save()
+            ClientesDigitales.registrar_envios([msg], when=now)
+            publicar_mensajes([msg])
 
             sent.append({"filename": name, "type": wtype, "data": wa_res})
 
         except Exception as e:
-            failed.append({"filename": getattr(f, "name", "archivo"), "error": str(e)})
+            failed.append({"filename": name, "error": str(e)})
 
     return Response({"ok": True, "sent": sent, "failed": failed}, status=status.HTTP_200_OK)
 
@@ -542,6 +984,7 @@ def enviar_plantilla_view(request):
             params=[str(x) for x in (params or [])],
             idioma=idioma,
             components=components,
+            hasta=plazo_interactivo(),
         )
 
         wa_message_id = ""
@@ -564,7 +1007,7 @@ def enviar_plantilla_view(request):
         else:
             body_log += " " + " | ".join([str(x) for x in (params or [])])
 
-        MensajeWhatsApp.objects.create(
+        msg = MensajeWhatsApp.objects.create(
             telefono=to,
             cliente=cliente,
             direction="out",
@@ -573,12 +1016,14 @@ def enviar_plantilla_view(request):
             status="accepted",
             raw=wa_res,
         )
+        cliente.registrar_ultimo_mensaje(msg)
+        publicar_mensajes([msg])
 
         return Response({"ok": True, "data": wa_res}, status=status.HTTP_200_OK)
 
     except Exception as e:
         # si truena, también log
-        MensajeWhatsApp.objects.create(
+        msg = MensajeWhatsApp.objects.create(
             telefono=to,
             cliente=cliente if "cliente" in locals() else None,
             direction="out",
@@ -587,8 +1032,61 @@ def enviar_plantilla_view(request):
             status="failed",
             raw={"error": str(e)},
         )
+        if msg.cliente:
+            msg.cliente.registrar_ultimo_mensaje(msg)
+        publicar_mensajes([msg])
         return Response({"ok": False, "error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+@api_view(["POST"])
+@permission_classes([AllowAny])
+def campana_enviar_view(request):
+    template_name = (request.data.get("template_name") or "").strip()
+    idioma = (request.data.get("idioma") or "es_MX").strip()
+    params = request.data.get("params") or []
+    filtro = request.data.get("filtro") or {}
+
+    if not template_name:
+        return Response({"ok": False, "error": "Falta template_name"}, status=status.HTTP_400_BAD_REQUEST)
+    if not isinstance(params, list):
+        return Response({"ok": False, "error": "params debe ser lista"}, status=status.HTTP_400_BAD_REQUEST)
+    if not isinstance(filtro, dict):
+        return Response({"ok": False, "error": "filtro debe ser objeto"}, status=status.HTTP_400_BAD_REQUEST)
+
+    campana = crear_campana(template_name, idioma, params, filtro)
+    if campana.total:
+        lanzar_campana(campana.pk)
+
+    return Response({"ok": True, "campana": CampanaEnvioSerializer(campana).data}, status=status.HTTP_202_ACCEPTED)
+
+
+@api_view(["GET"])
+@permission_classes([AllowAny])
+def campana_detalle_view(request, pk: int):
+    campana = CampanaEnvio.objects.filter(pk=pk).first()
+    if not campana:
+        return Response({"ok": False, "error": "Campaña no encontrada"}, status=status.HTTP_404_NOT_FOUND)
+
+    data = {"ok": True, "campana": CampanaEnvioSerializer(campana).data}
+    if request.query_params.get("detalle") == "1":
+        qs = campana.destinatarios.order_by("id")
+        if request.query_params.get("estado"):
+            qs = qs.filter(estado=request.query_params["estado"])
+        data["destinatarios"] = CampanaEnvioDestinatarioSerializer(qs[:1000], many=True).data
+    return Response(data, status=status.HTTP_200_OK)
+
+
+@api_view(["POST"])
+@permission_classes([AllowAny])
+def campana_cancelar_view(request, pk: int):
+    n = CampanaEnvio.objects.filter(
+        pk=pk,
+        estado__in=[CampanaEnvio.Estado.PENDIENTE, CampanaEnvio.Estado.ENVIANDO],
+    ).update(estado=CampanaEnvio.Estado.CANCELADA, terminado_at=timezone.now())
+    if not n:
+        return Response({"ok": False, "error": "La campaña no está en curso"}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({"ok": True}, status=status.HTTP_200_OK)
+
+
 @api_view(["GET"])
 @permission_classes([AllowAny])
 def campanas_meta_recientes(request):
@@ -641,6 +1139,7 @@ def editar_mensaje_view(request):
             to=to,
             original_message_id=message_id,
             new_text=text,
+            hasta=plazo_interactivo(),
         )
 
         # actualiza tu BD (marcar editado)
@@ -648,7 +1147,8 @@ def editar_mensaje_view(request):
         raw = dict(msg.raw or {})
         raw["edit_response"] = wa_res
         msg.raw = raw
-        msg.save(update_fields=["body", "raw", "actualizado"])
+        msg.save(update_fields=["body", "raw"])
+        busqueda.reindexar_mensaje(msg)
 
         return Response({"ok": True, "data": wa_res}, status=200)
 
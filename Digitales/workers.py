@@ -0,0 +1,80 @@
+# digitales/workers.py
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class Despachador:
+    """
+    Hilos daemon que ejecutan `fn` cada vez que alguien los despierta
+    (o cada `intervalo` segundos, para recoger lo que haya quedado pendiente).
+
+    `fn` debe drenar su cola hasta vaciarla y ser segura de correr en
+    varios hilos a la vez (cada hilo reclama su trabajo de forma atómica).
+    """
+
+    def __init__(self, nombre: str, fn, hilos: int = 1, intervalo: float = 5.0):
+        self.nombre = nombre
+        self.fn = fn
+        self.hilos = max(1, int(hilos))
+        self.intervalo = intervalo
+        self._evento = threading.Event()
+        self._lock = threading.Lock()
+        self._threads: list[threading.Thread] = []
+
+    def iniciar(self):
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            for i in range(len(self._threads), self.hilos):
+                t = threading.Thread(
+                    target=self._loop,
+                    name=f"{self.nombre}-{i}",
+                    daemon=True,
+                )
+                t.start()
+                self._threads.append(t)
+
+    def despertar(self):
+        self.iniciar()
+        self._evento.set()
+
+    def _loop(self):
+        while True:
+            self._evento.wait(self.intervalo)
+            self._evento.clear()
+            try:
+                close_old_connections()
+                self.fn()
+            except Exception:
+                logger.exception("Despachador %s: fallo drenando la cola", self.nombre)
+            finally:
+                close_old_connections()
+
+
+_pools: dict[str, ThreadPoolExecutor] = {}
+_pools_lock = threading.Lock()
+
+
+def _con_conexion_limpia(fn, *args, **kwargs):
+    # cada hilo del pool abre su propia conexión a BD; se cierra al terminar la tarea
+    try:
+        close_old_connections()
+        return fn(*args, **kwargs)
+    except Exception:
+        logger.exception("Tarea en segundo plano %s falló", getattr(fn, "__name__", fn))
+        raise
+    finally:
+        close_old_connections()
+
+
+def en_segundo_plano(pool: str, fn, *args, max_workers: int = 2, **kwargs) -> Future:
+    """Ejecuta `fn` en un ThreadPoolExecutor compartido por nombre (acotado a `max_workers`)."""
+    with _pools_lock:
+        ex = _pools.get(pool)
+        if ex is None:
+            ex = _pools[pool] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=pool)
+    return ex.submit(_con_conexion_limpia, fn, *args, **kwargs)
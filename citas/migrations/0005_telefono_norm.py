@@ -0,0 +1,56 @@
+# Generated by Django 5.2.5 on 2026-10-18 15:53
+
+from django.db import migrations, models
+
+
+def normaliza_tel_mx(raw):
+    # copia de Digitales.models.normaliza_tel_mx al momento de esta migración:
+    # las migraciones no importan código de la app, que puede cambiar después
+    digits = "".join(c for c in str(raw or "") if c.isdigit())
+    if not digits:
+        return ""
+    if len(digits) == 10:
+        return "52" + digits
+    if len(digits) == 12 and digits.startswith("52"):
+        return digits
+    return digits
+
+
+def llenar_telefono_norm(apps, schema_editor):
+    for nombre in ("Citas", "CitasPiso", "PruebasManejo"):
+        Modelo = apps.get_model("citas", nombre)
+        lote = []
+        for obj in Modelo.objects.only("id", "telefono").iterator(chunk_size=2000):
+            obj.telefono_norm = normaliza_tel_mx(obj.telefono)
+            lote.append(obj)
+            if len(lote) >= 500:
+                Modelo.objects.bulk_update(lote, ["telefono_norm"])
+                lote = []
+        if lote:
+            Modelo.objects.bulk_update(lote, ["telefono_norm"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('citas', '0004_citaspiso_pruebasmanejo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='citas',
+            name='telefono_norm',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='citaspiso',
+            name='telefono_norm',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='pruebasmanejo',
+            name='telefono_norm',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=32),
+        ),
+        migrations.RunPython(llenar_telefono_norm, migrations.RunPython.noop),
+    ]
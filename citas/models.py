@@ -2,9 +2,12 @@
 from django.db import models
 from django.utils import timezone
 
-class Citas(models.Model):
+from ryrback.telefonos import TelefonoNormMixin
+
+class Citas(TelefonoNormMixin, models.Model):
     nombre = models.CharField(max_length=200, blank=True, default="")
     telefono = models.CharField(max_length=32, db_index=True, unique=False)
+    telefono_norm = models.CharField(max_length=32, blank=True, default="", db_index=True, editable=False)
     correo = models.CharField(max_length=200, blank=True, default="")
     auto_interes = models.CharField(max_length=255, blank=True, default="")
     agencia = models.CharField(max_length=120, blank=True, default="")
@@ -36,9 +39,10 @@ class Citas(models.Model):
         return f"{self.nombre} ({self.telefono})".strip()
 
 
-class CitasPiso(models.Model):
+class CitasPiso(TelefonoNormMixin, models.Model):
     nombre = models.CharField(max_length=200, blank=True, default="")
     telefono = models.CharField(max_length=32, db_index=True, unique=False)
+    telefono_norm = models.CharField(max_length=32, blank=True, default="", db_index=True, editable=False)
     correo = models.CharField(max_length=200, blank=True, default="")
     auto_interes = models.CharField(max_length=255, blank=True, default="")
     agencia = models.CharField(max_length=120, blank=True, default="")
@@ -59,9 +63,10 @@ class CitasPiso(models.Model):
     def __str__(self):
         return f"{self.nombre} ({self.telefono})".strip()
 
-class PruebasManejo(models.Model):
+class PruebasManejo(TelefonoNormMixin, models.Model):
     nombre = models.CharField(max_length=200, blank=True, default="")
     telefono = models.CharField(max_length=32, db_index=True, unique=False)
+    telefono_norm = models.CharField(max_length=32, blank=True, default="", db_index=True, editable=False)
     correo = models.CharField(max_length=200, blank=True, default="")
     auto_interes = models.CharField(max_length=255, blank=True, default="")
     agencia = models.CharField(max_length=120, blank=True, default="")
@@ -7,15 +7,18 @@ class CitasSerializer(serializers.ModelSerializer):
     class Meta:
         model = Citas
         fields = "__all__"
+        read_only_fields = ["telefono_norm"]
 
 
 class CitasPisoSerializer(serializers.ModelSerializer):
     class Meta:
         model = CitasPiso
         fields = "__all__"
+        read_only_fields = ["telefono_norm"]
 
 
 class PruebasManejoSerializer(serializers.ModelSerializer):
     class Meta:
         model = PruebasManejo
-        fields = "__all__"
\ No newline at end of file
+        fields = "__all__"
+        read_only_fields = ["telefono_norm"]
\ No newline at end of file
@@ -1,3 +1,25 @@
 from django.test import TestCase
 
-# Create your tests here.
+from .models import Citas
+from .serializers import CitasSerializer
+
+
+class TelefonoNormTests(TestCase):
+    def test_save_y_caminos_en_bloque(self):
+        cita = Citas.objects.create(telefono="55 1234 5678")
+        self.assertEqual(cita.telefono_norm, "525512345678")
+
+        [otra] = Citas.objects.bulk_create([Citas(telefono="(55) 8765-4321")])
+        self.assertEqual(Citas.objects.get(pk=otra.pk).telefono_norm, "525587654321")
+
+        cita.telefono = "5511112222"
+        Citas.objects.bulk_update([cita], ["telefono"])
+        self.assertEqual(Citas.objects.get(pk=cita.pk).telefono_norm, "525511112222")
+
+        Citas.objects.filter(pk=cita.pk).update(telefono="55 3333 4444")
+        self.assertEqual(Citas.objects.get(pk=cita.pk).telefono_norm, "525533334444")
+
+    def test_serializer_no_escribe_telefono_norm(self):
+        s = CitasSerializer(data={"telefono": "5512345678", "telefono_norm": "999"})
+        self.assertTrue(s.is_valid(), s.errors)
+        self.assertEqual(s.save().telefono_norm, "525512345678")
@@ -5,6 +5,31 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+The WhatsApp chat stream (digitales/contacto/stream/, Server-Sent Events)
+holds one connection per open chat, so only that path should be served
+through this entry point. Keep the rest of the API on WSGI and split at the
+proxy, e.g. with nginx:
+
+    location /digitales/contacto/stream/ {
+        proxy_pass http://127.0.0.1:8001;   # uvicorn ryrback.asgi:application
+        proxy_buffering off;
+        proxy_read_timeout 1h;
+    }
+    location / {
+        proxy_pass http://127.0.0.1:8000;   # gunicorn ryrback.wsgi:application
+    }
+
+Serving everything through ASGI is not a good trade: all sync views share
+a single thread-sensitive executor per worker (one request at a time), and
+streaming responses such as the media proxy are buffered in memory.
+
+Events reach the stream from any process on the same machine: publishers
+(the WSGI workers, the inbox and outbox threads, campaigns, management
+commands) append to a small SQLite log in WHATSAPP_SPOOL_DIR, and the
+ASGI process polls it every WHATSAPP_EVENTOS_POLL seconds (see
+Digitales/eventos.py). Both sides must share that spool directory; running
+the web tier on several hosts needs a shared pub/sub (e.g. Redis) instead.
 """
 
 import os
@@ -103,6 +103,7 @@ CORS_ALLOWED_ORIGINS = [
     "https://www.grupoautomotrizryr.com",
     "https://crm.grupoautomotrizryr.com",
 ]
+CORS_EXPOSE_HEADERS = ["X-Next-Cursor"]
 
 
 DATABASES = {
@@ -175,10 +176,78 @@ USE_TZ = True
 STATIC_URL = 'static/'
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
+# Tope por documento en los expedientes de conformidad
+CRM_DOCS_MAX_MB = 50
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
-DEFAULT_FROM_EMAIL = "no-reply@crm.local"
\ No newline at end of file
+DEFAULT_FROM_EMAIL = "no-reply@crm.local"
+
+# WhatsApp (Digitales)
+# Inbox local del webhook: Meta recibe el 200 en cuanto el payload queda en disco.
+WHATSAPP_SPOOL_DIR = BASE_DIR / "spool"
+WHATSAPP_INBOX_HILOS = 2
+WHATSAPP_INBOX_LOTE = 50
+# SSE de chats: cada cuántos segundos un stream abierto revisa BD por mensajes
+# guardados en otro proceso (0 = solo pub/sub en proceso).
+WHATSAPP_SSE_RESYNC = 60
+# Cliente de Graph API: conexiones keep-alive por proceso, timeouts (s) y reintentos.
+WHATSAPP_GRAPH_POOL = 10
+WHATSAPP_GRAPH_CONNECT_TIMEOUT = 5
+WHATSAPP_GRAPH_TIMEOUT = 20
+WHATSAPP_GRAPH_MEDIA_TIMEOUT = 45
+WHATSAPP_GRAPH_RETRIES = 3
+WHATSAPP_GRAPH_BACKOFF = 0.5
+# Límite compartido entre procesos (token bucket en SQLite local) y reintentos
+# cuando Meta responde con throttling (130429, 131056, ...).
+WHATSAPP_RATE_DB = WHATSAPP_SPOOL_DIR / "graph_rate.sqlite3"
+WHATSAPP_GRAPH_MPS = 80
+WHATSAPP_GRAPH_MEDIA_RPS = 20
+WHATSAPP_GRAPH_THROTTLE_RETRIES = 5
+WHATSAPP_GRAPH_THROTTLE_MAX = 60
+# enviar_media_view: subidas de archivos en paralelo por proceso.
+WHATSAPP_MEDIA_HILOS = 4
+# Tope por archivo (bytes) al subir media; por defecto los límites de WhatsApp
+# (image 5 MB, video/audio 16 MB, document 100 MB).
+# WHATSAPP_MEDIA_LIMITES = {"video": 16 * 1024 * 1024}
+# Caché en disco de la media que se sirve en /digitales/media/<id>/ (LRU por tamaño).
+WHATSAPP_MEDIA_CACHE_DIR = MEDIA_ROOT / "wa_cache"
+WHATSAPP_MEDIA_CACHE_MB = 2048
+# Info de media (URL de descarga, mime, tamaño): la URL de Meta vence a los ~5 min.
+WHATSAPP_MEDIA_INFO_TTL = 240
+# Precarga de media entrante al procesar el webhook (pool acotado de descargas).
+WHATSAPP_MEDIA_PRECARGA = True
+WHATSAPP_MEDIA_PRECARGA_HILOS = 2
+# Outbox de salientes: workers, reintentos (solo errores de conexión / 429 / 5xx)
+# y backoff en segundos.
+WHATSAPP_OUTBOX_HILOS = 4
+WHATSAPP_OUTBOX_INTENTOS = 5
+WHATSAPP_OUTBOX_BACKOFF = 5
+WHATSAPP_OUTBOX_BACKOFF_MAX = 300
+# Miniaturas del chat (Pillow; portada de video solo si hay ffmpeg en el PATH).
+WHATSAPP_THUMB_LADO = 320
+WHATSAPP_THUMB_CALIDAD = 70
+# Campañas de plantillas: hilos de envío, mensajes por segundo y tamaño de lote.
+WHATSAPP_CAMPANA_HILOS = 8
+WHATSAPP_CAMPANA_MPS = 20
+WHATSAPP_CAMPANA_LOTE = 200
+# Búsqueda (índice FTS5 local, se sincroniza con la BD cada N segundos).
+WHATSAPP_BUSQUEDA_DB = WHATSAPP_SPOOL_DIR / "busqueda.sqlite3"
+WHATSAPP_BUSQUEDA_INTERVALO = 15
+# Importación masiva de prospectos (CSV / XLSX / JSONL): filas por lote y tope del archivo.
+PROSPECTOS_IMPORT_LOTE = 1000
+PROSPECTOS_IMPORT_MAX_MB = 50
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "Digitales": {"handlers": ["console"], "level": "INFO"},
+    },
+}
@@ -0,0 +1,81 @@
+# ryrback/telefonos.py
+"""
+Normalización de teléfonos compartida por las apps (Digitales, citas,
+CrmConformidad): ninguna depende de otra para tener `telefono_norm`.
+"""
+from django.db import models
+
+
+def normaliza_tel_mx(raw: str) -> str:
+    digits = "".join(c for c in str(raw or "") if c.isdigit())
+    if not digits:
+        return ""
+    if len(digits) == 10:
+        return "52" + digits
+    if len(digits) == 12 and digits.startswith("52"):
+        return digits
+    return digits
+
+
+def variantes_tel_mx(raw: str) -> list[str]:
+    """
+    Formas normalizadas con las que puede estar guardado el mismo celular:
+    WhatsApp manda 521 + 10 dígitos y los formularios 52 + 10.
+    """
+    tel = normaliza_tel_mx(raw)
+    if len(tel) == 13 and tel.startswith("521"):
+        return [tel, "52" + tel[3:]]
+    if len(tel) == 12 and tel.startswith("52"):
+        return [tel, "521" + tel[2:]]
+    return [tel] if tel else []
+
+
+class TelefonoNormQuerySet(models.QuerySet):
+    """
+    Los caminos en bloque no pasan por save(): aquí también se calcula
+    `telefono_norm` en bulk_create, bulk_update y update(telefono=...).
+    """
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            obj.telefono_norm = normaliza_tel_mx(obj.telefono)
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        if "telefono" in fields:
+            objs = list(objs)
+            for obj in objs:
+                obj.telefono_norm = normaliza_tel_mx(obj.telefono)
+            fields = [*{*fields, "telefono_norm"}]
+        return super().bulk_update(objs, fields, *args, **kwargs)
+
+    def update(self, **kwargs):
+        if "telefono" in kwargs:
+            if isinstance(kwargs["telefono"], str):
+                kwargs["telefono_norm"] = normaliza_tel_mx(kwargs["telefono"])
+            elif "telefono_norm" not in kwargs:
+                # una expresión (F, Concat...) no se puede normalizar aquí;
+                # bulk_update sí llega con las dos columnas ya calculadas
+                raise ValueError("update(telefono=...) necesita un valor: telefono_norm se calcula en Python")
+        return super().update(**kwargs)
+
+
+class TelefonoNormMixin(models.Model):
+    """
+    Para tablas con `telefono` de texto libre: mantiene `telefono_norm`
+    (normaliza_tel_mx, indexado) para buscar por igualdad entre tablas,
+    en save() y en los caminos en bloque del manager.
+    """
+
+    objects = TelefonoNormQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        self.telefono_norm = normaliza_tel_mx(self.telefono)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "telefono" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "telefono_norm"}
+        super().save(*args, **kwargs)
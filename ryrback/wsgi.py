@@ -14,3 +14,15 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ryrback.settings')
 
 application = get_wsgi_application()
+
+# Workers del outbox y del inbox en cada proceso web: los reintentos
+# programados salen aunque nadie vuelva a encolar después de un reinicio
+# (ver Digitales/outbox.py e inbox.py). Con WHATSAPP_WORKERS_EN_WEB = False
+# hay que correr `manage.py procesar_outbox` y `procesar_webhooks`.
+from django.conf import settings  # noqa: E402
+
+if getattr(settings, "WHATSAPP_WORKERS_EN_WEB", True):
+    from Digitales import inbox, outbox  # noqa: E402
+
+    outbox.despachador.iniciar()
+    inbox.despachador.iniciar()